@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Programmatic benchmarks of workflow steps on synthetic data."""
+
+# pylint: disable=invalid-name
+
+import argparse
+import os
+
+import pandas as pd
+
+from src.benchmark import (
+    compare_benchmarks,
+    get_benchmark_fpath,
+    read_benchmark_results,
+    run_benchmark,
+    write_benchmark_results,
+)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        dest="scales",
+        default=[10_000, 100_000],
+        help="numbers of infractions in synthetic snapshots (10k to 50M)",
+    )
+    parser.add_argument(
+        "--work-dir",
+        type=str,
+        dest="work_dir",
+        default="data/benchmarks",
+        help="directory to store synthetic snapshots and databases",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        dest="output_dir",
+        default="reports/benchmarks",
+        help="directory to store results (one file per git commit)",
+    )
+    parser.add_argument(
+        "--load-uri",
+        type=str,
+        dest="load_uri",
+        default=None,
+        help="database URI to append infractions to (default: SQLite)",
+    )
+    parser.add_argument(
+        "--db-uri",
+        type=str,
+        dest="db_uri",
+        default=None,
+        help="database URI to aggregate infractions in (default: DuckDB)",
+    )
+    parser.add_argument(
+        "--baseline",
+        type=str,
+        dest="baseline",
+        default=None,
+        help="git commit (or results file) to compare results with",
+    )
+    args = parser.parse_args()
+
+    # Baseline is read first, in case it is overwritten by the results
+    df_baseline = None
+    if args.baseline:
+        df_baseline = read_benchmark_results(
+            args.baseline
+            if os.path.exists(args.baseline)
+            else get_benchmark_fpath(args.baseline, args.output_dir)
+        )
+
+    df_results = pd.concat(
+        [
+            run_benchmark(
+                num_infractions, args.work_dir, args.load_uri, args.db_uri
+            )
+            for num_infractions in args.scales
+        ],
+        ignore_index=True,
+    )
+    results_fpath = write_benchmark_results(df_results, args.output_dir)
+    print(
+        df_results[
+            [
+                "num_infractions",
+                "name",
+                "wall_seconds",
+                "cpu_seconds",
+                "peak_rss_mb",
+                "rows_in",
+                "rows_out",
+                "db_round_trips",
+            ]
+        ].to_string(index=False)
+    )
+    print(f"Saved results to {results_fpath}")
+    if df_baseline is not None:
+        print(compare_benchmarks(df_results, df_baseline).to_string())
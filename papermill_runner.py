@@ -7,12 +7,18 @@
 # pylint: disable=invalid-name
 
 import argparse
+import hashlib
+import json
 import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime
-from typing import Dict, List
+from glob import glob
+from typing import Dict, List, Optional
 
 import papermill as pm
 
+from src.snapshot_cache import get_file_hash
+
 PROJ_ROOT_DIR = os.getcwd()
 data_dir = os.path.join(PROJ_ROOT_DIR, "data")
 output_notebook_dir = os.path.join(PROJ_ROOT_DIR, "executed_notebooks")
@@ -31,6 +37,47 @@ seven_dict_nb_name = "7_feat_engineering.ipynb"
 eight_dict_nb_name = "8_ml.ipynb"
 nine_dict_nb_name = "9_delete_all_v2.ipynb"
 
+# Notebooks that must be executed before each notebook (if both are run)
+NOTEBOOK_DEPENDENCIES = {
+    one_dict_nb_name: [],
+    two_dict_nb_name: [one_dict_nb_name],
+    three_dict_nb_name: [two_dict_nb_name],
+    one_v2_dict_nb_name: [],
+    two_v2_dict_nb_name: [one_v2_dict_nb_name],
+    three_v2_dict_nb_name: [two_v2_dict_nb_name],
+    nine_dict_nb_name: [
+        one_v2_dict_nb_name,
+        two_v2_dict_nb_name,
+        three_v2_dict_nb_name,
+    ],
+    # Local processed (.csv) and raw data are deleted by nine_dict_nb_name,
+    # so the notebooks creating or reading these files are run after it
+    zero_dict_nb_name: [nine_dict_nb_name],
+    four_dict_nb_name: [zero_dict_nb_name, three_dict_nb_name],
+    seven_dict_nb_name: [four_dict_nb_name],
+    eight_dict_nb_name: [seven_dict_nb_name],
+}
+
+# Data files read by each notebook (glob patterns, relative to the project
+# directory), so that notebooks are re-executed if their inputs changed
+NOTEBOOK_INPUTS = {
+    zero_dict_nb_name: [
+        "data/processed/filtered_transformed_filledmissing_data__*.zip"
+    ],
+    one_dict_nb_name: ["data/raw/*/dinesafe.xml"],
+    one_v2_dict_nb_name: ["data/raw/*/dinesafe.xml"],
+    three_dict_nb_name: ["data/processed/filtered_transformed_data__*.csv"],
+    three_v2_dict_nb_name: ["data/processed/filtered_transformed_data__*.csv"],
+    # Neighbourhood boundaries and profiles are cached CKAN responses
+    four_dict_nb_name: [
+        "data/processed/filtered_transformed_filledmissing_data__*.csv",
+        "data/raw/ckan_cache/*.body",
+        "data/raw/*/Major_Crime_Indicators.shp",
+    ],
+    seven_dict_nb_name: ["data/processed/processed__*.csv"],
+    eight_dict_nb_name: ["data/processed/processed_with_features__*.csv"],
+}
+
 zero_dict = dict(
     dload_fpath=(
         "data/processed/filtered_transformed_filledmissing_data__"
@@ -147,14 +194,72 @@ def papermill_run_notebook(
         )
 
 
+def get_notebook_key(
+    notebook: str,
+    nb_params: Dict,
+    dependency_keys: List[str],
+    input_patterns: Optional[List[str]] = None,
+) -> str:
+    """Get hash of notebook, its parameters, source code and dependencies."""
+    key = hashlib.sha256()
+    key.update(get_file_hash(notebook).encode("utf-8"))
+    key.update(json.dumps(nb_params, sort_keys=True).encode("utf-8"))
+    # Notebooks import modules from src
+    for fpath in sorted(glob("src/**/*.py", recursive=True)):
+        key.update(get_file_hash(fpath).encode("utf-8"))
+    # Data files can be large, so they are compared by size and modification
+    # time instead of by hash
+    for pattern in input_patterns or []:
+        for fpath in sorted(glob(pattern, recursive=True)):
+            stat = os.stat(fpath)
+            key.update(
+                f"{fpath}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")
+            )
+    for dependency_key in dependency_keys:
+        key.update(dependency_key.encode("utf-8"))
+    return key.hexdigest()
+
+
+def read_notebook_state(state_fpath: str) -> Dict:
+    """Get keys of notebooks executed in earlier runs."""
+    if os.path.exists(state_fpath):
+        with open(state_fpath) as f:
+            return json.load(f)
+    return {}
+
+
+def write_notebook_state(state: Dict, state_fpath: str) -> None:
+    """Save keys of executed notebooks."""
+    tmp_fpath = f"{state_fpath}.tmp"
+    with open(tmp_fpath, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_fpath, state_fpath)
+
+
 def run_notebooks(
-    notebooks_list: List, output_notebook_directory: str = "executed_notebooks"
+    notebooks_list: List,
+    output_notebook_directory: str = "executed_notebooks",
+    dependencies: Optional[Dict[str, List[str]]] = None,
+    max_workers: Optional[int] = None,
+    force: bool = False,
+    inputs: Optional[Dict[str, List[str]]] = None,
 ) -> None:
-    """Execute notebooks from CLI.
+    """Execute notebooks from CLI, in order of their dependencies.
     Parameters
     ----------
     nb_dict : List
         list of notebooks to be executed
+    dependencies : Dict
+        names of notebooks to be executed before each notebook (by default,
+        NOTEBOOK_DEPENDENCIES)
+    max_workers : int
+        number of notebooks executed at the same time (by default, number of
+        processors)
+    force : bool
+        whether to execute notebooks with unchanged inputs
+    inputs : Dict
+        glob patterns of data files read by each notebook (by default,
+        NOTEBOOK_INPUTS)
     Usage
     -----
     > import os
@@ -167,10 +272,93 @@ def run_notebooks(
           ]
       )
     """
-    for nb in notebooks_list:
-        papermill_run_notebook(
-            nb_dict=nb, output_notebook_directory=output_notebook_directory
-        )
+    # Empty dictionaries are used as given (no dependencies or inputs)
+    dependencies = (
+        NOTEBOOK_DEPENDENCIES if dependencies is None else dependencies
+    )
+    inputs = NOTEBOOK_INPUTS if inputs is None else inputs
+    nb_dicts = {
+        notebook: nb_params
+        for nb in notebooks_list
+        for notebook, nb_params in nb.items()
+    }
+    notebooks = {os.path.basename(notebook): notebook for notebook in nb_dicts}
+    # Only dependencies on notebooks in this run are used
+    upstream = {
+        nb_name: [d for d in dependencies.get(nb_name, []) if d in notebooks]
+        for nb_name in notebooks
+    }
+    state_fpath = os.path.join(
+        output_notebook_directory, ".notebook_state.json"
+    )
+    os.makedirs(output_notebook_directory, exist_ok=True)
+    state = read_notebook_state(state_fpath)
+
+    keys, executed, failed = {}, set(), set()
+    pending = list(notebooks)
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            num_pending = len(pending)
+            for nb_name in list(pending):
+                if any(
+                    d in pending or d in running.values()
+                    for d in upstream[nb_name]
+                ):
+                    continue
+                pending.remove(nb_name)
+                if any(d in failed for d in upstream[nb_name]):
+                    print(f"\nSkipped {nb_name} (dependency failed)")
+                    failed.add(nb_name)
+                    continue
+                notebook = notebooks[nb_name]
+                keys[nb_name] = get_notebook_key(
+                    notebook,
+                    nb_dicts[notebook],
+                    [keys[d] for d in upstream[nb_name]],
+                    inputs.get(nb_name),
+                )
+                # Notebooks are re-executed if their inputs changed, or if
+                # a notebook they depend on was executed (outputs are
+                # written to new, timestamped, files)
+                if (
+                    not force
+                    and state.get(nb_name) == keys[nb_name]
+                    and not any(d in executed for d in upstream[nb_name])
+                ):
+                    print(f"\nSkipped {nb_name} (inputs unchanged)")
+                    continue
+                future = executor.submit(
+                    papermill_run_notebook,
+                    {notebook: nb_dicts[notebook]},
+                    output_notebook_directory,
+                )
+                running[future] = nb_name
+            if not running and len(pending) == num_pending:
+                raise ValueError(f"Circular dependencies between {pending}")
+            # Independent notebooks are executed concurrently
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                nb_name = running.pop(future)
+                executed.add(nb_name)
+                if future.exception() is not None:
+                    print(f"\nFailed {nb_name}: {future.exception()}")
+                    failed.add(nb_name)
+                    state.pop(nb_name, None)
+                else:
+                    # Notebooks can create the files they read (eg.
+                    # downloaded snapshots), so the key is computed again
+                    notebook = notebooks[nb_name]
+                    keys[nb_name] = get_notebook_key(
+                        notebook,
+                        nb_dicts[notebook],
+                        [keys[d] for d in upstream[nb_name]],
+                        inputs.get(nb_name),
+                    )
+                    state[nb_name] = keys[nb_name]
+                write_notebook_state(state, state_fpath)
+    if failed:
+        raise RuntimeError(f"Notebooks failed: {sorted(failed)}")
 
 
 if __name__ == "__main__":
@@ -182,6 +370,19 @@ if __name__ == "__main__":
         default="yes",
         help="whether to run CI build",
     )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        dest="max_workers",
+        default=None,
+        help="number of notebooks to execute at the same time",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        dest="force",
+        help="execute notebooks even if their inputs are unchanged",
+    )
     args = parser.parse_args()
 
     one_dict_v2.update({"ci_run": args.ci_run})
@@ -221,4 +422,6 @@ if __name__ == "__main__":
     run_notebooks(
         notebooks_list=notebook_list,
         output_notebook_directory=output_notebook_dir,
+        max_workers=args.max_workers,
+        force=args.force,
     )
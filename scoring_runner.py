@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Programmatic scoring of establishments with trained ML pipeline."""
+
+# pylint: disable=invalid-name
+
+import argparse
+
+from src.scoring import get_latest_model_fpath, score_establishments
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--features-fpath",
+        type=str,
+        dest="features_fpath",
+        required=True,
+        help=(
+            "path to feature table (.parquet or .csv) with all features of "
+            "the model, eg. data/processed/processed_with_features__*.csv"
+        ),
+    )
+    parser.add_argument(
+        "--model-fpath",
+        type=str,
+        dest="model_fpath",
+        default=None,
+        help="path to trained model (default: latest model in models/)",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        dest="output",
+        default="data/processed/risk_scores.parquet",
+        help="path to .parquet file or database URI to store scores",
+    )
+    parser.add_argument(
+        "--table-name",
+        type=str,
+        dest="table_name",
+        default="risk_scores",
+        help="database table to store scores (if output is a database URI)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        dest="batch_size",
+        default=50_000,
+        help="number of rows of feature table to read at a time",
+    )
+    parser.add_argument(
+        "--min-date",
+        type=str,
+        dest="min_date",
+        default=None,
+        help="only score establishments inspected on or after this date",
+    )
+    args = parser.parse_args()
+
+    df_scores, stats = score_establishments(
+        args.model_fpath or get_latest_model_fpath(),
+        args.features_fpath,
+        args.output,
+        args.table_name,
+        args.batch_size,
+        args.min_date,
+    )
+    print(df_scores.head(10).to_string(index=False))
+    for k, v in stats.items():
+        print(f"{k}: {v:,.2f}" if isinstance(v, float) else f"{k}: {v:,}")
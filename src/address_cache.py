@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Persistent cache of geocoded outputs, keyed by canonical address."""
+
+# pylint: disable=invalid-name
+
+import json
+import os
+import re
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Union
+
+# Abbreviations used in DineSafe data for street types and directions
+STREET_ABBREVIATIONS = {
+    "AVENUE": "AVE",
+    "BOULEVARD": "BLVD",
+    "CIRCLE": "CIR",
+    "COURT": "CRT",
+    "CRESCENT": "CRES",
+    "DRIVE": "DR",
+    "EAST": "E",
+    "GARDENS": "GDNS",
+    "HIGHWAY": "HWY",
+    "NORTH": "N",
+    "PARKWAY": "PKWY",
+    "PLACE": "PL",
+    "ROAD": "RD",
+    "SOUTH": "S",
+    "SQUARE": "SQ",
+    "STREET": "ST",
+    "TERRACE": "TER",
+    "TRAIL": "TRL",
+    "WEST": "W",
+}
+CITY_SUFFIX_REGEX = re.compile(r",\s*TORONTO(,\s*ON)?(,\s*CANADA)?\s*$")
+# Unit keywords must be whole words followed by a unit number, so that
+# street names starting with them (eg. STEELES AVE, UNITY RD) are kept
+UNIT_REGEX = re.compile(
+    r"\b(UNIT|SUITE|STE|APT|APARTMENT|RM|ROOM)\b(\s+|\s*#\s*)"
+    r"(\d[A-Z0-9-]*|[A-Z]\d*)\b"
+    r"|#\s*[A-Z0-9-]+"
+)
+# Unit number written before the street number, e.g. 12-345 MAIN ST
+UNIT_PREFIX_REGEX = re.compile(
+    r"^([A-Z]|[A-Z]?\d+[A-Z]?)\s*-\s*(\d+)(?=\s+\D)"
+)
+
+
+def remove_unit_prefix(address: str) -> str:
+    """Remove unit number written before the street number."""
+    match = UNIT_PREFIX_REGEX.match(address)
+    if match is None:
+        return address
+    unit, number = match.groups()
+    # Range of street numbers (eg. 100-102 QUEEN ST W) is not a unit
+    if unit.isdigit() and len(unit) == len(number) and int(unit) < int(number):
+        return address
+    number_start = match.start(2)
+    return address[number_start:]
+
+
+def canonicalize_address(address: str) -> str:
+    """Get canonical version of a street address."""
+    address = CITY_SUFFIX_REGEX.sub("", address.upper().strip())
+    address = remove_unit_prefix(UNIT_REGEX.sub(" ", address).strip())
+    address = re.sub(r"[.,]", " ", address)
+    return " ".join(
+        STREET_ABBREVIATIONS.get(word, word)
+        for word in address.split()
+        if word != "-"
+    )
+
+
+class AddressCache:
+    """On-disk (SQLite) geocode cache with an in-memory LRU front."""
+
+    def __init__(
+        self,
+        db_fpath: str = "data/processed/geocode_cache.sqlite",
+        maxsize: int = 10_000,
+    ):
+        os.makedirs(os.path.dirname(db_fpath) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_fpath)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS geocoded (
+                canonical_address TEXT PRIMARY KEY,
+                record TEXT
+            )
+            """
+        )
+        self.maxsize = maxsize
+        self.lru = OrderedDict()
+
+    def _remember(self, key: str, record: Dict) -> None:
+        """Add record to in-memory LRU cache."""
+        self.lru[key] = record
+        self.lru.move_to_end(key)
+        if len(self.lru) > self.maxsize:
+            self.lru.popitem(last=False)
+
+    def get_many(
+        self, addresses: Iterable[str]
+    ) -> Dict[str, Dict[str, Union[str, float, None]]]:
+        """Get cached records by canonical address, for found addresses."""
+        records = {}
+        missing_keys = []
+        for key in {canonicalize_address(a) for a in addresses}:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                records[key] = self.lru[key]
+            else:
+                missing_keys.append(key)
+        # Look up addresses not in memory with one query per 500 addresses
+        for start in range(0, len(missing_keys), 500):
+            end = start + 500
+            keys = missing_keys[start:end]
+            placeholders = ", ".join(["?"] * len(keys))
+            for key, record in self.conn.execute(
+                "SELECT canonical_address, record FROM geocoded "
+                f"WHERE canonical_address IN ({placeholders})",
+                keys,
+            ):
+                records[key] = json.loads(record)
+                self._remember(key, records[key])
+        return records
+
+    def get(self, address: str) -> Optional[Dict]:
+        """Get cached record for a street address, if found."""
+        return self.get_many([address]).get(canonicalize_address(address))
+
+    def put_many(self, records: List[Dict]) -> None:
+        """Add geocoded records to cache."""
+        rows = []
+        for record in records:
+            key = canonicalize_address(record["address"])
+            self._remember(key, record)
+            rows.append((key, json.dumps(record)))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO geocoded VALUES (?, ?)", rows
+            )
+
+    def close(self) -> None:
+        """Close connection to on-disk cache."""
+        self.conn.close()
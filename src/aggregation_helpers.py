@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Single-pass aggregation of grouped infractions into inspections."""
+
+# pylint: disable=invalid-name
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+INSPECTION_COLS = [
+    "establishment_id",
+    "establishmenttype",
+    "establishment_address",
+    "inspection_date",
+    "inspection_id",
+    "establishment_status",
+]
+SEVERITY_COLS = [
+    "num_significant",
+    "num_crucial",
+    "num_minor",
+    "num_na",
+    "num_infractions",
+]
+PIVOT_COLS = ["action", "court_outcome"]
+
+
+def get_action_col_name(action: str) -> str:
+    """Get name of column with number of an action per inspection."""
+    return f"num_{action.lower().replace(' ', '_')}"
+
+
+def get_outcome_col_name(court_outcome: str) -> str:
+    """Get name of column with number of a court outcome per inspection."""
+    outcome_cname = (
+        court_outcome.lower()
+        .replace(" ", "_")
+        .replace("-", "")
+        .replace("__", "_")
+        .replace("&_", "")
+    )
+    return f"num_{outcome_cname}"
+
+
+PIVOT_COL_NAMERS = {
+    "action": get_action_col_name,
+    "court_outcome": get_outcome_col_name,
+}
+
+
+def get_categories_fpath(
+    uri: str, table_name: str, data_dir: str = "data/processed"
+) -> str:
+    """Get path to cached categories of a table in a database."""
+    # URI is hashed, so that credentials are not part of the file name
+    uri_hash = hashlib.sha256(uri.encode()).hexdigest()[:16]
+    return os.path.join(data_dir, f"{table_name}_categories__{uri_hash}.json")
+
+
+def get_categories(
+    df: pd.DataFrame, categories_fpath: str, prune: bool = False
+) -> Dict[str, List[str]]:
+    """Get cached categories of pivoted columns, adding new categories."""
+    categories = {c: [] for c in PIVOT_COLS}
+    if os.path.exists(categories_fpath):
+        with open(categories_fpath) as f:
+            categories.update(json.load(f))
+    is_changed = False
+    for c in PIVOT_COLS:
+        # Missing and empty values are counted as a NULL category
+        observed = set(df[c].replace("", np.nan).fillna("NULL").unique())
+        if prune:
+            # Categories that are no longer found are only dropped if all
+            # inspections are recomputed
+            kept = [cat for cat in categories[c] if cat in observed]
+            is_changed |= len(kept) < len(categories[c])
+            categories[c] = kept
+        new_categories = sorted(observed - set(categories[c]))
+        if new_categories:
+            # Append new categories, so that existing columns keep their order
+            categories[c] += new_categories
+            is_changed = True
+    if is_changed or not os.path.exists(categories_fpath):
+        os.makedirs(os.path.dirname(categories_fpath) or ".", exist_ok=True)
+        with open(categories_fpath, "w") as f:
+            json.dump(categories, f, indent=4)
+    return categories
+
+
+def pivot_inspections(
+    df: pd.DataFrame,
+    categories: Dict[str, List[str]],
+    extra_cols: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Aggregate infractions grouped by action and outcome into inspections."""
+    # Number each inspection, in order of first appearance
+    group_codes = (
+        df.groupby(INSPECTION_COLS, sort=False, dropna=False, observed=True)
+        .ngroup()
+        .to_numpy()
+    )
+    num_groups = group_codes.max() + 1 if len(group_codes) else 0
+    is_first = ~pd.Series(group_codes).duplicated().to_numpy()
+    df_inspections = (
+        df.loc[is_first, INSPECTION_COLS].reset_index(drop=True).copy()
+    )
+    df_inspections["infractions_summary"] = (
+        df.groupby(group_codes, sort=True)["infractions_summary"]
+        .agg(lambda s: ". ".join(s.dropna()) or None)
+        .to_numpy()
+    )
+    df_inspections[SEVERITY_COLS] = np.column_stack(
+        [
+            np.bincount(
+                group_codes,
+                weights=df[c].to_numpy(dtype=float),
+                minlength=num_groups,
+            )
+            for c in SEVERITY_COLS
+        ]
+    ).astype(int)
+    # Count each category per inspection, using codes of categoricals and a
+    # single bincount over the combined (inspection, category) index
+    for c in PIVOT_COLS:
+        cats = categories[c]
+        # As with SUM(CASE WHEN ... IS NULL ...), empty values have a num_null
+        # column but are not counted in it (nor in any other column)
+        cat_codes = pd.Categorical(df[c].fillna("NULL"), categories=cats).codes
+        is_counted = cat_codes >= 0
+        counts = np.bincount(
+            group_codes[is_counted] * len(cats) + cat_codes[is_counted],
+            minlength=num_groups * len(cats),
+        ).reshape(num_groups, len(cats))
+        df_inspections = pd.concat(
+            [
+                df_inspections,
+                pd.DataFrame(
+                    counts,
+                    columns=[PIVOT_COL_NAMERS[c](cat) for cat in cats],
+                ),
+            ],
+            axis=1,
+        )
+    # Columns that are constant within an inspection are placed last
+    for c in extra_cols or []:
+        df_inspections[c] = df.loc[is_first, c].to_numpy()
+    return df_inspections
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Benchmarks of workflow steps on synthetic DineSafe snapshots."""
+
+# pylint: disable=invalid-name
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+from datetime import datetime
+from typing import Dict, Optional
+
+import pandas as pd
+
+from src.aggregation_helpers import INSPECTION_COLS, get_categories_fpath
+from src.duckdb_backend import (
+    assert_backend_parity,
+    create_infractions_view,
+    get_snapshot_paths,
+    is_duckdb_uri,
+)
+from src.engine_pool import dispose_engines, get_engine
+from src.instrumentation import clear_metrics, get_metrics, instrument
+from src.synthetic_data import write_synthetic_snapshot
+from src.workflow.workflow_utils import (
+    aggregate_inspections,
+    create_class_labels,
+    engineer_features,
+    filter_inspections_in_database,
+    load,
+    process_data,
+    remove_multi_day_inspections,
+    remove_reinspections,
+    transform,
+)
+
+# Name of synthetic snapshot (timestamp, as for downloaded snapshots)
+BENCHMARK_SNAPSHOT = "20220101000000"
+COLS_ORDER_WANTED = [
+    "row_id",
+    "establishment_id",
+    "inspection_id",
+    "establishment_name",
+    "establishmenttype",
+    "establishment_address",
+    "latitude",
+    "longitude",
+    "establishment_status",
+    "minimum_inspections_peryear",
+    "infraction_details",
+    "inspection_date",
+    "severity",
+    "action",
+    "court_outcome",
+    "amount_fined",
+    "filename",
+]
+ESTABLISHMENT_TYPES_WANTED = [
+    "Restaurant",
+    "Food Take Out",
+    "Food Store (Convenience / Variety)",
+    "Food Court Vendor",
+    "Supermarket",
+    "Bakery",
+    "Butcher Shop",
+    "Cafeteria - Public Access",
+    "Cocktail Bar / Beverage Room",
+    "Fish Shop",
+    "Bake Shop",
+    "Flea Market",
+]
+
+
+def read_data(filepath: str) -> pd.DataFrame:
+    """Load an XML file into a DataFrame, with the full XML tree."""
+    fname = filepath.split("/", 3)[-2]
+    return pd.read_xml(filepath).assign(filename=fname)
+
+
+def get_git_commit() -> Dict[str, Optional[str]]:
+    """Get current git commit and whether there are uncommitted changes."""
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], text=True
+        ).strip()
+        is_dirty = bool(
+            subprocess.check_output(
+                ["git", "status", "--porcelain", "--untracked-files=no"],
+                text=True,
+            ).strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": is_dirty}
+
+
+def filter_inspections(uri: str, table_name: str) -> pd.DataFrame:
+    """Aggregate infractions in database and filter inspections in pandas."""
+    df_inspections = aggregate_inspections.fn(
+        uri, table_name, ESTABLISHMENT_TYPES_WANTED
+    )
+    df_inspections = remove_multi_day_inspections.fn(df_inspections)
+    df_inspections = remove_reinspections.fn(df_inspections)
+    return create_class_labels.fn(df_inspections)
+
+
+def run_benchmark(
+    num_infractions: int,
+    work_dir: str = "data/benchmarks",
+    load_uri: Optional[str] = None,
+    db_uri: Optional[str] = None,
+    table_name: str = "inspections",
+    batch_size: int = 50_000,
+    full_read_max_rows: int = 1_000_000,
+    random_state: int = 42,
+) -> pd.DataFrame:
+    """Time workflow steps on a synthetic snapshot of a number of rows."""
+    scale_dir = os.path.abspath(os.path.join(work_dir, str(num_infractions)))
+    # Infractions are appended to a SQLite database and aggregated with the
+    # embedded DuckDB database, unless database URIs are given
+    load_uri = load_uri or f"sqlite:///{scale_dir}/benchmark.sqlite"
+    db_uri = db_uri or f"duckdb:///{scale_dir}/benchmark.duckdb"
+    cwd = os.getcwd()
+    # Steps use paths relative to the project directory (the snapshot
+    # filename is found from its path), so they are run in a separate one
+    os.makedirs(scale_dir, exist_ok=True)
+    os.chdir(scale_dir)
+    try:
+        snapshot_dir = os.path.join("data", "raw", BENCHMARK_SNAPSHOT)
+        xml_fpath = os.path.join(snapshot_dir, "dinesafe.xml")
+        # Same synthetic snapshot is re-used, so results are comparable
+        # across commits
+        if not os.path.exists(xml_fpath):
+            write_synthetic_snapshot(
+                xml_fpath, num_infractions, random_state=random_state
+            )
+        shutil.rmtree(os.path.join("data", "processed"), ignore_errors=True)
+        clear_metrics()
+
+        # Extract and transform
+        if num_infractions <= full_read_max_rows:
+            # Full XML tree is held in memory, so only small snapshots are
+            # read at once
+            instrument(process_data)(
+                instrument(read_data)(xml_fpath), COLS_ORDER_WANTED
+            )
+        df = transform.fn(
+            snapshot_dir, [], COLS_ORDER_WANTED, table_name, batch_size
+        )
+
+        # Load
+        with get_engine(load_uri).begin() as conn:
+            df.head(0).to_sql(
+                table_name, conn, if_exists="replace", index=False
+            )
+        load.fn([df], ["", load_uri, ""], table_name)
+        if is_duckdb_uri(db_uri):
+            # Infractions are not loaded into DuckDB database, so creating
+            # its view is not timed
+            create_infractions_view(db_uri, table_name, get_snapshot_paths())
+
+        # Aggregate and filter in pandas, or in the database
+        df_inspections = filter_inspections(db_uri, table_name)
+        df_filtered = filter_inspections_in_database.fn(
+            db_uri, table_name, ESTABLISHMENT_TYPES_WANTED
+        )
+
+        # Features
+        engineer_features.fn(
+            df_inspections,
+            None,
+            table_name,
+            get_categories_fpath(db_uri, table_name),
+        )
+        df_metrics = get_metrics().assign(num_infractions=num_infractions)
+
+        # Filters in pandas and in the database must give same inspections
+        assert_backend_parity(df_filtered, df_inspections, INSPECTION_COLS)
+    finally:
+        dispose_engines()
+        os.chdir(cwd)
+    return df_metrics
+
+
+def get_benchmark_fpath(commit: str, output_dir: str) -> str:
+    """Get path to benchmark results of a git commit."""
+    return os.path.join(output_dir, f"{commit[:12]}.json")
+
+
+def write_benchmark_results(
+    df_results: pd.DataFrame, output_dir: str = "reports/benchmarks"
+) -> str:
+    """Save benchmark results to a JSON file named by the git commit."""
+    git_info = get_git_commit()
+    os.makedirs(output_dir, exist_ok=True)
+    results_fpath = get_benchmark_fpath(
+        git_info["commit"] or "unknown", output_dir
+    )
+    with open(results_fpath, "w") as f:
+        json.dump(
+            {
+                **git_info,
+                "created_at": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "pandas": pd.__version__,
+                "platform": platform.platform(),
+                "processors": os.cpu_count(),
+                "results": df_results.astype(object)
+                .where(df_results.notna(), None)
+                .to_dict("records"),
+            },
+            f,
+            indent=4,
+            default=str,
+        )
+    return results_fpath
+
+
+def read_benchmark_results(results_fpath: str) -> pd.DataFrame:
+    """Load benchmark results from a JSON file."""
+    with open(results_fpath) as f:
+        return pd.DataFrame.from_records(json.load(f)["results"])
+
+
+def compare_benchmarks(
+    df_results: pd.DataFrame, df_baseline: pd.DataFrame
+) -> pd.DataFrame:
+    """Get ratio of metrics of each step to those of a baseline run."""
+    keys = ["num_infractions", "name"]
+    aggs = {
+        "wall_seconds": "sum",
+        "peak_rss_mb": "max",
+        "db_round_trips": "sum",
+    }
+    df = (
+        df_results.groupby(keys)
+        .agg(aggs)
+        .join(
+            df_baseline.groupby(keys).agg(aggs),
+            rsuffix="_baseline",
+            how="left",
+        )
+    )
+    for c in aggs:
+        df[f"{c}_ratio"] = df[c] / df[f"{c}_baseline"]
+    return df
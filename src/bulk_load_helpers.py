@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Bulk loading of DataFrames into database tables."""
+
+# pylint: disable=invalid-name
+
+import csv
+import os
+import tempfile
+from contextlib import nullcontext
+from time import perf_counter
+from typing import Callable, Dict, Union
+
+import pandas as pd
+
+# Maximum number of bound parameters allowed in a single statement
+MAX_PARAMS = {"sqlite": 999, "mysql": 65_535, "postgresql": 32_767}
+
+
+def write_temp_csv(
+    df: pd.DataFrame, na_rep: str = "", chunksize: int = 50_000
+) -> str:
+    """Stream DataFrame to a temporary CSV file and get its path."""
+    fd, csv_fpath = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    df.to_csv(
+        csv_fpath,
+        index=False,
+        na_rep=na_rep,
+        date_format="%Y-%m-%d",
+        quoting=csv.QUOTE_MINIMAL,
+        chunksize=chunksize,
+    )
+    return csv_fpath
+
+
+def load_multirow(
+    df: pd.DataFrame, conn, table_name: str, chunksize: int = 10_000
+) -> None:
+    """Append rows using chunked multi-row INSERT ... VALUES statements."""
+    # Limit rows per statement, so that the number of bound parameters stays
+    # within the limit of the database
+    max_params = MAX_PARAMS.get(conn.engine.dialect.name, 999)
+    chunksize = max(1, min(chunksize, max_params // len(list(df))))
+    df.to_sql(
+        name=table_name,
+        con=conn,
+        index=False,
+        if_exists="append",
+        method="multi",
+        chunksize=chunksize,
+    )
+
+
+def load_data_infile(
+    df: pd.DataFrame, conn, table_name: str, chunksize: int = 50_000
+) -> None:
+    """Append rows to MySQL table using LOAD DATA LOCAL INFILE."""
+    # Unquoted NULL is read as a missing value when fields can be enclosed
+    # by quotes and no escape character is used
+    csv_fpath = write_temp_csv(df, "NULL", chunksize)
+    cols_str = ", ".join(list(df))
+    try:
+        conn.execute(
+            f"""
+            LOAD DATA LOCAL INFILE '{csv_fpath}'
+            INTO TABLE {table_name}
+            FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '\\n'
+            IGNORE 1 LINES
+            ({cols_str})
+            """
+        )
+    finally:
+        os.remove(csv_fpath)
+
+
+def load_copy(
+    df: pd.DataFrame, conn, table_name: str, chunksize: int = 50_000
+) -> None:
+    """Append rows using the native bulk copy path of the database."""
+    dialect = conn.engine.dialect.name
+    if dialect not in ["postgresql", "sqlite"]:
+        raise ValueError(
+            f"Bulk load method copy is not supported for {dialect}. Use "
+            "one of: multirow, load_data (MySQL)."
+        )
+    cols_str = ", ".join(list(df))
+    # Rows are committed with the transaction of the caller, if one was
+    # started, and otherwise in a transaction of their own
+    transaction = nullcontext() if conn.in_transaction() else conn.begin()
+    with transaction:
+        cursor = conn.connection.cursor()
+        _copy_rows(df, cursor, dialect, table_name, cols_str, chunksize)
+        cursor.close()
+
+
+def _copy_rows(
+    df: pd.DataFrame,
+    cursor,
+    dialect: str,
+    table_name: str,
+    cols_str: str,
+    chunksize: int,
+) -> None:
+    """Send rows to the database with a DBAPI cursor."""
+    if dialect == "postgresql":
+        # Stream temporary CSV file to server with COPY ... FROM STDIN
+        csv_fpath = write_temp_csv(df, "", chunksize)
+        try:
+            with open(csv_fpath) as f:
+                cursor.copy_expert(
+                    f"COPY {table_name} ({cols_str}) FROM STDIN "
+                    "WITH (FORMAT csv, HEADER true, NULL '')",
+                    f,
+                )
+        finally:
+            os.remove(csv_fpath)
+    else:
+        # SQLite has no COPY, so the closest equivalent is a single prepared
+        # statement executed for all rows in one transaction
+        placeholders = ", ".join(["?"] * len(list(df)))
+        insert_sql = (
+            f"INSERT INTO {table_name} ({cols_str}) VALUES ({placeholders})"
+        )
+        for start in range(0, len(df), chunksize):
+            end = start + chunksize
+            df_chunk = df.iloc[start:end]
+            # Convert to Python-native values, with None for missing values
+            for c in df_chunk.select_dtypes(include=["datetime"]):
+                df_chunk = df_chunk.assign(**{c: df_chunk[c].dt.date})
+            df_chunk = df_chunk.astype(object).where(df_chunk.notna(), None)
+            cursor.executemany(
+                insert_sql, df_chunk.itertuples(index=False, name=None)
+            )
+
+
+BULK_LOAD_METHODS: Dict[str, Callable] = {
+    "multirow": load_multirow,
+    "load_data": load_data_infile,
+    "copy": load_copy,
+}
+
+
+def bulk_load(
+    df: pd.DataFrame,
+    conn,
+    table_name: str,
+    method: str = "multirow",
+    chunksize: int = 10_000,
+) -> Dict[str, Union[str, int, float]]:
+    """Append DataFrame to database table and report rows per second."""
+    start_time = perf_counter()
+    BULK_LOAD_METHODS[method](df, conn, table_name, chunksize)
+    duration = perf_counter() - start_time
+    return {
+        "method": method,
+        "rows": len(df),
+        "seconds": duration,
+        "rows_per_sec": len(df) / duration if duration else float("nan"),
+    }
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Cached client for Toronto Open Data Portal (CKAN) datasets."""
+
+# pylint: disable=invalid-name
+
+import json
+import os
+from time import time
+from typing import Callable, Dict, Optional
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import requests
+
+from src.download_helpers import get_pooled_session
+from src.snapshot_cache import get_file_hash
+
+CKAN_BASE_URL = "https://ckan0.cf.opendata.inter.prod-toronto.ca/api/3/action"
+
+
+class CachedCKANClient:
+    """Client revalidating cached CKAN responses with conditional GETs."""
+
+    def __init__(
+        self,
+        cache_dir: str = "data/raw/ckan_cache",
+        offline: Optional[bool] = None,
+        metadata_ttl: int = 86_400,
+        session: Optional[requests.Session] = None,
+        timeout: int = 60,
+    ):
+        self.cache_dir = cache_dir
+        # Offline mode can also be turned on with an environment variable
+        self.offline = (
+            offline
+            if offline is not None
+            else os.getenv("TORONTO_OPEN_DATA_OFFLINE", "0") == "1"
+        )
+        self.metadata_ttl = metadata_ttl
+        self.session = session or get_pooled_session()
+        self.timeout = timeout
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_paths(self, key: str) -> Dict[str, str]:
+        """Get paths to cached response body and its headers."""
+        return {
+            "body": os.path.join(self.cache_dir, f"{key}.body"),
+            "meta": os.path.join(self.cache_dir, f"{key}.json"),
+        }
+
+    def _get_body_hash(self, key: str, body_fpath: str) -> str:
+        """Get hash of response body, stored when it was downloaded."""
+        # Hash is only computed for files not downloaded by this client
+        paths = self._get_paths(key)
+        if body_fpath == paths["body"] and os.path.exists(paths["meta"]):
+            with open(paths["meta"]) as f:
+                body_hash = json.load(f).get("sha256")
+            if body_hash:
+                return body_hash
+        return get_file_hash(body_fpath)
+
+    def get_file(
+        self,
+        url: str,
+        key: str,
+        params: Optional[Dict] = None,
+        max_age: Optional[int] = None,
+    ) -> str:
+        """Get path to cached response, downloading it only if changed."""
+        # Responses are stored by key (package or resource ID), with their
+        # ETag and Last-Modified headers
+        paths = self._get_paths(key)
+        meta = {}
+        if os.path.exists(paths["meta"]) and os.path.exists(paths["body"]):
+            with open(paths["meta"]) as f:
+                meta = json.load(f)
+        if self.offline:
+            if not meta:
+                raise FileNotFoundError(
+                    f"{url} ({key}) is not cached and cannot be retrieved "
+                    "in offline mode."
+                )
+            return paths["body"]
+        # Responses without validators (e.g. API metadata) are reused for
+        # up to max_age seconds
+        if meta and max_age and time() - meta["fetched_at"] < max_age:
+            return paths["body"]
+
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        try:
+            r = self.session.get(
+                url,
+                params=params,
+                headers=headers,
+                stream=True,
+                timeout=self.timeout,
+            )
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.RetryError,
+        ):
+            # Use stale copy if the server cannot be reached, or if it kept
+            # failing until the retries of the session were used up
+            if meta:
+                return paths["body"]
+            raise
+        with r:
+            if r.status_code == 304 and meta:
+                meta["fetched_at"] = time()
+            elif r.status_code >= 500 and meta:
+                # Server errors are not cached, so the stale copy is used
+                # again on the next call
+                return paths["body"]
+            else:
+                r.raise_for_status()
+                tmp_fpath = f"{paths['body']}.tmp"
+                with open(tmp_fpath, "wb") as f:
+                    for chunk in r.iter_content(chunk_size=1 << 20):
+                        f.write(chunk)
+                os.replace(tmp_fpath, paths["body"])
+                meta = {
+                    "url": url,
+                    "params": params,
+                    "etag": r.headers.get("ETag"),
+                    "last_modified": r.headers.get("Last-Modified"),
+                    "sha256": get_file_hash(paths["body"]),
+                    "fetched_at": time(),
+                }
+        with open(paths["meta"], "w") as f:
+            json.dump(meta, f, indent=4)
+        return paths["body"]
+
+    def get_parsed(
+        self,
+        key: str,
+        body_fpath: str,
+        parse_func: Callable,
+        geo: bool = False,
+    ):
+        """Get parsed (Geo)DataFrame of cached response, stored as Parquet."""
+        # Parsed file is keyed by the hash of the response it was parsed from
+        body_hash = self._get_body_hash(key, body_fpath)[:16]
+        parsed_fpath = os.path.join(
+            self.cache_dir, f"{key}__{body_hash}.parquet"
+        )
+        if os.path.exists(parsed_fpath):
+            if geo:
+                return gpd.read_parquet(parsed_fpath)
+            return pd.read_parquet(parsed_fpath)
+        df = parse_func(body_fpath)
+        for f in os.listdir(self.cache_dir):
+            if f.startswith(f"{key}__") and f.endswith(".parquet"):
+                os.remove(os.path.join(self.cache_dir, f))
+        try:
+            df.to_parquet(f"{parsed_fpath}.tmp", index=False)
+            os.replace(f"{parsed_fpath}.tmp", parsed_fpath)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # Columns with mixed types cannot be stored, so they are parsed
+            # from the cached response on every run
+            if os.path.exists(f"{parsed_fpath}.tmp"):
+                os.remove(f"{parsed_fpath}.tmp")
+        return df
+
+    def package_show(
+        self, package_id: str, url: str = f"{CKAN_BASE_URL}/package_show"
+    ) -> Dict:
+        """Get metadata of a dataset (package)."""
+        body_fpath = self.get_file(
+            url,
+            f"package_{package_id}",
+            params={"id": package_id},
+            max_age=self.metadata_ttl,
+        )
+        with open(body_fpath) as f:
+            return json.load(f)
+
+    def datastore_search(
+        self,
+        resource_id: str,
+        url: str = f"{CKAN_BASE_URL}/datastore_search",
+    ) -> pd.DataFrame:
+        """Get records of a datastore resource."""
+        key = f"datastore_{resource_id}"
+        body_fpath = self.get_file(
+            url, key, params={"id": resource_id}, max_age=self.metadata_ttl
+        )
+
+        def parse_records(fpath):
+            with open(fpath) as f:
+                return pd.DataFrame(json.load(f)["result"]["records"])
+
+        return self.get_parsed(key, body_fpath, parse_records)
+
+    def get_resource(self, resource: Dict, url: Optional[str] = None) -> str:
+        """Get path to cached file of a resource, by resource ID."""
+        return self.get_file(
+            url or resource["url"], f"resource_{resource['id']}"
+        )
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Parallel time-series cross-validation of ML pipelines."""
+
+# pylint: disable=invalid-name
+
+import os
+from itertools import product
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, dump, load
+from sklearn.base import clone
+from sklearn.metrics import f1_score, precision_score, recall_score
+
+from src.preprocessing import get_cached_fit_transform, get_data_fingerprint
+
+
+def get_fold_indices(
+    dates: pd.Series,
+    val_fold_starts: List[str],
+    train_start: str = "2017-01-01",
+    val_days: int = 60,
+    random_state: Optional[int] = 42,
+) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """Get positions of training and validation rows of each fold."""
+    # Sort dates once, then find boundaries of all folds with binary searches
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy()
+    order = np.argsort(dates, kind="stable")
+    sorted_dates = dates[order]
+    start_dates = pd.to_datetime(pd.Series(val_fold_starts))
+    end_dates = start_dates + pd.Timedelta(val_days, unit="days")
+    train_starts = np.searchsorted(
+        sorted_dates, np.datetime64(pd.to_datetime(train_start)), side="left"
+    )
+    # Training fold ends on the day before the validation fold starts, and
+    # fold end dates are inclusive
+    train_ends = np.searchsorted(
+        sorted_dates,
+        (start_dates - pd.Timedelta(1, unit="days")).to_numpy(),
+        side="right",
+    )
+    val_starts = np.searchsorted(
+        sorted_dates, start_dates.to_numpy(), side="left"
+    )
+    val_ends = np.searchsorted(
+        sorted_dates, end_dates.to_numpy(), side="right"
+    )
+
+    rng = np.random.default_rng(random_state)
+    folds = []
+    for train_end, val_start, val_end in zip(train_ends, val_starts, val_ends):
+        _, train_rows, _ = np.split(order, [train_starts, train_end])
+        _, val_rows, _ = np.split(order, [val_start, val_end])
+        # Training rows keep their order, validation rows are shuffled (with
+        # a fixed seed by default, so that encoded folds cached by earlier
+        # runs are found again)
+        folds.append((np.sort(train_rows), rng.permutation(val_rows)))
+    return folds
+
+
+def set_single_job(pipe):
+    """Get copy of pipeline whose steps run on a single job."""
+    pipe = clone(pipe)
+    n_jobs_params = {
+        k: 1 for k in pipe.get_params() if k.split("__")[-1] == "n_jobs"
+    }
+    return pipe.set_params(**n_jobs_params)
+
+
+def preprocess_fold(
+    data_fpath: str,
+    split_index: int,
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    preprocessing,
+    cache_dir: str,
+    data_fingerprint: str,
+) -> Dict:
+    """Fit pre-processing on one training fold and cache encoded folds."""
+    X, _ = load(data_fpath, mmap_mode="r")
+    start_time = perf_counter()
+    get_cached_fit_transform(cache_dir)(
+        preprocessing, X, train_idx, val_idx, data_fingerprint
+    )
+    return {
+        "split_index": split_index,
+        "preprocess_time": perf_counter() - start_time,
+    }
+
+
+def score_fold(
+    data_fpath: str,
+    pipe,
+    clf_name: str,
+    split_index: int,
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    preprocessing=None,
+    cache_dir: Optional[str] = None,
+    data_fingerprint: Optional[str] = None,
+) -> Dict:
+    """Fit a pipeline on one training fold and score it on both folds."""
+    # Features and labels are memory-mapped instead of copied to each worker
+    X, y = load(data_fpath, mmap_mode="r")
+    y_train_cv, y_test_cv = y[train_idx], y[val_idx]
+    if preprocessing is None:
+        X_train_cv, X_test_cv = X.iloc[train_idx], X.iloc[val_idx]
+    else:
+        # Encoded (sparse) folds are shared by all pipelines
+        _, X_train_cv, X_test_cv = get_cached_fit_transform(cache_dir)(
+            preprocessing, X, train_idx, val_idx, data_fingerprint
+        )
+    pipe_cv = clone(pipe)
+
+    # Train and Predict
+    start_time = perf_counter()
+    pipe_cv.fit(X_train_cv, y_train_cv)
+    fit_time = perf_counter() - start_time
+    start_time = perf_counter()
+    y_train_pred = pipe_cv.predict(X_train_cv)
+    y_test_pred = pipe_cv.predict(X_test_cv)
+    predict_time = perf_counter() - start_time
+
+    start_time = perf_counter()
+    d_cv = {
+        "split_index": split_index,
+        "len_val": X_test_cv.shape[0],
+        "len_train": X_train_cv.shape[0],
+        "recall_train": recall_score(y_train_cv, y_train_pred),
+        "recall_test": recall_score(y_test_cv, y_test_pred),
+        "precision_train": precision_score(y_train_cv, y_train_pred),
+        "precision_test": precision_score(y_test_cv, y_test_pred),
+        "f1_train": f1_score(y_train_cv, y_train_pred),
+        "f1_test": f1_score(y_test_cv, y_test_pred),
+        "clf": clf_name,
+    }
+    d_cv.update(
+        {
+            "fit_time": fit_time,
+            "predict_time": predict_time,
+            "score_time": perf_counter() - start_time,
+        }
+    )
+    return d_cv
+
+
+def run_cross_validation(
+    pipes: Dict,
+    X: pd.DataFrame,
+    y: pd.Series,
+    folds: List[Tuple[np.ndarray, np.ndarray]],
+    preprocessing=None,
+    cache_dir: Optional[str] = None,
+    n_jobs: int = -1,
+    temp_dir: Optional[str] = None,
+    verbose: int = 0,
+) -> pd.DataFrame:
+    """Cross-validate pipelines, with all folds and pipelines in parallel."""
+    if n_jobs != 1:
+        # Folds and pipelines are already run in parallel, so estimators
+        # (eg. random forests) do not start jobs of their own
+        pipes = {
+            clf_name: set_single_job(pipe) for clf_name, pipe in pipes.items()
+        }
+    with TemporaryDirectory(dir=temp_dir) as tmp_dir:
+        # Store features and labels once, for workers to memory-map
+        data_fpath = os.path.join(tmp_dir, "cv_data.joblib")
+        dump((X, np.asarray(y)), data_fpath)
+        pp_kwargs = {}
+        if preprocessing is not None:
+            # Encode each fold once (or reuse encoded folds from earlier
+            # runs on the same data), before fitting any pipeline
+            pp_kwargs = {
+                "preprocessing": preprocessing,
+                "cache_dir": cache_dir or os.path.join(tmp_dir, "cache"),
+                "data_fingerprint": get_data_fingerprint(X, y),
+            }
+            d_pp_all = Parallel(n_jobs=n_jobs, verbose=verbose)(
+                delayed(preprocess_fold)(
+                    data_fpath, n, train_idx, val_idx, **pp_kwargs
+                )
+                for n, (train_idx, val_idx) in enumerate(folds)
+            )
+        d_cv_all = Parallel(n_jobs=n_jobs, verbose=verbose)(
+            delayed(score_fold)(
+                data_fpath, pipe, clf_name, n, train_idx, val_idx, **pp_kwargs
+            )
+            for (clf_name, pipe), (n, (train_idx, val_idx)) in product(
+                pipes.items(), enumerate(folds)
+            )
+        )
+    df_cv_summary = pd.DataFrame.from_records(d_cv_all)
+    if preprocessing is not None:
+        df_cv_summary = df_cv_summary.merge(
+            pd.DataFrame.from_records(d_pp_all), on="split_index", how="left"
+        )
+    return df_cv_summary
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Utilities to download DineSafe data snapshots from WayBackMachine."""
+
+# pylint: disable=invalid-name
+
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from zipfile import ZipFile
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from src.snapshot_cache import get_file_hash
+
+
+def get_snapshot_url(zip_fname: str) -> str:
+    """Get WayBackMachine URL of a zipped DineSafe data snapshot."""
+    return (
+        f"https://web.archive.org/web/{zip_fname}/"
+        "http://opendata.toronto.ca/public.health/dinesafe/dinesafe.zip"
+    )
+
+
+def get_pooled_session(
+    pool_size: int = 4, max_retries: int = 3, backoff_factor: float = 1.0
+) -> requests.Session:
+    """Get HTTP session with a connection pool shared by all downloads."""
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["HEAD", "GET"]),
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def download_file(
+    session: requests.Session,
+    url: str,
+    filepath: str,
+    expected_sha256: Optional[str] = None,
+    chunk_size: int = 1 << 20,
+    timeout: int = 60,
+) -> str:
+    """Stream file to disk, resuming a partial download if one is found."""
+    if os.path.exists(filepath):
+        return filepath
+    part_fpath = f"{filepath}.part"
+    # Resume from the end of a partially downloaded file using HTTP Range
+    start = os.path.getsize(part_fpath) if os.path.exists(part_fpath) else 0
+    headers = {"Range": f"bytes={start}-"} if start else {}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+        # 416 means the partial file already holds the full content
+        if r.status_code != 416:
+            r.raise_for_status()
+            # Server ignored Range header, so restart download from scratch
+            mode = "ab" if r.status_code == 206 else "wb"
+            with open(part_fpath, mode) as f:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+    # Verify checksum before the file is made available at its final path
+    if expected_sha256:
+        sha256 = get_file_hash(part_fpath)
+        if sha256 != expected_sha256:
+            os.remove(part_fpath)
+            raise ValueError(
+                f"Checksum mismatch for {url}: expected {expected_sha256}, "
+                f"got {sha256}"
+            )
+    # Atomic rename, so that a file at filepath is always complete
+    os.replace(part_fpath, filepath)
+    return filepath
+
+
+def download_and_extract_snapshot(
+    session: requests.Session,
+    zip_fname: str,
+    raw_data_dir: str = "data/raw",
+    expected_sha256: Optional[str] = None,
+) -> str:
+    """Download zipped data snapshot and extract XML file."""
+    # Create path to target dir, where extracted .XML file will be found
+    target_dir = f"{raw_data_dir}/{zip_fname}"
+    if os.path.exists(f"{target_dir}/dinesafe.xml"):
+        return target_dir
+    os.makedirs(target_dir, exist_ok=True)
+    zip_fpath = download_file(
+        session,
+        get_snapshot_url(zip_fname),
+        f"{target_dir}/dinesafe.zip",
+        expected_sha256,
+    )
+    # Extract to temporary dir and move extracted files to target dir, so
+    # that an interrupted extraction does not leave a partial .XML file
+    tmp_dir = f"{target_dir}/.extract"
+    with ZipFile(zip_fpath) as zfile:
+        bad_member = zfile.testzip()
+        if bad_member:
+            os.remove(zip_fpath)
+            raise ValueError(f"Corrupt member {bad_member} in {zip_fpath}")
+        zfile.extractall(tmp_dir)
+    for fname in os.listdir(tmp_dir):
+        os.replace(f"{tmp_dir}/{fname}", f"{target_dir}/{fname}")
+    shutil.rmtree(tmp_dir)
+    os.remove(zip_fpath)
+    return target_dir
+
+
+def download_snapshots(
+    zip_filenames: List[str],
+    raw_data_dir: str = "data/raw",
+    max_workers: int = 4,
+    checksums: Optional[Dict[str, str]] = None,
+) -> List[str]:
+    """Download and extract data snapshots concurrently."""
+    checksums = checksums or {}
+    session = get_pooled_session(pool_size=max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        target_dirs = list(
+            executor.map(
+                lambda zip_fname: download_and_extract_snapshot(
+                    session,
+                    zip_fname,
+                    raw_data_dir,
+                    checksums.get(zip_fname),
+                ),
+                zip_filenames,
+            )
+        )
+    session.close()
+    return target_dirs
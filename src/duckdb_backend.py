@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Embedded DuckDB backend over Parquet snapshots, instead of MySQL."""
+
+# pylint: disable=invalid-name
+
+import os
+from glob import glob
+from typing import Dict, List, Optional
+
+import duckdb
+import pandas as pd
+
+from src.engine_pool import get_engine
+
+DUCKDB_URI_PREFIX = "duckdb:///"
+# SQL that differs between MySQL, DuckDB and SQLite (string literals in
+# MySQL queries use double quotes and escaped % signs)
+SQL_DIALECTS: Dict[str, Dict[str, str]] = {
+    "mysql": {
+        "group_concat": "GROUP_CONCAT({col} SEPARATOR '. ')",
+        "integer": "SIGNED",
+        "like": '"%%{pattern}"',
+        "datediff": "DATEDIFF({start}, {end})",
+        "quote": "\\'",
+    },
+    "duckdb": {
+        "group_concat": "STRING_AGG({col}, '. ')",
+        "integer": "BIGINT",
+        "like": "'%{pattern}'",
+        "datediff": "DATE_DIFF('day', {start}, {end})",
+        "quote": "''",
+    },
+    "sqlite": {
+        "group_concat": "GROUP_CONCAT({col}, '. ')",
+        "integer": "INTEGER",
+        "like": "'%{pattern}'",
+        "datediff": "(JULIANDAY({start}) - JULIANDAY({end}))",
+        "quote": "''",
+    },
+}
+# Columns of the infractions table, with the types used in MySQL (all-null
+# columns are stored without a type in Parquet files)
+INFRACTIONS_COLUMN_TYPES = {
+    "row_id": "INTEGER",
+    "establishment_id": "INTEGER",
+    "inspection_id": "INTEGER",
+    "establishment_name": "VARCHAR",
+    "establishmenttype": "VARCHAR",
+    "establishment_address": "VARCHAR",
+    "latitude": "FLOAT",
+    "longitude": "FLOAT",
+    "establishment_status": "VARCHAR",
+    "minimum_inspections_peryear": "INTEGER",
+    "infraction_details": "VARCHAR",
+    "inspection_date": "DATE",
+    "severity": "VARCHAR",
+    "action": "VARCHAR",
+    "court_outcome": "VARCHAR",
+    "amount_fined": "FLOAT",
+    "filename": "BIGINT",
+}
+
+
+def is_duckdb_uri(uri: str) -> bool:
+    """Check if URI points to an embedded DuckDB database file."""
+    return uri.startswith(DUCKDB_URI_PREFIX)
+
+
+def get_dialect(uri: str) -> str:
+    """Get SQL dialect of database at URI."""
+    if is_duckdb_uri(uri):
+        return "duckdb"
+    return "sqlite" if uri.startswith("sqlite") else "mysql"
+
+
+def get_duckdb_fpath(uri: str) -> str:
+    """Get path to DuckDB database file from its URI."""
+    return uri.replace(DUCKDB_URI_PREFIX, "", 1)
+
+
+def get_sqlite_uri(uri: str) -> str:
+    """Get URI of SQLite database stored next to DuckDB database file."""
+    return f"sqlite:///{os.path.splitext(get_duckdb_fpath(uri))[0]}.sqlite"
+
+
+def get_snapshot_name(fpath: str, storage_mode: str = "memory") -> str:
+    """Get name of snapshot, from path to a cached file or partition part."""
+    if storage_mode == "partitioned":
+        fpath = os.path.dirname(fpath)
+    return os.path.basename(fpath).split("__", 1)[0]
+
+
+def get_snapshot_paths(
+    snapshot_names: Optional[List[str]] = None,
+    storage_mode: str = "memory",
+    cache_dir: str = "data/processed/snapshot_cache",
+    partitions_dir: str = "data/processed/snapshot_partitions",
+) -> List[str]:
+    """Get Parquet files of processed snapshots (cached or partitioned)."""
+    if storage_mode == "partitioned":
+        data_dir = partitions_dir
+        fpaths = [
+            f
+            for f in glob(os.path.join(partitions_dir, "*", "part-*.parquet"))
+            # Only completely written partitions have a metadata file
+            if os.path.exists(
+                os.path.join(os.path.dirname(f), "_metadata.json")
+            )
+        ]
+    else:
+        data_dir = cache_dir
+        fpaths = glob(os.path.join(cache_dir, "*.parquet"))
+    if snapshot_names is not None:
+        fpaths = [
+            f
+            for f in fpaths
+            if get_snapshot_name(f, storage_mode) in snapshot_names
+        ]
+    if not fpaths:
+        raise FileNotFoundError(f"No processed snapshots found in {data_dir}")
+    return sorted(fpaths)
+
+
+def create_infractions_view(
+    uri: str, table_name: str, parquet_paths: List[str]
+) -> None:
+    """Create view of infractions over Parquet files in DuckDB database."""
+    duckdb_fpath = get_duckdb_fpath(uri)
+    os.makedirs(os.path.dirname(duckdb_fpath) or ".", exist_ok=True)
+    # Paths are stored in the view, so they must not depend on the working
+    # directory of later queries (eg. from notebooks)
+    paths_str = ", ".join(f"'{os.path.abspath(f)}'" for f in parquet_paths)
+    cols_str = ",\n            ".join(
+        f"CAST({c} AS {dtype}) AS {c}"
+        for c, dtype in INFRACTIONS_COLUMN_TYPES.items()
+    )
+    conn = duckdb.connect(duckdb_fpath)
+    # Same rows as appended to the MySQL table (duplicates are dropped)
+    conn.execute(
+        f"""
+        CREATE OR REPLACE VIEW {table_name} AS
+        SELECT DISTINCT {cols_str}
+        FROM read_parquet([{paths_str}], union_by_name = true)
+        """
+    )
+    conn.close()
+
+
+def create_geocoded_table(uri: str, table_name: str) -> None:
+    """Create table of geocoded addresses, if not found in database."""
+    engine = get_engine(uri)
+    conn = engine.connect()
+    _ = conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            address TEXT,
+            neighbourhood TEXT,
+            locality TEXT,
+            formattedAddress TEXT,
+            postalCode TEXT,
+            latitude FLOAT,
+            longitude FLOAT
+        )
+        """
+    )
+    conn.close()
+
+
+def read_sql(query: str, uri: str) -> pd.DataFrame:
+    """Get results of query, from DuckDB database file or database server."""
+    if is_duckdb_uri(uri):
+        conn = duckdb.connect(get_duckdb_fpath(uri), read_only=True)
+        # Same datatypes as from pd.read_sql (NaN for missing numbers)
+        df = conn.execute(query).fetch_arrow_table().to_pandas()
+        conn.close()
+        return df
+    engine = get_engine(uri)
+    conn = engine.connect()
+    df = pd.read_sql(query, con=conn)
+    conn.close()
+    return df
+
+
+def sort_concatenated(s: pd.Series, sep: str = ". ") -> pd.Series:
+    """Sort values concatenated into each string of a column."""
+    return s.map(
+        lambda v: sep.join(sorted(v.split(sep))) if isinstance(v, str) else v
+    )
+
+
+def assert_backend_parity(
+    df: pd.DataFrame,
+    df_expected: pd.DataFrame,
+    sort_cols: List[str],
+    concat_cols: Optional[List[str]] = None,
+) -> None:
+    """Check that results from two backends have the same values."""
+    # Order of values concatenated by GROUP_CONCAT (or STRING_AGG) is not
+    # defined, so they are compared after sorting them
+    concat_cols = (
+        ["infractions_summary"] if concat_cols is None else concat_cols
+    )
+    # Backends return different (but equivalent) datatypes
+    dfs = [
+        d.astype({c: str for c in d.select_dtypes("category")})
+        .sort_values(by=sort_cols, kind="stable")
+        .reset_index(drop=True)
+        for d in [df, df_expected]
+    ]
+    for d in dfs:
+        for k, c in enumerate(list(d)):
+            if c in concat_cols:
+                d.iloc[:, k] = sort_concatenated(d.iloc[:, k])
+    # Columns are compared by position, since column names can be repeated
+    # (eg. num_null)
+    pd.testing.assert_frame_equal(
+        dfs[0], dfs[1], check_dtype=False, check_exact=False
+    )
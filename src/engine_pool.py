@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Shared, pooled SQLAlchemy engines for workflow tasks."""
+
+# pylint: disable=invalid-name
+
+import json
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+POOL_SETTINGS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_recycle": 3_600,
+    "pool_pre_ping": True,
+}
+
+_ENGINES: Dict[Tuple[str, str], Engine] = {}
+_POOL_METRICS: Dict[Tuple[str, str], Dict[str, int]] = {}
+_LOCK = threading.Lock()
+
+
+def configure_engine_pool(**pool_settings) -> None:
+    """Change settings used by engines that have not been created yet."""
+    POOL_SETTINGS.update(pool_settings)
+
+
+def _register_pool_metrics(engine: Engine, key: Tuple[str, str]) -> None:
+    """Count connection pool events for an engine."""
+    metrics = {"connects": 0, "checkouts": 0, "checkins": 0, "invalidated": 0}
+    _POOL_METRICS[key] = metrics
+
+    def _increment(name):
+        def _listener(*args):
+            metrics[name] += 1
+
+        return _listener
+
+    event.listen(engine, "connect", _increment("connects"))
+    event.listen(engine, "checkout", _increment("checkouts"))
+    event.listen(engine, "checkin", _increment("checkins"))
+    event.listen(engine, "invalidate", _increment("invalidated"))
+
+
+def get_engine(uri: str, connect_args: Optional[Dict] = None) -> Engine:
+    """Get engine for URI, creating it (once per process) if necessary."""
+    connect_args = connect_args or {}
+    key = (uri, json.dumps(connect_args, sort_keys=True))
+    with _LOCK:
+        if key not in _ENGINES:
+            pool_settings = dict(POOL_SETTINGS)
+            # SQLite engines do not use a size-limited connection pool
+            if uri.startswith("sqlite"):
+                pool_settings.pop("pool_size")
+                pool_settings.pop("max_overflow")
+            engine = create_engine(
+                uri, connect_args=connect_args, **pool_settings
+            )
+            _register_pool_metrics(engine, key)
+            _ENGINES[key] = engine
+    return _ENGINES[key]
+
+
+def get_pool_metrics() -> Dict[str, Dict[str, Union[int, str]]]:
+    """Get connection pool checkout metrics for every engine."""
+    pool_metrics = {}
+    for key, engine in _ENGINES.items():
+        # Engine URL representation hides the database password
+        pool_metrics[repr(engine.url)] = dict(
+            _POOL_METRICS[key],
+            checked_out=engine.pool.checkedout()
+            if hasattr(engine.pool, "checkedout")
+            else 0,
+            status=engine.pool.status(),
+        )
+    return pool_metrics
+
+
+def dispose_engines() -> None:
+    """Close all pooled connections and forget created engines."""
+    with _LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+        _ENGINES.clear()
+        _POOL_METRICS.clear()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Vectorized per-establishment features of inspections."""
+
+# pylint: disable=invalid-name
+
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+ESTABLISHMENT_COLS = [
+    "establishment_id",
+    "establishmenttype",
+    "establishment_address",
+]
+INFRACTION_TYPES = ["minor", "significant", "crucial"]
+ACTION_TYPES = [
+    "action_null",
+    "num_corrected_during_inspection",
+    "num_notice_to_comply",
+    "num_ticket",
+    "num_summons",
+    "num_summons_and_health_hazard_order",
+    "num_closure_order",
+    "num_not_in_compliance",
+    "num_order",
+    "num_education_provided",
+    "num_warning_letter",
+    "num_recommendations",
+    "num_prohibition_order_requested",
+]
+COURT_OUTCOME_TYPES = [
+    "court_outcome_null",
+    "num_conviction_fined",
+    "num_pending",
+    "num_charges_withdrawn",
+    "num_conviction_suspended_sentence",
+    "num_conviction_ordered_to_close_by_court",
+    "num_charges_dismissed",
+    "num_charges_quashed",
+    "num_conviction_probationary_order",
+    "num_cancelled",
+    "num_conviction_fined_order_to_close_by_court",
+]
+
+
+def rename_null_columns(
+    df: pd.DataFrame,
+    null_col_names: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Rename the num_null columns (action, then court outcome)."""
+    null_cols = iter(null_col_names or ["action_null", "court_outcome_null"])
+    return df.set_axis(
+        [
+            next(null_cols, c) if c in ("num_null", "num_null.1") else c
+            for c in list(df)
+        ],
+        axis=1,
+    )
+
+
+def get_segment_starts(df: pd.DataFrame) -> np.ndarray:
+    """Get mask of first row of each establishment, in sorted rows."""
+    is_start = np.zeros(len(df), dtype=bool)
+    is_start[:1] = True
+    for c in ESTABLISHMENT_COLS:
+        values = df[c].to_numpy()
+        is_start[1:] |= values[1:] != values[:-1]
+    return is_start
+
+
+def segment_lag(values: np.ndarray, is_start: np.ndarray) -> np.ndarray:
+    """Get value of previous row within each segment (NaN for first)."""
+    lagged = np.empty(values.shape, dtype=np.float64)
+    lagged[1:] = values[:-1]
+    lagged[is_start] = np.nan
+    return lagged
+
+
+def segment_cumsum(
+    values: np.ndarray, segment_ids: np.ndarray, is_start: np.ndarray
+) -> np.ndarray:
+    """Get running total within each segment, skipping (keeping) NaNs."""
+    is_missing = np.isnan(values)
+    filled = np.where(is_missing, 0, values)
+    totals = np.cumsum(filled, axis=0)
+    # Subtract running total before the start of each segment
+    offsets = (totals - filled)[is_start][segment_ids]
+    cumsums = totals - offsets
+    cumsums[is_missing] = np.nan
+    return cumsums
+
+
+def add_establishment_features(
+    df: pd.DataFrame,
+    action_types: Optional[List[str]] = None,
+    court_outcome_types: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Add features from past inspections of the same establishment."""
+    action_types = action_types or ACTION_TYPES
+    court_outcome_types = court_outcome_types or COURT_OUTCOME_TYPES
+    # Sort once and find segments (establishments) once
+    df = df.sort_values(
+        by=ESTABLISHMENT_COLS + ["inspection_date"],
+        kind="stable",
+        ignore_index=True,
+    )
+    n_infrac = len(INFRACTION_TYPES)
+    is_start = get_segment_starts(df)
+    segment_ids = np.cumsum(is_start) - 1
+    row_numbers = np.arange(len(df))
+    cumulative_inspections = (
+        row_numbers - np.flatnonzero(is_start)[segment_ids]
+    ).astype(np.int32)
+
+    # Features from the previous inspection, in one 2D block
+    lag_cols = (
+        [f"num_{t}" for t in INFRACTION_TYPES] + action_types
+    ) + court_outcome_types
+    lag_names = (
+        [f"num_{t}_prev" for t in INFRACTION_TYPES]
+        + [f"num_{t.replace('num_', 'action_')}_prev" for t in action_types]
+        + [
+            f"num_{t.replace('num_', 'court_outcome_')}_prev"
+            for t in court_outcome_types
+        ]
+    )
+    lags = segment_lag(df[lag_cols].to_numpy(dtype=np.float64), is_start)
+    dates = df["inspection_date"].to_numpy(dtype="datetime64[D]")
+    date_days = dates.astype(np.int64).astype(np.float64)
+    last_date_days = segment_lag(date_days, is_start)
+    statuses = df["establishment_status"].to_numpy()
+    last_statuses = np.empty(len(df), dtype=object)
+    last_statuses[1:] = statuses[:-1]
+    last_statuses[is_start] = None
+
+    # Running totals, in one 2D block
+    is_fail = (statuses == "Closed").astype(np.float64)
+    num_infrac = df[[f"num_{t}" for t in INFRACTION_TYPES]].to_numpy(
+        dtype=np.float64
+    )
+    cum_inputs = np.column_stack([is_fail, num_infrac, lags[:, n_infrac:]])
+    cumsums = segment_cumsum(cum_inputs, segment_ids, is_start)
+    cumulative_failures, cumulative_infrac, cumulative_lags = np.split(
+        cumsums, [1, n_infrac + 1], axis=1
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        proportions = (
+            np.column_stack([cumulative_failures, cumulative_infrac])
+            / cumulative_inspections[:, None]
+        )
+
+    # Datetime attributes of the current and previous inspection
+    last_dates = np.empty(len(df), dtype="datetime64[ns]")
+    last_dates[1:] = df["inspection_date"].to_numpy()[:-1]
+    last_dates[is_start] = np.datetime64("NaT")
+    last_dates = pd.Series(last_dates)
+    inspection_dates = df["inspection_date"]
+
+    float_block = pd.DataFrame(
+        np.column_stack(
+            [
+                date_days - last_date_days,
+                lags,
+                cumulative_lags,
+                proportions,
+                last_date_days - date_days,
+            ]
+        ).astype(np.float32),
+        columns=(
+            ["time_since_last_infrac"]
+            + lag_names
+            + [f"cumulative_{c}" for c in lag_names[n_infrac:]]
+            + ["proportion_past_failures"]
+            + [f"proportion_past_{t}" for t in INFRACTION_TYPES]
+            + ["days_since_last_inspection"]
+        ),
+    )
+    int_block = pd.DataFrame(
+        np.column_stack(
+            [cumulative_failures, cumulative_infrac, cumulative_inspections]
+        ).astype(np.int32),
+        columns=(
+            ["cumulative_failures"]
+            + [f"cumulative_{t}" for t in INFRACTION_TYPES]
+            + ["cumulative_inspections"]
+        ),
+    )
+    bool_block = pd.DataFrame(
+        np.column_stack(
+            [
+                last_statuses == "Pass",
+                last_statuses == "Conditional Pass",
+                cumulative_failures[:, 0] != 0,
+                cumulative_infrac > 0,
+            ]
+        ),
+        columns=["last_pass", "last_cond_pass", "ever_failed"]
+        + [f"ever_{t}" for t in INFRACTION_TYPES],
+    )
+    date_block = pd.DataFrame(
+        {
+            f"{prefix}_{attr}": values
+            for prefix, dates_series in [
+                ("last_inspection", last_dates),
+                ("inspection", inspection_dates),
+            ]
+            for attr, values in [
+                ("month", dates_series.dt.month),
+                ("weekday", dates_series.dt.weekday),
+                ("weekofyear", dates_series.dt.isocalendar().week),
+                ("quarter", dates_series.dt.quarter),
+                ("year", dates_series.dt.year),
+            ]
+        }
+    )
+    return pd.concat(
+        [df, float_block, int_block, bool_block, date_block], axis=1
+    )
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Concurrent, rate-limited geocoding of street addresses."""
+
+# pylint: disable=invalid-name
+
+import json
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from random import uniform
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, Iterator, List, Optional, Union
+
+from geopy.exc import (
+    GeocoderQuotaExceeded,
+    GeocoderTimedOut,
+    GeocoderUnavailable,
+)
+
+# Errors after which a request is retried (GeocoderRateLimited is a
+# subclass of GeocoderQuotaExceeded)
+RETRY_EXCEPTIONS = (
+    GeocoderTimedOut,
+    GeocoderQuotaExceeded,
+    GeocoderUnavailable,
+)
+
+
+class GeocodingProvider(ABC):
+    """Interface to a geocoding service."""
+
+    @abstractmethod
+    def geocode(self, street_address: str) -> Dict[str, Union[str, None]]:
+        """Geocode a single street address."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting the rate of requests."""
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            sleep(wait_seconds)
+
+
+def geocode_with_backoff(
+    provider: GeocodingProvider,
+    street_address: str,
+    bucket: TokenBucket,
+    max_retries: int = 5,
+    backoff_seconds: float = 1.0,
+) -> Dict[str, Union[str, None]]:
+    """Geocode street address, retrying with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            return provider.geocode(street_address)
+        except RETRY_EXCEPTIONS:
+            # Error is raised instead of returning a record without a
+            # location, which would be stored and never geocoded again
+            if attempt == max_retries:
+                raise
+            # Exponential backoff with jitter
+            sleep(backoff_seconds * 2**attempt + uniform(0, backoff_seconds))
+
+
+def read_checkpoint(
+    checkpoint_fpath: Optional[str],
+) -> Dict[str, Dict[str, Union[str, None]]]:
+    """Load geocoded records saved by an earlier, interrupted run."""
+    records = {}
+    if checkpoint_fpath and os.path.exists(checkpoint_fpath):
+        with open(checkpoint_fpath) as f:
+            for line in f:
+                # Skip last line, if it was only partially written
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record["address"]] = record
+    return records
+
+
+def geocode_addresses(
+    street_addresses: List[str],
+    provider: GeocodingProvider,
+    requests_per_second: float = 1.0,
+    max_in_flight: int = 4,
+    max_retries: int = 5,
+    backoff_seconds: float = 1.0,
+    checkpoint_fpath: Optional[str] = None,
+) -> Iterator[Dict[str, Union[str, None]]]:
+    """Geocode street addresses concurrently and yield geocoded records."""
+    # Records geocoded in an earlier run are not geocoded again
+    checkpointed_records = read_checkpoint(checkpoint_fpath)
+    for street_address in street_addresses:
+        if street_address in checkpointed_records:
+            yield checkpointed_records[street_address]
+    street_addresses = [
+        street_address
+        for street_address in street_addresses
+        if street_address not in checkpointed_records
+    ]
+    if not street_addresses:
+        return
+
+    if checkpoint_fpath:
+        os.makedirs(os.path.dirname(checkpoint_fpath) or ".", exist_ok=True)
+    bucket = TokenBucket(requests_per_second, capacity=max_in_flight)
+    addresses = iter(street_addresses)
+    futures = set()
+    error = None
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        while True:
+            # Requests are only submitted when a worker is free and no
+            # request failed, so that no further (paid) requests are sent
+            # after an error
+            if error is None:
+                for street_address in islice(
+                    addresses, max_in_flight - len(futures)
+                ):
+                    futures.add(
+                        executor.submit(
+                            geocode_with_backoff,
+                            provider,
+                            street_address,
+                            bucket,
+                            max_retries,
+                            backoff_seconds,
+                        )
+                    )
+            if not futures:
+                break
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                record = future.result()
+                # Save progress, so that an interrupted run can be resumed
+                if checkpoint_fpath:
+                    with open(checkpoint_fpath, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                yield record
+    # Error is raised once records of requests still running when it
+    # occurred have been saved
+    if error is not None:
+        raise error
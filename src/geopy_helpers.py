@@ -6,130 +6,156 @@
 
 
 import os
-from random import randint
-from time import sleep
 
 import pandas as pd
-from geopy.exc import GeocoderTimedOut
 from geopy.geocoders import Bing
-from sqlalchemy import create_engine
 
+from src.address_cache import AddressCache, canonicalize_address
+from src.bulk_load_helpers import bulk_load
+from src.engine_pool import get_engine
+from src.geocoding_engine import GeocodingProvider, geocode_addresses
 
-def run_bing_geocoder(row_number, street_address, verbose: bool = False):
-    """Geocode a single street addresses."""
-    # Set up the Bing Geocoder
-    geolocator = Bing(os.getenv("BING_MAPS_KEY"))
 
-    # Perform geocoding
-    try:
-        # Geocode a single street address
-        location = geolocator.geocode(
+def get_missing_record(street_address):
+    """Get geocoded output with None for a street address not geocoded."""
+    return {
+        "address": street_address,
+        "neighbourhood": None,
+        "locality": None,
+        "formattedAddress": None,
+        "postalCode": None,
+        "latitude": None,
+        "longitude": None,
+    }
+
+
+def get_bing_record(street_address, location):
+    """Get geocoded output from location found by the Bing geocoder."""
+    # Get the street address key from the .raw attribute of the geocoded
+    # output
+    address_components = location.raw["address"]
+    # Get the neighbourhood (if available)
+    neighbourhood = (
+        address_components["neighborhood"]
+        if "neighborhood" in list(address_components)
+        else None
+    )
+    # Get the locality (if available)
+    locality = address_components["locality"]
+    # Get the latitude and longitude coordinates
+    lat, lon = location.raw["point"]["coordinates"]
+    # Store geocoded output in a dictionary
+    return {
+        "address": street_address,
+        "neighbourhood": neighbourhood,
+        "locality": locality,
+        "formattedAddress": address_components["formattedAddress"]
+        if "formattedAddress" in address_components
+        else None,
+        "postalCode": address_components["postalCode"]
+        if "postalCode" in address_components
+        else None,
+        "latitude": lat,
+        "longitude": lon,
+    }
+
+
+class BingGeocoder(GeocodingProvider):
+    """Geocoding provider using a single, reused Bing geocoder client."""
+
+    def __init__(self, api_key=None):
+        self.geolocator = Bing(api_key or os.getenv("BING_MAPS_KEY"))
+
+    def geocode(self, street_address):
+        """Geocode a single street address."""
+        location = self.geolocator.geocode(
             street_address, include_neighborhood=True, exactly_one=True
         )
-        # Get the street address key from the .raw attribute of the geocoded
-        # output
-        address_components = location.raw["address"]
-        # Get the neighbourhood (if available)
-        neighbourhood = (
-            address_components["neighborhood"]
-            if "neighborhood" in list(address_components)
-            else None
-        )
-        # Get the locality (if available)
-        locality = address_components["locality"]
-        # Get the latitude and longitude coordinates
-        lat, lon = location.raw["point"]["coordinates"]
-        # Store geocoded output in a dictionary
-        record = {
-            "address": street_address,
-            "neighbourhood": neighbourhood,
-            "locality": locality,
-            "formattedAddress": address_components["formattedAddress"]
-            if "formattedAddress" in address_components
-            else None,
-            "postalCode": address_components["postalCode"]
-            if "postalCode" in address_components
-            else None,
-            "latitude": lat,
-            "longitude": lon,
-        }
-        if verbose:
-            print(
-                f"{row_number}: Geocode completed for {street_address}", end=""
-            )
-    except GeocoderTimedOut as e:
-        # If geocoding did not work, create dictionary with None for each key
-        # in the dictionary where geocoding was successful
-        if verbose:
-            print(
-                "{} - Error: geocode failed on input {} with msg: {}".format(
-                    row_number, street_address, e.message
-                )
-            )
-        record = {
-            "address": street_address,
-            "neighbourhood": None,
-            "locality": None,
-            "formattedAddress": None,
-            "postalCode": None,
-            "latitude": None,
-            "longitude": None,
-        }
-    return record
+        if location is None:
+            return get_missing_record(street_address)
+        return get_bing_record(street_address, location)
+
+
+def append_geocoded_records(records, conn, db_table_name) -> None:
+    """Append batch of geocoded outputs to database table."""
+    df_geocoded = pd.DataFrame.from_records(records).astype(
+        {"latitude": float, "longitude": float}
+    )
+    bulk_load(df_geocoded, conn, db_table_name, "multirow")
 
 
 def geocode_missing_lat_lon(
     unique_addresses_missing_lat_lon,
     db_table_name=None,
     uri=None,
-    min_delay_seconds=5,
-    max_delay_seconds=10,
+    requests_per_second: float = 1.0,
+    max_in_flight: int = 4,
     verbose: bool = False,
+    batch_size: int = 50,
+    provider: GeocodingProvider = None,
+    checkpoint_dir: str = "data/processed",
+    cache_fpath: str = "data/processed/geocode_cache.sqlite",
 ):
     """Geocode a column with one or more street addresses."""
-    engine = create_engine(uri)
+    engine = get_engine(uri)
     conn = engine.connect()
-    # Iterate over all street addresses to be geocoded
-    for row_num, street_address in unique_addresses_missing_lat_lon.items():
-        # Clean the street address
-        street_address_clean = street_address.replace("'", "\\'")
-        # Query local database for existing record with street address
-        df_query = pd.read_sql(
-            f"""
-            SELECT COUNT(*) AS num_matching_street_addresses
-            FROM {db_table_name}
-            WHERE address = '{street_address_clean}'
-            """,
-            con=conn,
+    address_cache = AddressCache(cache_fpath)
+    # Add geocoded outputs from local database to cache, if not found there
+    df_geocoded = pd.read_sql(f"SELECT * FROM {db_table_name}", con=conn)
+    df_geocoded = df_geocoded.astype(object).where(df_geocoded.notna(), None)
+    cached = address_cache.get_many(df_geocoded["address"])
+    address_cache.put_many(
+        [
+            record
+            for record in df_geocoded.to_dict("records")
+            if canonicalize_address(record["address"]) not in cached
+        ]
+    )
+    # Only geocode one spelling of each street address not found in cache
+    canonical_addresses = unique_addresses_missing_lat_lon.map(
+        canonicalize_address
+    )
+    is_geocoded = canonical_addresses.isin(
+        list(address_cache.get_many(unique_addresses_missing_lat_lon))
+    )
+    addresses_to_geocode = unique_addresses_missing_lat_lon[
+        ~is_geocoded & ~canonical_addresses.duplicated()
+    ]
+    if verbose:
+        print(
+            f"Found existing records for {is_geocoded.sum():,} street "
+            f"addresses. Geocoding {len(addresses_to_geocode):,} street "
+            "addresses."
         )
-        # If geocoded output is not available in local database, then preform
-        # geocoding for street address
-        if df_query["num_matching_street_addresses"].iloc[0] == 0:
-            # Geocode
-            geocoded_output = run_bing_geocoder(
-                row_num, street_address, verbose
-            )
-            # Pause
-            if verbose:
-                print("...Pausing...", end="")
-            sleep(randint(min_delay_seconds, max_delay_seconds))
-            if verbose:
-                print("Done.")
-            # Convert dictionary of geocoded outputs to DataFrame
-            df_geocoded = pd.DataFrame.from_dict(
-                geocoded_output, orient="index"
-            ).T.astype({"latitude": float, "longitude": float})
-            # Append DataFrame of geocoded outputs to database
-            df_geocoded.to_sql(
-                name=db_table_name, con=conn, index=False, if_exists="append"
-            )
-        else:
-            # If geocoded output is available in local database, then do not
-            # geocode the same street address
-            if verbose:
-                print(
-                    f"{row_num}: Found existing record for {street_address}. "
-                    "Did nothing."
-                )
+    # Geocode concurrently, within the rate limit of the geocoding service
+    checkpoint_fpath = os.path.join(
+        checkpoint_dir, f"{db_table_name}_geocoding_checkpoint.jsonl"
+    )
+    records = []
+    for k, record in enumerate(
+        geocode_addresses(
+            addresses_to_geocode.tolist(),
+            provider or BingGeocoder(),
+            requests_per_second,
+            max_in_flight,
+            checkpoint_fpath=checkpoint_fpath,
+        ),
+        start=1,
+    ):
+        records.append(record)
+        if verbose:
+            print(f"{k}: Geocode completed for {record['address']}")
+        # Append batches of geocoded outputs to database, so that progress is
+        # not lost if geocoding is interrupted
+        if len(records) == batch_size:
+            append_geocoded_records(records, conn, db_table_name)
+            address_cache.put_many(records)
+            records = []
+    if records:
+        append_geocoded_records(records, conn, db_table_name)
+        address_cache.put_many(records)
     conn.close()
-    engine.dispose()
+    address_cache.close()
+    # All geocoded outputs are in database, so checkpoint is not needed
+    if os.path.exists(checkpoint_fpath):
+        os.remove(checkpoint_fpath)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Incremental recomputation of establishments changed by new data."""
+
+# pylint: disable=invalid-name
+
+import os
+from typing import List, Optional
+
+import pandas as pd
+
+ESTABLISHMENT_COLS = [
+    "establishment_id",
+    "establishmenttype",
+    "establishment_address",
+]
+
+
+def get_touched_fpath(table_name: str, data_dir: str) -> str:
+    """Get path to file with establishments waiting to be recomputed."""
+    return os.path.join(data_dir, f"{table_name}_touched_establishments.csv")
+
+
+def read_touched_establishments(
+    table_name: str, data_dir: str = "data/processed"
+) -> pd.DataFrame:
+    """Get establishments changed since they were last recomputed."""
+    touched_fpath = get_touched_fpath(table_name, data_dir)
+    if not os.path.exists(touched_fpath):
+        return pd.DataFrame(columns=ESTABLISHMENT_COLS)
+    return pd.read_csv(touched_fpath)
+
+
+def add_touched_establishments(
+    df: pd.DataFrame, table_name: str, data_dir: str = "data/processed"
+) -> None:
+    """Record establishments changed by appended or deleted infractions."""
+    # Establishments are kept until recomputed, so that they are not lost if
+    # a run is interrupted after loading new data
+    df_touched = (
+        pd.concat(
+            [read_touched_establishments(table_name, data_dir), df],
+            ignore_index=True,
+        )[ESTABLISHMENT_COLS]
+        .drop_duplicates()
+        .astype({"establishment_id": int})
+    )
+    os.makedirs(data_dir, exist_ok=True)
+    touched_fpath = get_touched_fpath(table_name, data_dir)
+    df_touched.to_csv(f"{touched_fpath}.tmp", index=False)
+    os.replace(f"{touched_fpath}.tmp", touched_fpath)
+
+
+def clear_touched_establishments(
+    table_name: str, data_dir: str = "data/processed"
+) -> None:
+    """Forget establishments after they were recomputed."""
+    touched_fpath = get_touched_fpath(table_name, data_dir)
+    if os.path.exists(touched_fpath):
+        os.remove(touched_fpath)
+
+
+def filter_establishments(
+    df: pd.DataFrame, df_touched: pd.DataFrame
+) -> pd.DataFrame:
+    """Keep rows of a DataFrame belonging to given establishments."""
+    return df.merge(
+        df_touched[ESTABLISHMENT_COLS].drop_duplicates(),
+        on=ESTABLISHMENT_COLS,
+        how="inner",
+    )
+
+
+def merge_recomputed_establishments(
+    df_recomputed: pd.DataFrame,
+    df_touched: Optional[pd.DataFrame],
+    table_fpath: str,
+    sort_cols: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Replace rows of recomputed establishments in a persisted table."""
+    # All establishments were recomputed if none were specified
+    if df_touched is not None and os.path.exists(table_fpath):
+        df = pd.read_parquet(table_fpath)
+        # Drop all rows of recomputed establishments, including those that
+        # are no longer found after recomputing
+        is_touched = (
+            df[ESTABLISHMENT_COLS]
+            .merge(
+                df_touched[ESTABLISHMENT_COLS].drop_duplicates(),
+                on=ESTABLISHMENT_COLS,
+                how="left",
+                indicator=True,
+            )["_merge"]
+            .eq("both")
+            .to_numpy()
+        )
+        df = pd.concat([df[~is_touched], df_recomputed], ignore_index=True)
+    else:
+        df = df_recomputed
+    df = df.sort_values(
+        by=sort_cols or ESTABLISHMENT_COLS + ["inspection_date"],
+        ignore_index=True,
+    )
+    os.makedirs(os.path.dirname(table_fpath) or ".", exist_ok=True)
+    df.to_parquet(f"{table_fpath}.tmp", index=False)
+    os.replace(f"{table_fpath}.tmp", table_fpath)
+    return df
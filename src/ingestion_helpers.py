@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Incremental ingestion of infractions, using hashes of rows."""
+
+# pylint: disable=invalid-name
+
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_float_dtype, is_integer_dtype
+from sqlalchemy import bindparam, text
+
+# Columns identifying an infraction across data snapshots (row_id is only
+# the position of the row within a snapshot)
+ROW_KEY_COLS = [
+    "establishment_id",
+    "inspection_id",
+    "inspection_date",
+    "infraction_details",
+    "severity",
+]
+# Columns not compared when looking for changed infractions
+NON_VALUE_COLS = ["row_id", "filename", "row_key", "row_hash"]
+
+
+def get_canonical_values(s: pd.Series) -> pd.Series:
+    """Get values of a column in a form that does not depend on its dtype."""
+    # Hashes are compared with hashes stored by earlier runs, so they must
+    # not change when compact dtypes of columns change (eg. float64 to
+    # float32, or object to category)
+    if s.dtype == bool or (is_integer_dtype(s.dtype) and s.notna().all()):
+        return s.astype("int64")
+    if is_float_dtype(s.dtype):
+        # Values are compared with the precision they are stored with
+        return s.astype("float32")
+    if s.dtype == object or isinstance(s.dtype, pd.CategoricalDtype):
+        return s.astype(object).where(s.notna(), None)
+    return s
+
+
+def hash_rows(df: pd.DataFrame) -> pd.Series:
+    """Get signed 64-bit hash of each row, to fit a BIGINT column."""
+    df_canonical = pd.DataFrame(
+        {c: get_canonical_values(df[c]) for c in list(df)}, index=df.index
+    )
+    return pd.Series(
+        pd.util.hash_pandas_object(df_canonical, index=False)
+        .to_numpy()
+        .view("int64"),
+        index=df.index,
+    )
+
+
+class OccurrenceCounts:
+    """Counts of identical infractions found in earlier parts of snapshots."""
+
+    def __init__(self):
+        self.counts = pd.Series(dtype="int64")
+
+    def get_occurrence(self, df: pd.DataFrame) -> np.ndarray:
+        """Get order of appearance of identical infractions, across parts."""
+        keys = hash_rows(df[ROW_KEY_COLS + ["filename"]])
+        occurrence = keys.groupby(keys, sort=False).cumcount().to_numpy()
+        occurrence += (
+            self.counts.reindex(keys.to_numpy()).fillna(0).to_numpy("int64")
+        )
+        self.counts = self.counts.add(keys.value_counts(), fill_value=0)
+        return occurrence
+
+
+def add_row_hashes(
+    df: pd.DataFrame, occurrence_counts: Optional[OccurrenceCounts] = None
+) -> pd.DataFrame:
+    """Add key and content hashes of infractions."""
+    # Identical infractions within the same inspection are told apart by
+    # their order of appearance in the snapshot (which continues across
+    # parts of a snapshot, if it is read in parts)
+    if occurrence_counts is not None:
+        occurrence = occurrence_counts.get_occurrence(df)
+    else:
+        occurrence = df.groupby(
+            ROW_KEY_COLS + ["filename"],
+            sort=False,
+            dropna=False,
+            observed=True,
+        ).cumcount()
+    value_cols = [c for c in list(df) if c not in NON_VALUE_COLS]
+    return df.assign(
+        row_key=hash_rows(df[ROW_KEY_COLS].assign(occurrence=occurrence)),
+        row_hash=hash_rows(df[value_cols]),
+    )
+
+
+def check_row_keys(conn, table_name: str) -> None:
+    """Check that all rows of database table have a key."""
+    # Rows appended before keys were added (or by full ingestion into a
+    # table created earlier) have no key, so they would be appended again
+    num_missing = pd.read_sql(
+        f"""
+        SELECT COUNT(*) AS num_missing
+        FROM {table_name}
+        WHERE row_key IS NULL
+        """,
+        con=conn,
+    )["num_missing"].iloc[0]
+    if num_missing:
+        raise ValueError(
+            f"Found {num_missing:,} rows without a row_key in database table "
+            f"{table_name}, so new infractions cannot be told apart from "
+            "existing ones. Reload the table with ingestion_mode="
+            "'incremental' (starting from an empty table) before using "
+            "incremental ingestion."
+        )
+
+
+class RowKeyIndex:
+    """Persistent index of hashes of infractions found in database table."""
+
+    def __init__(
+        self, conn, table_name: str, index_dir: str = "data/processed"
+    ):
+        self.index_fpath = os.path.join(
+            index_dir, f"{table_name}_row_key_index.parquet"
+        )
+        if os.path.exists(self.index_fpath):
+            df = pd.read_parquet(self.index_fpath)
+        else:
+            # Rebuild the index from the hashes stored in the table
+            df = pd.read_sql(
+                f"""
+                SELECT row_key, row_hash
+                FROM {table_name}
+                WHERE row_key IS NOT NULL
+                """,
+                con=conn,
+            )
+        self.row_hashes = pd.Series(
+            df["row_hash"].to_numpy(dtype="int64"),
+            index=df["row_key"].to_numpy(dtype="int64"),
+        )
+
+    def get_delta(self, df: pd.DataFrame) -> List:
+        """Get new or changed infractions and keys of changed infractions."""
+        existing_hashes = self.row_hashes.reindex(df["row_key"]).to_numpy()
+        is_new = pd.isna(existing_hashes)
+        is_changed = ~is_new & (existing_hashes != df["row_hash"].to_numpy())
+        changed_keys = df.loc[is_changed, "row_key"].tolist()
+        return [df[is_new | is_changed], changed_keys]
+
+    def update(self, df: pd.DataFrame) -> None:
+        """Add hashes of appended infractions to index and save it."""
+        row_hashes = pd.Series(
+            df["row_hash"].to_numpy(), index=df["row_key"].to_numpy()
+        )
+        self.row_hashes = pd.concat([self.row_hashes, row_hashes])
+        self.row_hashes = self.row_hashes[
+            ~self.row_hashes.index.duplicated(keep="last")
+        ]
+        os.makedirs(os.path.dirname(self.index_fpath) or ".", exist_ok=True)
+        tmp_fpath = f"{self.index_fpath}.tmp"
+        pd.DataFrame(
+            {
+                "row_key": self.row_hashes.index,
+                "row_hash": self.row_hashes.to_numpy(),
+            }
+        ).to_parquet(tmp_fpath, index=False)
+        os.replace(tmp_fpath, self.index_fpath)
+
+
+class SeenKeys:
+    """Keys of infractions found in snapshots already processed in a run."""
+
+    def __init__(self):
+        self.keys = np.array([], dtype="int64")
+
+    def isin(self, row_keys: pd.Series) -> np.ndarray:
+        """Check which keys were already found."""
+        return np.isin(row_keys.to_numpy(), self.keys)
+
+    def update(self, row_keys: pd.Series) -> None:
+        """Add found keys."""
+        # Keys are kept as a sorted array, instead of a set of Python ints
+        self.keys = np.union1d(self.keys, row_keys.to_numpy(dtype="int64"))
+
+
+def get_new_infractions(
+    dfs: List[pd.DataFrame],
+    row_key_index: RowKeyIndex,
+    seen_keys: Optional[SeenKeys] = None,
+    occurrence_counts: Optional[OccurrenceCounts] = None,
+) -> List:
+    """Get infractions not yet in database table, from data snapshots."""
+    dfs = [add_row_hashes(df, occurrence_counts) for df in dfs if not df.empty]
+    if not dfs:
+        return [pd.DataFrame(), []]
+    df = pd.concat(dfs, ignore_index=True)
+    # Keep version of an infraction from the most recent snapshot
+    df = df.sort_values(by="filename", kind="stable").drop_duplicates(
+        subset=["row_key"], keep="last"
+    )
+    if seen_keys is not None:
+        # Snapshots can be processed one at a time (most recent first), so
+        # infractions found in more recent snapshots are skipped
+        row_keys = df["row_key"]
+        df = df[~seen_keys.isin(row_keys)]
+        seen_keys.update(row_keys)
+    return row_key_index.get_delta(df)
+
+
+def delete_rows_by_key(
+    conn, table_name: str, row_keys: List[int], chunksize: int = 1_000
+) -> None:
+    """Delete rows with given keys from database table."""
+    query = text(
+        f"DELETE FROM {table_name} WHERE row_key IN :row_keys"
+    ).bindparams(bindparam("row_keys", expanding=True))
+    for start in range(0, len(row_keys), chunksize):
+        end = start + chunksize
+        conn.execute(query, {"row_keys": row_keys[start:end]})
+
+
+def get_establishments_by_key(
+    conn, table_name: str, row_keys: List[int], chunksize: int = 1_000
+) -> pd.DataFrame:
+    """Get establishments of rows with given keys in database table."""
+    query = text(
+        f"""
+        SELECT DISTINCT establishment_id,
+            establishmenttype,
+            establishment_address
+        FROM {table_name}
+        WHERE row_key IN :row_keys
+        """
+    ).bindparams(bindparam("row_keys", expanding=True))
+    dfs = []
+    for start in range(0, len(row_keys), chunksize):
+        end = start + chunksize
+        dfs.append(
+            pd.read_sql(
+                query, con=conn, params={"row_keys": row_keys[start:end]}
+            )
+        )
+    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Timing, memory, I/O and database metrics of workflow tasks and flows."""
+
+# pylint: disable=invalid-name
+
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter, thread_time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+INSTRUMENTATION_SETTINGS = {
+    "enabled": True,
+    # Save a cProfile capture (.prof file) of every call
+    "profile": False,
+    "profile_dir": "reports/profiles",
+}
+
+_METRICS: List[Dict] = []
+_LOCK = threading.Lock()
+# Metrics of calls running in each thread (a flow and the tasks it calls
+# directly can run in the same thread)
+_ACTIVE = threading.local()
+
+
+def configure_instrumentation(**settings) -> None:
+    """Change settings used by instrumented calls that start afterwards."""
+    INSTRUMENTATION_SETTINGS.update(settings)
+
+
+def _count_round_trip(*args) -> None:
+    """Count query sent to a database by calls running in this thread."""
+    for record in getattr(_ACTIVE, "records", []):
+        record["db_round_trips"] += 1
+
+
+# Queries of every engine are counted
+event.listen(Engine, "before_cursor_execute", _count_round_trip)
+
+
+def count_rows(obj) -> int:
+    """Count rows of DataFrames (or partitions) in a (nested) object."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, (list, tuple)):
+        return sum(map(count_rows, obj))
+    if isinstance(obj, dict):
+        # Metadata of a partition written to disk
+        return int(obj.get("num_rows", 0))
+    return 0
+
+
+def get_io_counters() -> Tuple[Optional[int], Optional[int]]:
+    """Get bytes read and written by this process (files and sockets)."""
+    # Only available on Linux
+    if not os.path.exists("/proc/self/io"):
+        return None, None
+    with open("/proc/self/io") as f:
+        counters = dict(line.split(": ") for line in f.read().splitlines())
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+def get_peak_rss_mb() -> Optional[float]:
+    """Get peak resident memory of this process so far, in MB."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes on Linux
+    return max_rss / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def instrument(func: Callable) -> Callable:
+    """Record time, memory, rows, I/O and database round trips of calls."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not INSTRUMENTATION_SETTINGS["enabled"]:
+            return func(*args, **kwargs)
+        record = {
+            "name": func.__name__,
+            "started_at": datetime.now().isoformat(),
+            "status": "failed",
+            "rows_in": count_rows([args, list(kwargs.values())]),
+            "rows_out": 0,
+            "db_round_trips": 0,
+        }
+        records = _ACTIVE.__dict__.setdefault("records", [])
+        records.append(record)
+        # Only one profiler can be active in a thread, so calls nested in a
+        # profiled call are not profiled separately
+        profiler = None
+        if INSTRUMENTATION_SETTINGS["profile"] and not getattr(
+            _ACTIVE, "profiling", False
+        ):
+            profiler = cProfile.Profile()
+            _ACTIVE.profiling = True
+        bytes_read_start, bytes_written_start = get_io_counters()
+        start_wall, start_cpu = perf_counter(), thread_time()
+        try:
+            if profiler is not None:
+                result = profiler.runcall(func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+            record["status"] = "completed"
+            record["rows_out"] = count_rows(result)
+            return result
+        finally:
+            # CPU time is only that of the thread running the call, and I/O
+            # is that of the whole process (including concurrent calls)
+            record["wall_seconds"] = perf_counter() - start_wall
+            record["cpu_seconds"] = thread_time() - start_cpu
+            record["peak_rss_mb"] = get_peak_rss_mb()
+            bytes_read, bytes_written = get_io_counters()
+            if bytes_read is not None:
+                record["bytes_read"] = bytes_read - bytes_read_start
+                record["bytes_written"] = bytes_written - bytes_written_start
+            records.remove(record)
+            if profiler is not None:
+                _ACTIVE.profiling = False
+                profile_dir = INSTRUMENTATION_SETTINGS["profile_dir"]
+                os.makedirs(profile_dir, exist_ok=True)
+                record["profile_fpath"] = os.path.join(
+                    profile_dir,
+                    f"{func.__name__}__"
+                    f"{record['started_at'].replace(':', '')}.prof",
+                )
+                profiler.dump_stats(record["profile_fpath"])
+            collected = getattr(_ACTIVE, "collected", None)
+            if collected is not None:
+                collected.append(record)
+            else:
+                with _LOCK:
+                    _METRICS.append(record)
+
+    return wrapper
+
+
+@contextmanager
+def collect_metrics() -> Iterator[List[Dict]]:
+    """Collect metrics of calls in this thread, instead of recording them."""
+    # Calls run by Dask workers (separate processes) cannot record metrics
+    # of the flow, so their metrics are returned with their results
+    previous = getattr(_ACTIVE, "collected", None)
+    _ACTIVE.collected = []
+    try:
+        yield _ACTIVE.collected
+    finally:
+        _ACTIVE.collected = previous
+
+
+def add_metrics(records: List[Dict]) -> None:
+    """Record metrics of calls collected in another process."""
+    with _LOCK:
+        _METRICS.extend(records)
+
+
+def get_metrics() -> pd.DataFrame:
+    """Get metrics of every instrumented call since they were last cleared."""
+    with _LOCK:
+        return pd.DataFrame.from_records(list(_METRICS))
+
+
+def clear_metrics() -> None:
+    """Remove recorded metrics of instrumented calls."""
+    with _LOCK:
+        _METRICS.clear()
+
+
+def get_metrics_summary(df_metrics: pd.DataFrame) -> pd.DataFrame:
+    """Get total metrics by task or flow, slowest first."""
+    if df_metrics.empty:
+        return df_metrics
+    aggs = {
+        "calls": ("name", "size"),
+        "wall_seconds": ("wall_seconds", "sum"),
+        "cpu_seconds": ("cpu_seconds", "sum"),
+        "peak_rss_mb": ("peak_rss_mb", "max"),
+        "rows_in": ("rows_in", "sum"),
+        "rows_out": ("rows_out", "sum"),
+        "db_round_trips": ("db_round_trips", "sum"),
+    }
+    for c in ["bytes_read", "bytes_written"]:
+        if c in df_metrics:
+            aggs[c] = (c, "sum")
+    return (
+        df_metrics.groupby("name")
+        .agg(**aggs)
+        .sort_values(by="wall_seconds", ascending=False)
+    )
+
+
+def write_run_metrics(
+    run_info: Dict, metrics_dir: str = "reports/metrics"
+) -> str:
+    """Save metrics of instrumented calls in this run to a JSON file."""
+    df_metrics = get_metrics()
+    os.makedirs(metrics_dir, exist_ok=True)
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+    metrics_fpath = os.path.join(metrics_dir, f"run_{run_id}.json")
+    with open(metrics_fpath, "w") as f:
+        json.dump(
+            {
+                "run_id": run_id,
+                **run_info,
+                # NaN is not valid JSON, so missing values are stored as null
+                "calls": df_metrics.astype(object)
+                .where(df_metrics.notna(), None)
+                .to_dict("records"),
+            },
+            f,
+            indent=4,
+            default=str,
+        )
+    return metrics_fpath
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Processed DineSafe snapshots stored as partitions of Parquet files."""
+
+# pylint: disable=invalid-name
+
+import json
+import os
+import shutil
+from glob import glob
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pandas.api.types import is_object_dtype
+
+from src.schema import INFRACTIONS_SCHEMA, apply_schema
+
+
+def get_partition_dir(cache_fpath: str) -> str:
+    """Get directory of partition, from path to cached snapshot."""
+    return os.path.splitext(cache_fpath)[0]
+
+
+def read_partition_metadata(partition_dir: str) -> Optional[Dict]:
+    """Get metadata of partition, if it was completely written."""
+    metadata_fpath = os.path.join(partition_dir, "_metadata.json")
+    if os.path.exists(metadata_fpath):
+        with open(metadata_fpath) as f:
+            return json.load(f)
+    return None
+
+
+def get_part_schema(df: pd.DataFrame) -> pa.Schema:
+    """Get Arrow schema of parts, with text and categories as strings."""
+    # Categories (and missing values) differ between batches, so all parts
+    # are written with the same schema, instead of one inferred per batch
+    return pa.schema(
+        [
+            pa.field(f.name, pa.string())
+            if is_object_dtype(df[f.name].dtype)
+            or isinstance(df[f.name].dtype, pd.CategoricalDtype)
+            else f
+            for f in pa.Schema.from_pandas(df, preserve_index=False)
+        ]
+    )
+
+
+def write_partition(
+    batches: Iterator[pd.DataFrame], partition_dir: str, filename: int
+) -> Dict:
+    """Write batches of rows of a snapshot as parts of a partition."""
+    tmp_dir = f"{partition_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    # Only one batch is held in memory at a time
+    num_rows = 0
+    num_parts = 0
+    schema = None
+    for df in batches:
+        schema = schema or get_part_schema(df)
+        table = pa.Table.from_pandas(
+            df.astype(
+                {
+                    c: object
+                    for c in schema.names
+                    if schema.field(c).type == pa.string()
+                }
+            ),
+            schema=schema,
+            preserve_index=False,
+        )
+        pq.write_table(
+            table,
+            os.path.join(tmp_dir, f"part-{num_parts:05d}.parquet"),
+            compression="zstd",
+        )
+        num_rows += len(df)
+        num_parts += 1
+    metadata = {
+        "filename": filename,
+        "path": partition_dir,
+        "num_rows": num_rows,
+        "num_parts": num_parts,
+    }
+    with open(os.path.join(tmp_dir, "_metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=4)
+
+    # Remove partitions written for an earlier version of the same snapshot
+    snapshot = os.path.basename(partition_dir).split("__", 1)[0]
+    parent_dir = os.path.dirname(partition_dir)
+    for stale_dir in glob(os.path.join(parent_dir, f"{snapshot}__*")):
+        if stale_dir != tmp_dir and os.path.isdir(stale_dir):
+            shutil.rmtree(stale_dir)
+    # Rename completed partition, so that an interrupted write does not
+    # leave a partial partition
+    os.replace(tmp_dir, partition_dir)
+    return metadata
+
+
+def get_part_fpaths(partition_dir: str) -> List[str]:
+    """Get paths to parts of a partition, in order of writing."""
+    return sorted(glob(os.path.join(partition_dir, "part-*.parquet")))
+
+
+def read_partition(partition_dir: str) -> pd.DataFrame:
+    """Load all parts of a partition."""
+    # Categories are stored as strings, so they are re-applied
+    return apply_schema(
+        pd.read_parquet(get_part_fpaths(partition_dir)), INFRACTIONS_SCHEMA
+    )
+
+
+def iter_partition(partition_dir: str) -> Iterator[pd.DataFrame]:
+    """Load parts of a partition, one at a time."""
+    for part_fpath in get_part_fpaths(partition_dir):
+        yield apply_schema(pd.read_parquet(part_fpath), INFRACTIONS_SCHEMA)
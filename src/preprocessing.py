@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Sparse pre-processing of ML features, cached per cross-validation fold."""
+
+# pylint: disable=invalid-name
+
+from typing import Callable, List, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import (
+    OneHotEncoder,
+    PowerTransformer,
+    StandardScaler,
+)
+
+
+def get_preprocessor(
+    cats: List[str], nums: List[str], power_method: str = "yeo-johnson"
+) -> ColumnTransformer:
+    """Get one-hot encoder and numerical scaler, with sparse (CSR) output."""
+    categorical_encoder = OneHotEncoder(handle_unknown="ignore")
+    numerical_pipe = Pipeline(
+        [
+            ("transformer", PowerTransformer(method=power_method)),
+            ("ss", StandardScaler()),
+        ]
+    )
+    # Output is always sparse, instead of only below a density threshold
+    return ColumnTransformer(
+        [
+            ("cat", categorical_encoder, cats),
+            ("num", numerical_pipe, nums),
+        ],
+        sparse_threshold=1.0,
+    )
+
+
+def get_data_fingerprint(X: pd.DataFrame, y=None) -> str:
+    """Get hash of features (and labels), including index and dtypes."""
+    return joblib.hash((X, None if y is None else np.asarray(y)))
+
+
+def fit_transform_fold(
+    preprocessing: ColumnTransformer,
+    X: pd.DataFrame,
+    train_idx: np.ndarray,
+    val_idx: np.ndarray,
+    data_fingerprint: str,
+) -> Tuple[ColumnTransformer, csr_matrix, csr_matrix]:
+    """Fit pre-processing on training fold and transform both folds."""
+    preprocessing = clone(preprocessing)
+    X_train_cv = csr_matrix(preprocessing.fit_transform(X.iloc[train_idx]))
+    X_test_cv = csr_matrix(preprocessing.transform(X.iloc[val_idx]))
+    return preprocessing, X_train_cv, X_test_cv
+
+
+def get_cached_fit_transform(cache_dir: str) -> Callable:
+    """Get fit_transform_fold cached on disk, keyed by data fingerprint."""
+    # Features are identified by their fingerprint, so they are not hashed
+    # on every call
+    memory = joblib.Memory(cache_dir, mmap_mode="r", verbose=0)
+    return memory.cache(fit_transform_fold, ignore=["X"])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Joins of time-varying neighbourhood attributes onto inspections."""
+
+# pylint: disable=invalid-name
+
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+
+def get_period_labels(
+    values: Union[np.ndarray, pd.Series], period_starts: Dict[int, int]
+) -> np.ndarray:
+    """Get label of period containing each value, with sorted searches."""
+    labels, starts = zip(*sorted(period_starts.items(), key=lambda x: x[1]))
+    positions = np.searchsorted(np.asarray(starts), values, side="right") - 1
+    if (positions >= 0).all():
+        return np.asarray(labels)[positions]
+    # Values before the first period do not get a label
+    return np.where(
+        positions >= 0, np.asarray(labels)[np.maximum(positions, 0)], np.nan
+    )
+
+
+def melt_periods(
+    df: pd.DataFrame,
+    value_cols: Dict[int, str],
+    value_name: str,
+    period_col: str,
+) -> pd.DataFrame:
+    """Convert one column per period into one row per period."""
+    id_cols = [c for c in list(df) if c not in value_cols.values()]
+    return df.rename(columns={v: k for k, v in value_cols.items()}).melt(
+        id_vars=id_cols,
+        value_vars=list(value_cols),
+        var_name=period_col,
+        value_name=value_name,
+    )
+
+
+def range_join(
+    df: pd.DataFrame,
+    df_attrs: pd.DataFrame,
+    on: List[str],
+    period_values: Union[np.ndarray, pd.Series],
+    period_starts: Dict[int, int],
+    period_col: str,
+) -> pd.DataFrame:
+    """Attach attributes of the period containing each row, in one merge."""
+    # Label each row with its period, instead of splitting rows by period
+    labels = get_period_labels(period_values, period_starts)
+    # Rows outside every period are dropped, as they were when rows of each
+    # period were selected and merged separately
+    df = df.assign(**{period_col: labels})[pd.notna(labels)]
+    return df.merge(
+        df_attrs.astype({period_col: df[period_col].dtype}),
+        on=on + [period_col],
+        how="left",
+    )
+
+
+def asof_join(
+    df: pd.DataFrame,
+    df_attrs: pd.DataFrame,
+    time_col: str,
+    by: Optional[Union[str, List[str]]] = None,
+    tolerance: Optional[pd.Timedelta] = None,
+    direction: str = "backward",
+) -> pd.DataFrame:
+    """Attach most recent attributes at or before each row's time."""
+    # merge_asof needs rows sorted by time, so sort once and restore the
+    # original order afterwards
+    order = np.argsort(df[time_col].to_numpy(), kind="stable")
+    df_merged = pd.merge_asof(
+        df.iloc[order],
+        df_attrs.sort_values(by=time_col, kind="stable"),
+        on=time_col,
+        by=by,
+        tolerance=tolerance,
+        direction=direction,
+    )
+    df_merged = df_merged.iloc[np.argsort(order, kind="stable")]
+    return df_merged.set_axis(df.index, axis=0)
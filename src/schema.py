@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Compact dtypes of infractions, inspections and neighbourhoods."""
+
+# pylint: disable=invalid-name
+
+from typing import Dict, Optional, Union
+
+import pandas as pd
+from pandas.api.types import CategoricalDtype
+
+ESTABLISHMENT_STATUSES = ["Pass", "Conditional Pass", "Closed"]
+SEVERITIES = [
+    "S - Significant",
+    "C - Crucial",
+    "M - Minor",
+    "NA - Not Applicable",
+]
+
+# Columns of the infractions table, as loaded from XML files
+INFRACTIONS_SCHEMA: Dict[str, Union[str, CategoricalDtype]] = {
+    "row_id": "int32",
+    "establishment_id": "int32",
+    "inspection_id": "int32",
+    "establishmenttype": "category",
+    "establishment_address": "category",
+    "latitude": "float32",
+    "longitude": "float32",
+    "establishment_status": CategoricalDtype(ESTABLISHMENT_STATUSES),
+    "minimum_inspections_peryear": "int16",
+    "severity": CategoricalDtype(SEVERITIES),
+    "action": "category",
+    "court_outcome": "category",
+    "amount_fined": "float32",
+    # Snapshot timestamp (YYYYmmddHHMMSS) does not fit in 32 bits
+    "filename": "int64",
+}
+
+# Columns of inspections, after aggregating infractions
+INSPECTIONS_SCHEMA: Dict[str, Union[str, CategoricalDtype]] = {
+    "establishment_id": "int32",
+    "inspection_id": "int32",
+    "establishmenttype": "category",
+    "establishment_address": "category",
+    "establishment_status": CategoricalDtype(ESTABLISHMENT_STATUSES),
+    "latitude": "float32",
+    "longitude": "float32",
+    "days_to_next": "float32",
+    "is_infraction": "int8",
+    "AREA_NAME": "category",
+}
+# Dtype of counts of infractions, actions and court outcomes (num_*)
+COUNT_DTYPE = "int16"
+
+
+def get_fixed_categories(
+    s: pd.Series, dtype: CategoricalDtype
+) -> CategoricalDtype:
+    """Get categorical dtype, with values not in fixed categories appended."""
+    # Unexpected values are kept instead of being silently set to missing
+    new_categories = sorted(
+        set(s.dropna().unique()) - set(dtype.categories.tolist())
+    )
+    if not new_categories:
+        return dtype
+    return CategoricalDtype(dtype.categories.tolist() + new_categories)
+
+
+def apply_schema(
+    df: pd.DataFrame,
+    schema: Dict[str, Union[str, CategoricalDtype]],
+    count_dtype: Optional[str] = None,
+) -> pd.DataFrame:
+    """Change datatypes of columns found in schema."""
+    dtypes = {}
+    for c, dtype in schema.items():
+        if c not in df:
+            continue
+        if isinstance(dtype, CategoricalDtype):
+            dtype = get_fixed_categories(df[c], dtype)
+        dtypes[c] = dtype
+    if count_dtype:
+        for c in df.columns[df.columns.str.startswith("num_")]:
+            dtypes[c] = count_dtype
+    return df.astype(dtypes)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Batch scoring of establishments with a trained ML pipeline."""
+
+# pylint: disable=invalid-name
+
+import os
+from glob import glob
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from joblib import load
+
+from src.bulk_load_helpers import bulk_load
+from src.engine_pool import get_engine
+from src.ingestion_helpers import SeenKeys, hash_rows
+
+ESTABLISHMENT_COLS = [
+    "establishment_id",
+    "establishmenttype",
+    "establishment_address",
+]
+# Inspections without these features are not scored (as in training)
+REQUIRED_COLS = ["AREA_NAME"]
+
+
+def get_latest_model_fpath(
+    models_dir: str = "models", model_fname: str = "trained_model"
+) -> str:
+    """Get path to most recently trained model."""
+    model_fpaths = sorted(
+        glob(os.path.join(models_dir, f"{model_fname}__*.joblib"))
+    )
+    if not model_fpaths:
+        raise FileNotFoundError(
+            f"No trained model {model_fname} found in {models_dir}"
+        )
+    return model_fpaths[-1]
+
+
+def load_model(model_fpath: str):
+    """Load trained pipeline once, memory-mapping its arrays."""
+    return load(model_fpath, mmap_mode="r")
+
+
+def get_missing_cols(features_fpath: str, cols: List[str]) -> List[str]:
+    """Get columns not found in feature table (.parquet or .csv)."""
+    if features_fpath.endswith(".parquet"):
+        found_cols = pq.read_schema(features_fpath).names
+    else:
+        found_cols = list(pd.read_csv(features_fpath, nrows=0))
+    return [c for c in cols if c not in found_cols]
+
+
+def iter_feature_batches(
+    features_fpath: str, cols: List[str], batch_size: int = 50_000
+) -> Iterator[pd.DataFrame]:
+    """Read chunks of columns of feature table (.parquet or .csv)."""
+    if features_fpath.endswith(".parquet"):
+        for batch in pq.ParquetFile(features_fpath).iter_batches(
+            batch_size=batch_size, columns=cols
+        ):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(
+            features_fpath,
+            usecols=cols,
+            parse_dates=["inspection_date"],
+            chunksize=batch_size,
+        )
+
+
+def iter_latest_rows(
+    batches: Iterator[pd.DataFrame],
+) -> Iterator[pd.DataFrame]:
+    """Get latest row of each establishment, from chunks sorted by it."""
+    # Chunks must be sorted by establishment and then by inspection date (as
+    # feature tables are written), which is checked while reading them
+    df_carry = None
+    finished_keys = SeenKeys()
+    for df in batches:
+        if df_carry is not None:
+            df = pd.concat([df_carry, df], ignore_index=True)
+        if df.empty:
+            continue
+        # Establishments are compared by hash, so that missing values in
+        # establishment columns are equal to each other
+        keys = hash_rows(df[ESTABLISHMENT_COLS])
+        key_values = keys.to_numpy()
+        # Row is the latest one if the next row is another establishment
+        is_last = np.append(key_values[:-1] != key_values[1:], False)
+        is_first = np.insert(is_last[:-1], 0, True)
+        first_keys = keys[is_first]
+        dates = df["inspection_date"].to_numpy()
+        if (
+            (dates[1:] < dates[:-1])[~is_first[1:]].any()
+            or first_keys.duplicated().any()
+            or finished_keys.isin(first_keys).any()
+        ):
+            raise ValueError(
+                "Feature table must be sorted by establishment "
+                f"({', '.join(ESTABLISHMENT_COLS)}) and inspection_date"
+            )
+        finished_keys.update(keys[is_last])
+        # Rows of the last establishment in a chunk can continue in the next
+        # chunk, so its last row is carried over
+        df_carry = df.iloc[-1:]
+        yield df[is_last]
+    if df_carry is not None:
+        yield df_carry
+
+
+def score_batch(
+    model, df: pd.DataFrame, feature_cols: List[str]
+) -> pd.DataFrame:
+    """Get predicted probability of an infraction, for a batch of rows."""
+    df = df.dropna(
+        subset=[c for c in REQUIRED_COLS if c in feature_cols]
+    ).reset_index(drop=True)
+    X = df[feature_cols].fillna(0)
+    return df[ESTABLISHMENT_COLS + ["inspection_date"]].assign(
+        risk_score=model.predict_proba(X)[:, 1] if len(X) else [],
+    )
+
+
+def store_scores(
+    df_scores: pd.DataFrame,
+    output: str,
+    table_name: str = "risk_scores",
+    method: str = "multirow",
+) -> Optional[Dict[str, Union[str, int, float]]]:
+    """Store ranked scores in a Parquet file or database table."""
+    if output.endswith(".parquet"):
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        df_scores.to_parquet(f"{output}.tmp", index=False)
+        os.replace(f"{output}.tmp", output)
+        return None
+    # Otherwise, output is a database URI and table is replaced
+    with get_engine(output).begin() as conn:
+        df_scores.head(0).to_sql(
+            table_name, conn, if_exists="replace", index=False
+        )
+        return bulk_load(df_scores, conn, table_name, method)
+
+
+def score_establishments(
+    model_fpath: str,
+    features_fpath: str,
+    output: Optional[str] = None,
+    table_name: str = "risk_scores",
+    batch_size: int = 50_000,
+    min_date: Optional[str] = None,
+) -> Tuple[pd.DataFrame, Dict[str, float]]:
+    """Rank establishments by risk of an infraction at next inspection."""
+    start_time = perf_counter()
+    model = load_model(model_fpath)
+    feature_cols = list(model.feature_names_in_)
+    cols = list(
+        dict.fromkeys(ESTABLISHMENT_COLS + ["inspection_date"] + feature_cols)
+    )
+    # Features of neighbourhoods (eg. AREA_NAME) are only added to the
+    # feature table of notebook 7 (processed_with_features__*.csv), and not
+    # to the feature table stored by the workflow
+    missing_cols = get_missing_cols(features_fpath, cols)
+    if missing_cols:
+        raise ValueError(
+            f"Feature table {features_fpath} is missing {len(missing_cols)} "
+            f"columns used by the model: {', '.join(missing_cols)}. Use the "
+            "feature table written by notebook 7 "
+            "(data/processed/processed_with_features__*.csv)."
+        )
+
+    # Score latest inspection of each establishment, one chunk at a time
+    num_rows = 0
+
+    def read_batches():
+        nonlocal num_rows
+        for df in iter_feature_batches(features_fpath, cols, batch_size):
+            num_rows += len(df)
+            yield df
+
+    scores = []
+    for df in iter_latest_rows(read_batches()):
+        if min_date:
+            # Only establishments inspected recently are considered active
+            df = df[df["inspection_date"] >= pd.to_datetime(min_date)]
+        scores.append(score_batch(model, df, feature_cols))
+    if not scores:
+        # Feature table has no rows, so no establishment is scored
+        scores.append(
+            score_batch(model, pd.DataFrame(columns=cols), feature_cols)
+        )
+    df_scores = pd.concat(scores, ignore_index=True).sort_values(
+        by="risk_score", ascending=False, kind="stable", ignore_index=True
+    )
+    df_scores["risk_rank"] = np.arange(1, len(df_scores) + 1)
+    scoring_time = perf_counter() - start_time
+
+    stats = {
+        "rows_read": num_rows,
+        "rows_per_sec": (
+            num_rows / scoring_time if scoring_time else float("nan")
+        ),
+        "establishments_scored": len(df_scores),
+        "scoring_seconds": scoring_time,
+        "establishments_per_sec": (
+            len(df_scores) / scoring_time if scoring_time else float("nan")
+        ),
+    }
+    if output:
+        load_stats = store_scores(df_scores, output, table_name)
+        stats["store_seconds"] = perf_counter() - start_time - scoring_time
+        if load_stats:
+            stats["store_rows_per_sec"] = load_stats["rows_per_sec"]
+    return df_scores, stats
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Content-addressed Parquet cache of processed DineSafe snapshots."""
+
+# pylint: disable=invalid-name
+
+import hashlib
+import inspect
+import json
+import os
+from glob import glob
+from typing import Callable, List, Optional
+
+import pandas as pd
+
+
+def get_file_hash(filepath: str, chunk_size: int = 1 << 20) -> str:
+    """Get SHA-256 hash of a file, reading it in chunks."""
+    file_hash = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_logic_version(funcs: List[Callable], *params) -> str:
+    """Get hash of the source code of processing functions and parameters."""
+    logic_hash = hashlib.sha256()
+    for func in funcs:
+        logic_hash.update(inspect.getsource(func).encode("utf-8"))
+    # Parameters can contain dtypes (eg. a schema), whose repr (unlike str)
+    # includes their categories
+    logic_hash.update(json.dumps(params, default=repr).encode("utf-8"))
+    return logic_hash.hexdigest()
+
+
+def get_cache_filepath(
+    xml_filepath: str,
+    logic_version: str,
+    cache_dir: str = "data/processed/snapshot_cache",
+) -> str:
+    """Get path to cached Parquet file for a raw XML snapshot."""
+    snapshot = os.path.basename(os.path.dirname(xml_filepath))
+    file_hash = get_file_hash(xml_filepath)
+    return os.path.join(
+        cache_dir,
+        f"{snapshot}__{file_hash[:16]}__{logic_version[:16]}.parquet",
+    )
+
+
+def read_cached_snapshot(cache_fpath: str) -> Optional[pd.DataFrame]:
+    """Load processed snapshot from cache, if available."""
+    if os.path.exists(cache_fpath):
+        return pd.read_parquet(cache_fpath)
+    return None
+
+
+def write_cached_snapshot(df: pd.DataFrame, cache_fpath: str) -> str:
+    """Save processed snapshot to cache and remove stale cached versions."""
+    cache_dir = os.path.dirname(cache_fpath)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Remove files cached for an earlier version of the same snapshot
+    snapshot = os.path.basename(cache_fpath).split("__", 1)[0]
+    for stale_fpath in glob(os.path.join(cache_dir, f"{snapshot}__*.parquet")):
+        if stale_fpath != cache_fpath:
+            os.remove(stale_fpath)
+    # Write to temporary file and rename, so that an interrupted write does
+    # not leave a partial file in the cache
+    tmp_fpath = f"{cache_fpath}.tmp"
+    df.to_parquet(tmp_fpath, index=False, compression="zstd")
+    os.replace(tmp_fpath, cache_fpath)
+    return cache_fpath
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Spatial index for assigning locations to neighbourhoods."""
+
+# pylint: disable=invalid-name
+
+import hashlib
+import os
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+import pygeos
+
+# Number of decimals of latitudes and longitudes used as lookup keys
+# (6 decimals is about 0.1 m)
+COORD_DECIMALS = 6
+
+
+class NeighbourhoodIndex:
+    """STRtree of prepared neighbourhood polygons, stored as WKB on disk."""
+
+    def __init__(self, wkbs: List[bytes], index_fpath: Optional[str] = None):
+        self.wkbs = list(wkbs)
+        self.version = hashlib.sha256(b"".join(self.wkbs)).hexdigest()[:16]
+        self.polygons = pygeos.from_wkb(np.array(self.wkbs, dtype=object))
+        # Prepared polygons speed up repeated point-in-polygon checks
+        pygeos.prepare(self.polygons)
+        self.tree = pygeos.STRtree(self.polygons)
+        self.index_fpath = index_fpath
+
+    @classmethod
+    def from_geodataframe(cls, gdf, index_fpath: Optional[str] = None):
+        """Build index from polygons in a GeoDataFrame and store it."""
+        index = cls(gdf.geometry.to_wkb().tolist(), index_fpath)
+        if index_fpath:
+            os.makedirs(os.path.dirname(index_fpath) or ".", exist_ok=True)
+            pd.DataFrame({"wkb": index.wkbs}).to_parquet(
+                f"{index_fpath}.tmp", index=False
+            )
+            os.replace(f"{index_fpath}.tmp", index_fpath)
+        return index
+
+    @classmethod
+    def from_file(cls, index_fpath: str):
+        """Load index with polygons stored by an earlier run."""
+        return cls(pd.read_parquet(index_fpath)["wkb"].tolist(), index_fpath)
+
+    def query(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """Get position of polygon containing each point (-1 if none)."""
+        points = pygeos.points(lons, lats)
+        # Single vectorized query of all points against the tree
+        point_idx, polygon_idx = self.tree.query_bulk(
+            points, predicate="within"
+        )
+        positions = np.full(len(points), -1, dtype=np.int32)
+        # Points in more than one polygon are assigned to the first match
+        point_idx, first_match = np.unique(point_idx, return_index=True)
+        positions[point_idx] = polygon_idx[first_match]
+        return positions
+
+
+def get_neighbourhood_index(
+    gdf=None, index_fpath: str = "data/processed/neighbourhoods.parquet"
+) -> NeighbourhoodIndex:
+    """Get stored spatial index, building it if not found or if changed."""
+    if gdf is None:
+        return NeighbourhoodIndex.from_file(index_fpath)
+    if os.path.exists(index_fpath):
+        index = NeighbourhoodIndex.from_file(index_fpath)
+        if index.wkbs == gdf.geometry.to_wkb().tolist():
+            return index
+    return NeighbourhoodIndex.from_geodataframe(gdf, index_fpath)
+
+
+def get_neighbourhood_positions(
+    df: pd.DataFrame,
+    index: NeighbourhoodIndex,
+    lat: str = "latitude",
+    lon: str = "longitude",
+    lookup_dir: str = "data/processed",
+) -> np.ndarray:
+    """Get position of neighbourhood of each location, with memoization."""
+    # Stored lookups are only valid for the same neighbourhood polygons
+    lookup_fpath = os.path.join(
+        lookup_dir, f"neighbourhood_lookup__{index.version}.parquet"
+    )
+    df_keys = pd.DataFrame(
+        {
+            "lat": df[lat].astype(float).round(COORD_DECIMALS).to_numpy(),
+            "lon": df[lon].astype(float).round(COORD_DECIMALS).to_numpy(),
+        }
+    )
+    if os.path.exists(lookup_fpath):
+        df_lookup = pd.read_parquet(lookup_fpath)
+    else:
+        df_lookup = pd.DataFrame(
+            {"lat": [], "lon": [], "position": []}
+        ).astype({"position": np.int32})
+    # Only look up locations not found in earlier runs
+    df_new = (
+        df_keys.dropna()
+        .drop_duplicates()
+        .merge(df_lookup, on=["lat", "lon"], how="left")
+        .query("position.isna()")[["lat", "lon"]]
+    )
+    if not df_new.empty:
+        df_new["position"] = index.query(
+            df_new["lat"].to_numpy(), df_new["lon"].to_numpy()
+        )
+        df_lookup = pd.concat([df_lookup, df_new], ignore_index=True)
+        os.makedirs(lookup_dir, exist_ok=True)
+        df_lookup.to_parquet(f"{lookup_fpath}.tmp", index=False)
+        os.replace(f"{lookup_fpath}.tmp", lookup_fpath)
+    positions = df_keys.merge(df_lookup, on=["lat", "lon"], how="left")[
+        "position"
+    ]
+    return positions.fillna(-1).astype(np.int32).to_numpy()
+
+
+def get_neighbourhoods(
+    df: pd.DataFrame,
+    gdf,
+    lat: str = "latitude",
+    lon: str = "longitude",
+    cols: Optional[List[str]] = None,
+    index_fpath: str = "data/processed/neighbourhoods.parquet",
+    lookup_dir: str = "data/processed",
+) -> pd.DataFrame:
+    """Get attributes of neighbourhood containing each location."""
+    index = get_neighbourhood_index(gdf, index_fpath)
+    positions = get_neighbourhood_positions(df, index, lat, lon, lookup_dir)
+    cols = cols or ["AREA_NAME"]
+    # Locations outside all neighbourhoods get missing values
+    df_attrs = (
+        gdf[cols]
+        .reset_index(drop=True)
+        .reindex(np.where(positions >= 0, positions, len(gdf)))
+    )
+    return df_attrs.set_axis(df.index, axis=0)
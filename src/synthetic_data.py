@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Synthetic DineSafe XML snapshots, shaped like the real data."""
+
+# pylint: disable=invalid-name
+
+import os
+from typing import Dict, Iterator, Optional
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from src.schema import ESTABLISHMENT_STATUSES, SEVERITIES
+
+# Relative frequencies of values, similar to those in real snapshots
+ESTABLISHMENT_TYPES = {
+    "Restaurant": 0.42,
+    "Food Take Out": 0.14,
+    "Food Store (Convenience / Variety)": 0.08,
+    "Food Court Vendor": 0.03,
+    "Supermarket": 0.03,
+    "Bakery": 0.04,
+    "Butcher Shop": 0.02,
+    "Cafeteria - Public Access": 0.02,
+    "Cocktail Bar / Beverage Room": 0.03,
+    "Fish Shop": 0.01,
+    "Bake Shop": 0.01,
+    "Child Care - Food Preparation": 0.05,
+    "Institutional Food Service": 0.04,
+    "Food Processing Plant": 0.03,
+    "Private Club": 0.02,
+    "Farmer's Market": 0.01,
+    "Flea Market": 0.01,
+    "Banquet Facility": 0.01,
+}
+SEVERITY_WEIGHTS = dict(zip(SEVERITIES, [0.3, 0.04, 0.6, 0.06]))
+ACTIONS = {
+    "Notice to Comply": 0.72,
+    "Corrected During Inspection": 0.16,
+    "Education Provided": 0.04,
+    "Ticket": 0.05,
+    "Summons": 0.015,
+    "Summons and Health Hazard Order": 0.005,
+    "Closure Order": 0.01,
+}
+# Only tickets and summons go to court
+COURT_ACTIONS = ["Ticket", "Summons", "Summons and Health Hazard Order"]
+COURT_OUTCOMES = {
+    "Conviction - Fined": 0.55,
+    "Pending": 0.2,
+    "Charges Withdrawn": 0.1,
+    "Charges Quashed": 0.04,
+    "Charges Dismissed": 0.03,
+    "Conviction - Suspended Sentence": 0.03,
+    "Conviction - Probationary Order": 0.02,
+    "Conviction - Fined & Order to Close by Court": 0.02,
+    "Conviction - Ordered to Close by Court": 0.01,
+}
+INFRACTION_DETAILS = [
+    "Operator fail to properly wash surfaces in rooms",
+    "Operator fail to properly wash equipment",
+    "Operator fail to ensure food is not contaminated/adulterated",
+    "Operator fail to maintain food at 4C (40F) or colder",
+    "Operator fail to maintain hazardous foods at 60C (140F) or hotter",
+    "Operator fail to provide adequate pest control",
+    "Operator fail to protect food from contamination or adulteration",
+    "FAIL TO PROVIDE THERMOMETER IN REFRIGERATION EQUIPMENT",
+    "FAIL TO MAINTAIN HANDWASHING STATIONS (LIQUID SOAP AND TOWELS)",
+    "FAIL TO PROVIDE TOWELS IN FOOD PREPARATION AREA",
+    "Fail to ensure the presence of the holder of a valid food "
+    "handler's certificate - Municipal Code Chapter 545-157E(1)",
+    "Food premise not maintained with care and cleanliness",
+    "Employee fail to wash hands when required",
+    "Store hazardous foods at an unsafe temperature",
+]
+STREETS = [
+    "Yonge St",
+    "Queen St W",
+    "King St W",
+    "Dundas St W",
+    "Bloor St W",
+    "College St",
+    "Spadina Ave",
+    "Danforth Ave",
+    "Eglinton Ave E",
+    "Kingston Rd",
+    "Lawrence Ave E",
+    "Finch Ave W",
+    "Sheppard Ave E",
+    "Bathurst St",
+    "Gerrard St E",
+]
+# Elements of a row, in the order found in the real snapshots
+XML_COLS = [
+    "ROW_ID",
+    "ESTABLISHMENT_ID",
+    "INSPECTION_ID",
+    "ESTABLISHMENT_NAME",
+    "ESTABLISHMENTTYPE",
+    "ESTABLISHMENT_ADDRESS",
+    "LATITUDE",
+    "LONGITUDE",
+    "ESTABLISHMENT_STATUS",
+    "MINIMUM_INSPECTIONS_PERYEAR",
+    "INFRACTION_DETAILS",
+    "INSPECTION_DATE",
+    "SEVERITY",
+    "ACTION",
+    "COURT_OUTCOME",
+    "AMOUNT_FINED",
+]
+
+
+def choose(
+    rng: np.random.Generator, values: Dict[str, float], size: int
+) -> np.ndarray:
+    """Draw values with their relative frequencies."""
+    p = np.array(list(values.values()))
+    return np.array(list(values), dtype=object)[
+        rng.choice(len(p), size=size, p=p / p.sum())
+    ]
+
+
+def get_establishments(
+    num_establishments: int, rng: np.random.Generator
+) -> pd.DataFrame:
+    """Get attributes of establishments."""
+    establishment_ids = 10_000_000 + np.arange(num_establishments)
+    street_numbers = rng.integers(1, 4_000, num_establishments).astype(str)
+    streets = np.array(STREETS, dtype=object)[
+        rng.integers(0, len(STREETS), num_establishments)
+    ]
+    df = pd.DataFrame(
+        {
+            "ESTABLISHMENT_ID": establishment_ids,
+            "ESTABLISHMENT_NAME": "ESTABLISHMENT "
+            + establishment_ids.astype(str).astype(object),
+            "ESTABLISHMENTTYPE": choose(
+                rng, ESTABLISHMENT_TYPES, num_establishments
+            ),
+            "ESTABLISHMENT_ADDRESS": (
+                pd.Series(street_numbers, dtype=object) + " " + streets
+            ).str.upper(),
+            # Co-ordinates within the City of Toronto
+            "LATITUDE": rng.uniform(43.58, 43.85, num_establishments),
+            "LONGITUDE": rng.uniform(-79.64, -79.12, num_establishments),
+            "MINIMUM_INSPECTIONS_PERYEAR": rng.choice(
+                [1, 2, 3], num_establishments, p=[0.3, 0.45, 0.25]
+            ),
+        }
+    )
+    return df.round({"LATITUDE": 7, "LONGITUDE": 7})
+
+
+def generate_infractions(
+    df_establishments: pd.DataFrame,
+    num_rows: np.ndarray,
+    rng: np.random.Generator,
+    first_inspection_id: int = 100_000_000,
+    start_date: str = "2013-01-01",
+    end_date: str = "2022-12-31",
+) -> pd.DataFrame:
+    """Get rows (infractions) of inspections of establishments."""
+    n = int(num_rows.sum())
+    establishment_rows = np.repeat(np.arange(len(df_establishments)), num_rows)
+    is_first_row = np.zeros(n, dtype=bool)
+    is_first_row[np.cumsum(num_rows) - num_rows] = True
+    # Inspections have one or more rows (geometric number of infractions)
+    is_new_inspection = is_first_row | (rng.random(n) < 0.45)
+    inspection_index = np.cumsum(is_new_inspection) - 1
+    inspection_starts = np.flatnonzero(is_new_inspection)
+    num_inspections = len(inspection_starts)
+
+    # Later inspections of an establishment have larger IDs
+    num_days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days
+    days = rng.integers(0, num_days + 1, num_inspections)
+    days = days[np.lexsort((days, establishment_rows[inspection_starts]))]
+    inspection_dates = pd.Timestamp(start_date) + pd.to_timedelta(
+        days, unit="D"
+    )
+
+    # Single-row inspections can have no infraction (passed inspections)
+    num_inspection_rows = np.diff(np.append(inspection_starts, n))
+    is_pass = (num_inspection_rows[inspection_index] == 1) & (
+        rng.random(n) < 0.6
+    )
+    severity = choose(rng, SEVERITY_WEIGHTS, n)
+    action = choose(rng, ACTIONS, n)
+    court_outcome = choose(rng, COURT_OUTCOMES, n)
+    is_court_case = np.isin(action, COURT_ACTIONS) & ~is_pass
+    is_fined = is_court_case & pd.Series(court_outcome).str.startswith(
+        "Conviction - Fined"
+    ).to_numpy(dtype=bool)
+    amount_fined = pd.Series(rng.integers(5, 200, n) * 25.0, dtype=float).map(
+        "{:,.2f}".format
+    )
+
+    # Status of an inspection depends on its most severe infraction
+    is_significant = np.isin(severity, SEVERITIES[:2]) & ~is_pass
+    has_significant = np.maximum.reduceat(is_significant, inspection_starts)
+    is_closed = has_significant & (rng.random(num_inspections) < 0.02)
+    status = np.where(
+        is_closed,
+        ESTABLISHMENT_STATUSES[2],
+        np.where(
+            has_significant,
+            ESTABLISHMENT_STATUSES[1],
+            ESTABLISHMENT_STATUSES[0],
+        ),
+    )
+
+    df = df_establishments.iloc[establishment_rows].reset_index(drop=True)
+    df["INSPECTION_ID"] = first_inspection_id + inspection_index
+    df["ESTABLISHMENT_STATUS"] = status[inspection_index]
+    df["INFRACTION_DETAILS"] = np.where(
+        is_pass,
+        None,
+        np.array(INFRACTION_DETAILS, dtype=object)[
+            rng.integers(0, len(INFRACTION_DETAILS), n)
+        ],
+    )
+    df["INSPECTION_DATE"] = inspection_dates[inspection_index].strftime(
+        "%Y-%m-%d"
+    )
+    df["SEVERITY"] = np.where(is_pass, None, severity)
+    df["ACTION"] = np.where(is_pass, None, action)
+    df["COURT_OUTCOME"] = np.where(is_court_case, court_outcome, None)
+    df["AMOUNT_FINED"] = np.where(is_fined, amount_fined, None)
+    return df
+
+
+def get_xml_rows(df: pd.DataFrame, include_lat_lon: bool = True) -> str:
+    """Get XML elements of rows of infractions."""
+    xml_rows = pd.Series("<ROW>", index=df.index, dtype=object)
+    for c in XML_COLS:
+        if c in ["LATITUDE", "LONGITUDE"] and not include_lat_lon:
+            continue
+        # Text is escaped once per distinct value, and missing values are
+        # stored as empty elements
+        values = df[c].astype("category")
+        values = values.cat.rename_categories(
+            [escape(str(v)) for v in values.cat.categories]
+        )
+        xml_rows += f"<{c}>" + values.astype(object).fillna("") + f"</{c}>"
+    return "\n".join(xml_rows + "</ROW>") + "\n"
+
+
+def iter_infraction_batches(
+    num_infractions: int,
+    num_establishments: Optional[int] = None,
+    batch_size: int = 500_000,
+    random_state: int = 42,
+) -> Iterator[pd.DataFrame]:
+    """Yield batches of synthetic infractions of whole establishments."""
+    rng = np.random.default_rng(random_state)
+    num_establishments = num_establishments or max(1, num_infractions // 20)
+    df_establishments = get_establishments(num_establishments, rng)
+    # Few establishments have many infractions (skewed, log-normal sizes)
+    weights = rng.lognormal(0, 1, num_establishments)
+    num_rows = rng.multinomial(num_infractions, weights / weights.sum())
+    # Batches contain all rows of their establishments
+    batch_ends = np.searchsorted(
+        np.cumsum(num_rows),
+        np.arange(batch_size, num_infractions, batch_size),
+    )
+    first_inspection_id = 100_000_000
+    for rows in np.split(np.arange(num_establishments), batch_ends):
+        rows = rows[num_rows[rows] > 0]
+        if not len(rows):
+            continue
+        df = generate_infractions(
+            df_establishments.iloc[rows].reset_index(drop=True),
+            num_rows[rows],
+            rng,
+            first_inspection_id,
+        )
+        first_inspection_id = df["INSPECTION_ID"].max() + 1
+        yield df
+
+
+def write_synthetic_snapshot(
+    fpath: str,
+    num_infractions: int,
+    num_establishments: Optional[int] = None,
+    include_lat_lon: bool = True,
+    batch_size: int = 500_000,
+    random_state: int = 42,
+) -> str:
+    """Write synthetic DineSafe XML file, one batch of rows at a time."""
+    os.makedirs(os.path.dirname(fpath) or ".", exist_ok=True)
+    tmp_fpath = f"{fpath}.tmp"
+    row_id = 1
+    with open(tmp_fpath, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<ROWDATA>\n')
+        for df in iter_infraction_batches(
+            num_infractions, num_establishments, batch_size, random_state
+        ):
+            df.insert(0, "ROW_ID", np.arange(row_id, row_id + len(df)))
+            row_id += len(df)
+            f.write(get_xml_rows(df, include_lat_lon))
+        f.write("</ROWDATA>\n")
+    os.replace(tmp_fpath, fpath)
+    return fpath
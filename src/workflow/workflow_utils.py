@@ -12,19 +12,98 @@
 
 
 import configparser
+import json
 import os
-from io import BytesIO
-from typing import List
-from zipfile import ZipFile
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
 
 import pandas as pd
-import requests
 from prefect import flow, task
 from prefect.task_runners import DaskTaskRunner
 from prefect.utilities.logging import get_logger
-from sqlalchemy import create_engine
 
+from src.address_cache import AddressCache, canonicalize_address
+from src.aggregation_helpers import (
+    INSPECTION_COLS,
+    PIVOT_COL_NAMERS,
+    PIVOT_COLS,
+    get_categories,
+    get_categories_fpath,
+    pivot_inspections,
+)
+from src.bulk_load_helpers import bulk_load
+from src.download_helpers import download_snapshots
+from src.duckdb_backend import (
+    DUCKDB_URI_PREFIX,
+    SQL_DIALECTS,
+    create_geocoded_table,
+    create_infractions_view,
+    get_dialect,
+    get_snapshot_paths,
+    get_sqlite_uri,
+    is_duckdb_uri,
+    read_sql,
+)
+from src.engine_pool import (
+    POOL_SETTINGS,
+    configure_engine_pool,
+    dispose_engines,
+    get_engine,
+    get_pool_metrics,
+)
+from src.feature_engineering import (
+    add_establishment_features,
+    rename_null_columns,
+)
 from src.geopy_helpers import geocode_missing_lat_lon
+from src.incremental_helpers import (
+    ESTABLISHMENT_COLS,
+    add_touched_establishments,
+    clear_touched_establishments,
+    filter_establishments,
+    merge_recomputed_establishments,
+    read_touched_establishments,
+)
+from src.ingestion_helpers import (
+    OccurrenceCounts,
+    RowKeyIndex,
+    SeenKeys,
+    check_row_keys,
+    delete_rows_by_key,
+    get_establishments_by_key,
+    get_new_infractions,
+)
+from src.instrumentation import (
+    INSTRUMENTATION_SETTINGS,
+    add_metrics,
+    clear_metrics,
+    collect_metrics,
+    configure_instrumentation,
+    get_metrics,
+    get_metrics_summary,
+    instrument,
+    write_run_metrics,
+)
+from src.partition_helpers import (
+    get_partition_dir,
+    iter_partition,
+    read_partition_metadata,
+    write_partition,
+)
+from src.schema import (
+    COUNT_DTYPE,
+    INFRACTIONS_SCHEMA,
+    INSPECTIONS_SCHEMA,
+    apply_schema,
+    get_fixed_categories,
+)
+from src.snapshot_cache import (
+    get_cache_filepath,
+    get_logic_version,
+    read_cached_snapshot,
+    write_cached_snapshot,
+)
+from src.xml_helpers import iter_xml_batches, iter_xml_records
 
 
 # Functionality from 1_get_data.ipynb
@@ -34,6 +113,7 @@ def get_state_result(state):
 
 
 @task
+@instrument
 def get_database_uris(config_filepath: str = "../sql.ini") -> List[str]:
     """Get MySQL database URIs."""
     logger = get_logger()
@@ -66,21 +146,35 @@ def get_database_uris(config_filepath: str = "../sql.ini") -> List[str]:
 
 
 @task
+@instrument
+def get_embedded_database_uris(
+    duckdb_fpath: str = "data/processed/dinesafe.duckdb",
+) -> List[str]:
+    """Get embedded DuckDB database URIs (no database server needed)."""
+    db_name = os.path.splitext(os.path.basename(duckdb_fpath))[0]
+    return ["", f"{DUCKDB_URI_PREFIX}{duckdb_fpath}", db_name]
+
+
+@task
+@instrument
 def prepare_database(outputs: List[str], dbase_table_name: str) -> None:
     """Perform Database administration tasks."""
     logger = get_logger()
-    logger.info("Creating database and table...")
     conn_uri_no_db, conn_uri, db_name = outputs
+    if is_duckdb_uri(conn_uri):
+        # Table is a view over processed snapshots, created when loading
+        logger.info("Found embedded database. Did nothing.")
+        return
+    logger.info("Creating database and table...")
     # Create database
-    engine = create_engine(conn_uri_no_db)
+    engine = get_engine(conn_uri_no_db)
     conn = engine.connect()
     # _ = conn.execute(f"DROP DATABASE IF EXISTS {db_name};")
     _ = conn.execute(f"CREATE DATABASE IF NOT EXISTS {db_name};")
     conn.close()
-    engine.dispose()
 
     # Create database table
-    engine = create_engine(conn_uri)
+    engine = get_engine(conn_uri)
     conn = engine.connect()
     # _ = conn.execute(f"DROP TABLE IF EXISTS {table_name}")
     create_table_query = f"""
@@ -101,12 +195,27 @@ def prepare_database(outputs: List[str], dbase_table_name: str) -> None:
                              action TEXT,
                              court_outcome TEXT,
                              amount_fined FLOAT,
-                             filename VARCHAR(20)
+                             filename VARCHAR(20),
+                             row_key BIGINT,
+                             row_hash BIGINT,
+                             INDEX (row_key)
                          )
                          """
     _ = conn.execute(create_table_query)
+    # Add columns used by incremental ingestion to tables created earlier
+    row_key_cols = pd.read_sql(
+        f"SHOW COLUMNS FROM {dbase_table_name} LIKE 'row_key'", con=conn
+    )
+    if row_key_cols.empty:
+        _ = conn.execute(
+            f"""
+            ALTER TABLE {dbase_table_name}
+            ADD COLUMN row_key BIGINT,
+            ADD COLUMN row_hash BIGINT,
+            ADD INDEX (row_key)
+            """
+        )
     conn.close()
-    engine.dispose()
     logger.info("Done.")
 
 
@@ -115,36 +224,33 @@ def prepare_database(outputs: List[str], dbase_table_name: str) -> None:
     retries=2,
     retry_delay_seconds=0,
 )
+@instrument
 def extract(
-    zip_filenames: List[str], outputs: List[str], table_name: str
+    zip_filenames: List[str],
+    outputs: List[str],
+    table_name: str,
+    max_workers: int = 4,
 ) -> List[str]:
     """Retrieve dinesafe data snapshot XML files from WayBackMachine."""
     _, uri, _ = outputs
     logger = get_logger()
-    available_files = []
-    for zip_fname in zip_filenames:
-        # Assemble source URL
-        url = (
-            f"https://web.archive.org/web/{zip_fname}/"
-            "http://opendata.toronto.ca/public.health/dinesafe/dinesafe.zip"
-        )
-        # Create path to target dir, where extracted .XML file will be found
-        target_dir = f"data/raw/{zip_fname}"
-        fpath = f"data/raw/{zip_fname}/dinesafe.xml"
-        if not os.path.exists(fpath):
-            logger.info(f"Downloading {zip_fname} locally to {fpath}...")
-            # Get zipped file containing .XML file
-            r = requests.get(url)
-            # Extract to target dir
-            with ZipFile(BytesIO(r.content)) as zfile:
-                zfile.extractall(target_dir)
-            logger.info("Done.")
-        else:
-            logger.info(f"Found {zip_fname} locally at {fpath}. Did nothing.")
-        available_files.append(target_dir)
+    logger.info(
+        f"Downloading {len(zip_filenames)} data snapshots (if not found "
+        f"locally) with {max_workers} workers..."
+    )
+    # Download zipped files containing .XML files concurrently and extract
+    # them to target dirs
+    available_files = download_snapshots(
+        zip_filenames, "data/raw", max_workers
+    )
+    logger.info("Done.")
+
+    if is_duckdb_uri(uri):
+        # View is re-created over all (cached) snapshots in every run
+        return [available_files, []]
 
     # Get list of filenames with data already in database
-    engine = create_engine(uri)
+    engine = get_engine(uri)
     conn = engine.connect()
     existing_filenames = pd.read_sql(
         f"SELECT DISTINCT(filename) AS fnames FROM {table_name}",
@@ -152,14 +258,19 @@ def extract(
     )
     existing_filenames = existing_filenames["fnames"].astype(int).tolist()
     conn.close()
-    engine.dispose()
     return [available_files, existing_filenames]
 
 
-def read_data(filepath):
-    """Load an XML file into a DataFrame."""
+def read_data_batches(
+    filepath: str, cols_order_wanted: List[str], batch_size: int = 50_000
+) -> Iterator[pd.DataFrame]:
+    """Stream processed batches of rows from an XML file."""
     fname = filepath.split("/", 3)[-2]
-    return pd.read_xml(filepath).assign(filename=fname)
+    # Columns expected in the raw data (latitude and longitude are not
+    # available in all snapshots and are filled with missing values)
+    raw_cols = [c.upper() for c in cols_order_wanted if c != "filename"]
+    for df in iter_xml_batches(filepath, batch_size, raw_cols):
+        yield process_data(df.assign(filename=fname), cols_order_wanted)
 
 
 def process_data(df, cols_order_wanted):
@@ -178,64 +289,243 @@ def process_data(df, cols_order_wanted):
     for loc_col in ["LATITUDE", "LONGITUDE"]:
         if loc_col not in list(df):
             df[loc_col] = None
-    # Change column names to lowercase, Re-order columns and Change datatype
-    # of the latitude and longitude columns
-    df = df.rename(columns=str.lower)[cols_order_wanted].astype(
-        {"latitude": float, "longitude": float, "filename": int}
+    # Change column names to lowercase, Re-order columns and Change to
+    # compact datatypes
+    df = apply_schema(
+        df.rename(columns=str.lower)[cols_order_wanted], INFRACTIONS_SCHEMA
     )
     return df
 
 
 @task(name="Process raw infraction data")
-def transform(f, existing_filenames, cols_order_wanted, table_name):
+@instrument
+def transform(
+    f,
+    existing_filenames,
+    cols_order_wanted,
+    table_name,
+    batch_size=50_000,
+    cache_dir="data/processed/snapshot_cache",
+    storage_mode: str = "memory",
+    partitions_dir: str = "data/processed/snapshot_partitions",
+):
     """Transform data in downloaded XML files."""
     logger = get_logger()
     f_int = int(os.path.basename(f))
-    if f_int not in existing_filenames:
-        fpath = f"{f}/dinesafe.xml"
-        logger.info(f"Transforming {fpath}...")
-        df = read_data(fpath)
-        df = process_data(df, cols_order_wanted)
-        logger.info("Done.")
-    else:
+    if f_int in existing_filenames:
         logger.info(
             f"Found data from {f_int} in database table {table_name}. "
             "Did nothing."
         )
-        df = pd.DataFrame()
+        return pd.DataFrame() if storage_mode == "memory" else None
+
+    fpath = f"{f}/dinesafe.xml"
+    # Cached file is keyed by the hash of the XML file and of the
+    # processing logic (parsing, processing and schema), so changes to
+    # either trigger re-processing
+    logic_version = get_logic_version(
+        [
+            iter_xml_records,
+            iter_xml_batches,
+            read_data_batches,
+            process_data,
+            get_fixed_categories,
+            apply_schema,
+            write_partition,
+        ],
+        cols_order_wanted,
+        INFRACTIONS_SCHEMA,
+    )
+    if storage_mode == "partitioned":
+        # Batches are written to disk as they are parsed, and only the
+        # location and size of the partition is returned
+        partition_dir = get_partition_dir(
+            get_cache_filepath(fpath, logic_version, partitions_dir)
+        )
+        partition = read_partition_metadata(partition_dir)
+        if partition is not None:
+            logger.info(f"Found processed {fpath} in {partition_dir}.")
+        else:
+            logger.info(f"Transforming {fpath} into {partition_dir}...")
+            partition = write_partition(
+                read_data_batches(fpath, cols_order_wanted, batch_size),
+                partition_dir,
+                f_int,
+            )
+            logger.info(
+                f"Done. Wrote {partition['num_rows']:,} rows in "
+                f"{partition['num_parts']:,} parts."
+            )
+        return partition
+
+    cache_fpath = get_cache_filepath(fpath, logic_version, cache_dir)
+    df = read_cached_snapshot(cache_fpath)
+    if df is not None:
+        logger.info(f"Loaded processed {fpath} from {cache_fpath}.")
+    else:
+        logger.info(f"Transforming {fpath}...")
+        # Stream typed batches of rows instead of loading full XML tree
+        # (this only bounds memory used while parsing, since the whole
+        # snapshot is returned; partitioned storage also bounds the rest)
+        df = pd.concat(
+            read_data_batches(fpath, cols_order_wanted, batch_size),
+            ignore_index=True,
+        )
+        # Categories differ between batches, so they are re-applied
+        df = apply_schema(df, INFRACTIONS_SCHEMA)
+        write_cached_snapshot(df, cache_fpath)
+        logger.info("Done.")
     return df
 
 
+@task(name="Process raw infraction data in worker")
+def transform_in_worker(
+    f,
+    existing_filenames,
+    cols_order_wanted,
+    table_name,
+    storage_mode: str = "memory",
+    pool_settings: Optional[Dict] = None,
+    instrumentation_settings: Optional[Dict] = None,
+) -> Dict:
+    """Transform data in downloaded XML file, with metrics of the worker."""
+    # Dask workers run in separate processes, so settings of the flow are
+    # passed along and metrics are returned with the result
+    if pool_settings:
+        configure_engine_pool(**pool_settings)
+    if instrumentation_settings:
+        configure_instrumentation(**instrumentation_settings)
+    with collect_metrics() as metrics:
+        result = transform.fn(
+            f,
+            existing_filenames,
+            cols_order_wanted,
+            table_name,
+            storage_mode=storage_mode,
+        )
+    return {"result": result, "metrics": metrics}
+
+
 @flow(task_runner=DaskTaskRunner(), name="Process raw infraction data")
-def transform_all(files_lists, cols_order_wanted, table_name) -> List:
+@instrument
+def transform_all(
+    files_lists, cols_order_wanted, table_name, storage_mode: str = "memory"
+) -> List:
     """Transform data in downloaded XML files."""
     available_files, existing_filenames = files_lists
     dfs_state = []
     for f in available_files:
-        state = transform(f, existing_filenames, cols_order_wanted, table_name)
+        state = transform_in_worker(
+            f,
+            existing_filenames,
+            cols_order_wanted,
+            table_name,
+            storage_mode=storage_mode,
+            pool_settings=dict(POOL_SETTINGS),
+            instrumentation_settings=dict(INSTRUMENTATION_SETTINGS),
+        )
         dfs_state.append(state)
     return dfs_state
 
 
 @task(name="Append transformed infractions to database table")
+@instrument
 def load(
-    dfs: List[pd.DataFrame], outputs: List[str], table_name="inspections"
+    dfs: List,
+    outputs: List[str],
+    table_name="inspections",
+    load_method: str = "multirow",
+    chunksize: int = 10_000,
+    ingestion_mode: str = "full",
+    storage_mode: str = "memory",
 ) -> pd.DataFrame:
     """Vertically concatenate list of DataFrames and Append to database."""
     _, uri, _ = outputs
     logger = get_logger()
-    dfs_all = pd.concat(dfs, ignore_index=True).drop_duplicates(
-        keep="first", subset=None
-    )
-    engine = create_engine(uri)
-    conn = engine.connect()
-    if not dfs_all.empty:
-        logger.info(f"Appending data to database table {table_name}...")
-        dfs_all.to_sql(
-            name=table_name, con=conn, index=False, if_exists="append"
+    if is_duckdb_uri(uri):
+        # Infractions are queried from the processed snapshots in place,
+        # instead of being appended to a table
+        if storage_mode == "partitioned":
+            filenames = [p["filename"] for p in dfs if p]
+        else:
+            filenames = [df["filename"].iloc[0] for df in dfs if not df.empty]
+        logger.info(f"Creating view {table_name} over processed snapshots...")
+        create_infractions_view(
+            uri,
+            table_name,
+            get_snapshot_paths(list(map(str, filenames)), storage_mode),
         )
         logger.info("Done.")
+        return sorted(filenames)
+    # LOAD DATA LOCAL INFILE must be enabled by the MySQL client
+    connect_args = {"local_infile": True} if load_method == "load_data" else {}
+    engine = get_engine(uri, connect_args=connect_args)
+    conn = engine.connect()
+    occurrence_counts = None
+    if storage_mode == "partitioned":
+        # Parts of partitions (snapshots) are read and appended one at a
+        # time, with the most recent snapshot first
+        partitions = sorted(
+            [p for p in dfs if p], key=lambda p: p["filename"], reverse=True
+        )
+        dfs_groups = (
+            [df] for p in partitions for df in iter_partition(p["path"])
+        )
+        occurrence_counts = OccurrenceCounts()
     else:
+        dfs_groups = iter([dfs])
+    if ingestion_mode == "incremental":
+        check_row_keys(conn, table_name)
+        row_key_index = RowKeyIndex(conn, table_name)
+        seen_keys = SeenKeys()
+
+    num_appended = 0
+    for dfs_group in dfs_groups:
+        if ingestion_mode == "incremental":
+            # Only append infractions that are new or changed since they
+            # were last loaded, and replace (upsert) the changed ones
+            dfs_all, changed_keys = get_new_infractions(
+                dfs_group, row_key_index, seen_keys, occurrence_counts
+            )
+            logger.info(
+                f"Found {len(dfs_all) - len(changed_keys):,} new and "
+                f"{len(changed_keys):,} changed infractions."
+            )
+            # Establishments of replaced rows are recomputed, in case a
+            # changed infraction moved to a different establishment
+            df_deleted = get_establishments_by_key(
+                conn, table_name, changed_keys
+            )
+            delete_rows_by_key(conn, table_name, changed_keys)
+        else:
+            dfs_all = pd.concat(dfs_group, ignore_index=True).drop_duplicates(
+                keep="first", subset=None
+            )
+        if dfs_all.empty:
+            continue
+        logger.info(
+            f"Appending data to database table {table_name} with "
+            f"{load_method} bulk load method..."
+        )
+        load_stats = bulk_load(
+            dfs_all, conn, table_name, load_method, chunksize
+        )
+        logger.info(
+            f"Done. Appended {load_stats['rows']:,} rows in "
+            f"{load_stats['seconds']:.1f} seconds "
+            f"({load_stats['rows_per_sec']:,.0f} rows/sec)."
+        )
+        num_appended += load_stats["rows"]
+        if ingestion_mode == "incremental":
+            row_key_index.update(dfs_all)
+            add_touched_establishments(
+                pd.concat(
+                    [dfs_all[ESTABLISHMENT_COLS], df_deleted],
+                    ignore_index=True,
+                ),
+                table_name,
+            )
+    if not num_appended:
         logger.info(
             f"No new data to append to database table {table_name}. "
             "Did nothing."
@@ -248,158 +538,238 @@ def load(
         con=conn,
     )["fnames"].tolist()
     conn.close()
-    engine.dispose()
     return all_existing_filenames
 
 
 # Functionality from 2_*.ipynb
-def get_actions_str(conn, table_name: str) -> List:
-    """Get actions str for SQL query."""
-    df_actions = pd.read_sql(
-        f"""
-        SELECT DISTINCT(action)
-        FROM {table_name}
-        """,
-        con=conn,
+def get_grouped_infractions_query(
+    table_name: str,
+    establishment_types_wanted: List[str],
+    establishment_ids: Optional[List[int]] = None,
+    dialect: str = "mysql",
+) -> str:
+    """Get SQL query to group infractions by inspection, action, outcome."""
+    # Establishment types use MySQL-escaped quotes (eg. Farmer\'s Market)
+    establishment_types_wanted_str = (
+        "('"
+        + "', '".join(
+            t.replace("\\'", "'").replace("'", SQL_DIALECTS[dialect]["quote"])
+            for t in establishment_types_wanted
+        )
+        + "')"
+    )
+    # Optionally, only scan infractions of some establishments
+    establishment_ids_str = (
+        "AND establishment_id IN ("
+        + (", ".join(map(str, establishment_ids)) or "NULL")
+        + ")"
+        if establishment_ids is not None
+        else ""
     )
-    action_strs = []
-    dtypes_dict = {}
-    for _, row in df_actions.iterrows():
-        act_str = row["action"] if row["action"] else "NULL"
-        action_value = f"= '{act_str}'" if act_str != "NULL" else "IS NULL"
-        action_cname = act_str.lower().replace(" ", "_")
-        sql_str = (
-            f"SUM(CASE WHEN action {action_value} THEN 1 ELSE 0 END) AS "
-            f"num_{action_cname}"
+    groupby_cols_str = ",".join(INSPECTION_COLS + PIVOT_COLS)
+    sql = SQL_DIALECTS[dialect]
+    case_str = "CAST(SUM(CASE WHEN severity LIKE "
+    when_str = f" THEN 1 ELSE 0 END) AS {sql['integer']}) "
+    group_concat_str = (
+        sql["group_concat"].format(col="infraction_details")
+        + " AS infractions_summary"
+    )
+    counts_str = {
+        severity: f"{case_str}{sql['like'].format(pattern=severity)}{when_str}"
+        for severity in ["S - Significant", "C - Crucial", "M - Minor", "NA -"]
+    }
+    # Single scan of table, with one row per inspection and combination of
+    # action and court outcome (pivoted into columns by pivot_inspections)
+    return f"""
+        SELECT establishment_id,
+            establishmenttype,
+            establishment_address,
+            inspection_date,
+            inspection_id,
+            establishment_status,
+            action,
+            court_outcome,
+            {group_concat_str},
+            {counts_str["S - Significant"]}AS num_significant,
+            {counts_str["C - Crucial"]}AS num_crucial,
+            {counts_str["M - Minor"]}AS num_minor,
+            {counts_str["NA -"]}AS num_na,
+            COUNT(infraction_details) AS num_infractions
+        FROM {table_name}
+        WHERE (
+            establishmenttype IN {establishment_types_wanted_str}
+            AND severity IS NULL
+            OR severity IN ('S - Significant', 'C - Crucial', 'M - Minor')
         )
-        action_strs.append(sql_str)
-        dtypes_dict[f"num_{action_cname}"] = int
-    action_strs = ",\n".join(action_strs)
-    return [action_strs, dtypes_dict]
+        {establishment_ids_str}
+        GROUP BY {groupby_cols_str}
+        """
 
 
-def get_outcomes_str(conn, table_name: str) -> List:
-    """Get actions str for SQL query."""
-    df_court_outcomes = pd.read_sql(
-        f"""
-        SELECT DISTINCT(court_outcome)
-        FROM {table_name}
-        """,
-        con=conn,
+def get_filtered_inspections_query(
+    grouped_query: str,
+    label_col_name: str = "is_infraction",
+    dialect: str = "mysql",
+) -> str:
+    """Get SQL query to filter inspections and create class labels."""
+    establishment_cols_str = (
+        "establishment_id, establishmenttype, establishment_address"
     )
-    outcome_strs = []
-    outcomes_dtypes_dict = {}
-    for _, row in df_court_outcomes.iterrows():
-        outcome_str = row["court_outcome"] if row["court_outcome"] else "NULL"
-        outcome_value = (
-            f"= '{outcome_str}'" if outcome_str != "NULL" else "IS NULL"
-        )
-        outcome_cname = (
-            outcome_str.lower()
-            .replace(" ", "_")
-            .replace("-", "")
-            .replace("__", "_")
-            .replace("&_", "")
-        )
-        outcome_sql_str = (
-            f"SUM(CASE WHEN court_outcome {outcome_value} THEN 1 ELSE 0 END) "
-            f"AS num_{outcome_cname}"
+    inspection_cols_str = ", ".join(INSPECTION_COLS)
+    datediff_str = SQL_DIALECTS[dialect]["datediff"].format(
+        start="i.inspection_date",
+        end=(
+            "LEAD(i.inspection_date) OVER ("
+            f"PARTITION BY {establishment_cols_str} "
+            "ORDER BY i.inspection_id, i.inspection_date)"
+        ),
+    )
+    # MySQL does not support COUNT(DISTINCT ...) as a window function, so
+    # single-day inspections are found with GROUP BY ... HAVING (names of
+    # CTEs must differ from table_name, which SQLite resolves to a CTE)
+    return f"""
+        WITH grouped_infractions AS (
+            {grouped_query}
+        ),
+        inspection_totals AS (
+            SELECT {inspection_cols_str},
+                SUM(num_significant) AS num_significant,
+                SUM(num_crucial) AS num_crucial
+            FROM grouped_infractions
+            GROUP BY {inspection_cols_str}
+        ),
+        single_day_inspections AS (
+            SELECT {establishment_cols_str}, inspection_id
+            FROM inspection_totals
+            GROUP BY {establishment_cols_str}, inspection_id
+            HAVING COUNT(DISTINCT inspection_date) = 1
+        ),
+        inspections_with_next AS (
+            SELECT i.*,
+                ABS({datediff_str}) AS days_to_next
+            FROM inspection_totals AS i
+            INNER JOIN single_day_inspections
+            USING ({establishment_cols_str}, inspection_id)
         )
-        outcome_strs.append(outcome_sql_str)
-        outcomes_dtypes_dict[(f"num_{outcome_cname}")] = int
-    outcome_strs = ",\n".join(outcome_strs)
-    return [outcome_strs, outcomes_dtypes_dict]
+        SELECT g.*,
+            n.days_to_next,
+            CASE WHEN n.num_significant > 0 OR n.num_crucial > 0 THEN 1
+            ELSE 0 END AS {label_col_name}
+        FROM grouped_infractions AS g
+        INNER JOIN inspections_with_next AS n
+        USING ({inspection_cols_str})
+        WHERE n.days_to_next > 2 OR n.days_to_next IS NULL
+        """
+
+
+def get_establishment_ids(
+    df_touched: Optional[pd.DataFrame],
+) -> Optional[List[int]]:
+    """Get IDs of establishments to be recomputed (None for all)."""
+    if df_touched is None:
+        return None
+    return sorted(df_touched["establishment_id"].astype(int).unique())
 
 
 @task
+@instrument
 def aggregate_inspections(
-    uri: str, table_name: str, establishment_types_wanted: List[str]
+    uri: str,
+    table_name: str,
+    establishment_types_wanted: List[str],
+    categories_fpath: Optional[str] = None,
+    df_touched: Optional[pd.DataFrame] = None,
 ) -> pd.DataFrame:
     """Get inspections by aggregating all recorded infractions."""
     logger = get_logger()
     logger.info("Aggregate infractions into inspections...")
-    engine = create_engine(uri)
-    conn = engine.connect()
-    action_strs, dtypes_dict = get_actions_str(conn, table_name)
-    outcome_strs, outcomes_dtypes_dict = get_outcomes_str(conn, table_name)
-    establishment_types_wanted_str = (
-        "('" + "', '".join(establishment_types_wanted) + "')"
+    df_grouped = read_sql(
+        get_grouped_infractions_query(
+            table_name,
+            establishment_types_wanted,
+            get_establishment_ids(df_touched),
+            get_dialect(uri),
+        ),
+        uri,
+    )
+    if df_touched is not None:
+        df_grouped = filter_establishments(df_grouped, df_touched)
+    # Categories no longer found are dropped when all establishments are
+    # recomputed, so stored columns are not kept at zero forever
+    categories = get_categories(
+        df_grouped,
+        categories_fpath or get_categories_fpath(uri, table_name),
+        prune=df_touched is None,
+    )
+    df_query = apply_schema(
+        pivot_inspections(df_grouped, categories),
+        INSPECTIONS_SCHEMA,
+        COUNT_DTYPE,
     )
-    groupby_cols = [
+    logger.info("Done.")
+    return df_query
+
+
+@task
+@instrument
+def filter_inspections_in_database(
+    uri: str,
+    table_name: str,
+    establishment_types_wanted: List[str],
+    label_col_name: str = "is_infraction",
+    categories_fpath: Optional[str] = None,
+    df_touched: Optional[pd.DataFrame] = None,
+) -> pd.DataFrame:
+    """Aggregate, filter and label inspections inside the database."""
+    logger = get_logger()
+    logger.info("Aggregate, filter and label inspections in database...")
+    query = get_filtered_inspections_query(
+        get_grouped_infractions_query(
+            table_name,
+            establishment_types_wanted,
+            get_establishment_ids(df_touched),
+            get_dialect(uri),
+        ),
+        label_col_name,
+        get_dialect(uri),
+    )
+    df_grouped = read_sql(query, uri)
+    if df_touched is not None:
+        df_grouped = filter_establishments(df_grouped, df_touched)
+    # Filtered inspections may not have all categories of the table, so
+    # cached categories are kept
+    categories = get_categories(
+        df_grouped, categories_fpath or get_categories_fpath(uri, table_name)
+    )
+    df = pivot_inspections(
+        df_grouped, categories, ["days_to_next", label_col_name]
+    )
+    df = apply_schema(df, INSPECTIONS_SCHEMA, COUNT_DTYPE)
+    df["inspection_date"] = pd.to_datetime(df["inspection_date"])
+    # Same column order and row order as when filtering inspections with
+    # pandas (columns are moved by position, since both actions and court
+    # outcomes can have a num_null column)
+    merge_cols = [
         "establishment_id",
         "establishmenttype",
         "establishment_address",
-        "inspection_date",
         "inspection_id",
-        "establishment_status",
-        "action",
-        "court_outcome",
     ]
-    groupby_cols_str = ",".join(groupby_cols)
-    case_str = "CAST(SUM(CASE WHEN severity LIKE "
-    when_str = " THEN 1 ELSE 0 END) AS SIGNED) "
-    group_concat_str2 = (
-        "GROUP_CONCAT(infractions_summary SEPARATOR '. ') AS "
-        "infractions_summary"
-    )
-    group_concat_str = (
-        "GROUP_CONCAT(infraction_details SEPARATOR '. ') AS "
-        "infractions_summary"
-    )
-    df_query = pd.read_sql(
-        f"""
-        SELECT establishment_id,
-            establishmenttype,
-            establishment_address,
-            inspection_date,
-            inspection_id,
-            establishment_status,
-            {group_concat_str2},
-            SUM(num_significant) AS num_significant,
-            SUM(num_crucial) AS num_crucial,
-            SUM(num_minor) AS num_minor,
-            SUM(num_na) AS num_na,
-            SUM(num_infractions) AS num_infractions,
-            {action_strs},
-            {outcome_strs}
-        FROM (
-            SELECT establishment_id,
-                establishmenttype,
-                establishment_address,
-                inspection_date,
-                inspection_id,
-                {group_concat_str},
-                establishment_status,
-                action,
-                court_outcome,
-                {case_str}"%%S - Significant"{when_str}AS num_significant,
-                {case_str}"%%C - Crucial"{when_str}AS num_crucial,
-                {case_str}"%%M - Minor"{when_str}AS num_minor,
-                {case_str}"%%NA -"{when_str}AS num_na,
-                COUNT(infraction_details) AS num_infractions
-            FROM {table_name}
-            WHERE establishmenttype IN {establishment_types_wanted_str}
-            AND severity IS NULL
-            OR severity IN ('S - Significant', 'C - Crucial', 'M - Minor')
-            GROUP BY {groupby_cols_str}
-        ) AS combo
-        GROUP BY establishment_id,
-                establishmenttype,
-                establishment_address,
-                inspection_date,
-                inspection_id,
-                establishment_status
-        """,
-        con=conn,
+    cols = list(df)
+    df = df.iloc[
+        :,
+        [cols.index(c) for c in merge_cols]
+        + [k for k, c in enumerate(cols) if c not in merge_cols],
+    ]
+    df = df.sort_values(by=merge_cols + ["inspection_date"]).reset_index(
+        drop=True
     )
-    df_query = df_query.astype(dtypes_dict).astype(outcomes_dtypes_dict)
-    conn.close()
-    engine.dispose()
     logger.info("Done.")
-    return df_query
+    return df
 
 
 @task
+@instrument
 def remove_multi_day_inspections(df: pd.DataFrame) -> pd.DataFrame:
     """Remove inspection IDs taking more than one day to complete."""
     logger = get_logger()
@@ -411,7 +781,9 @@ def remove_multi_day_inspections(df: pd.DataFrame) -> pd.DataFrame:
         "inspection_id",
     ]
     df_query_no_multi_day_inspections = (
-        df.groupby(merge_cols, as_index=False)["inspection_date"]
+        df.groupby(merge_cols, as_index=False, observed=True)[
+            "inspection_date"
+        ]
         .nunique()
         .query("inspection_date == 1")
         .sort_values(by=["inspection_date"], ascending=False)
@@ -426,6 +798,7 @@ def remove_multi_day_inspections(df: pd.DataFrame) -> pd.DataFrame:
 
 
 @task
+@instrument
 def remove_reinspections(df: pd.DataFrame) -> pd.DataFrame:
     """Remove re-inspections."""
     logger = get_logger()
@@ -437,6 +810,7 @@ def remove_reinspections(df: pd.DataFrame) -> pd.DataFrame:
                 "establishmenttype",
                 "establishment_address",
             ],
+            observed=True,
         )["inspection_date"]
         .diff(-1)
         .dt.days.abs()
@@ -451,6 +825,7 @@ def remove_reinspections(df: pd.DataFrame) -> pd.DataFrame:
 
 
 @task
+@instrument
 def create_class_labels(
     df: pd.DataFrame, label_col_name: str = "is_infraction"
 ) -> pd.DataFrame:
@@ -460,21 +835,39 @@ def create_class_labels(
     mask = (df["num_significant"] > 0) | (df["num_crucial"] > 0)
     df[label_col_name] = 0
     df.loc[mask, label_col_name] = 1
+    df = apply_schema(df, INSPECTIONS_SCHEMA, COUNT_DTYPE)
     logger.info("Done.")
     return df
 
 
 @flow(name="Converting infractions into inspections")
+@instrument
 def convert_infractions_to_inspections(
     establishment_types_wanted: List[str],
     outputs: List[str],
     table_name: str,
     distinct_fnames: List[str],
     label_col_name: str = "is_infraction",
+    execution_mode: str = "pandas",
+    df_touched: Optional[pd.DataFrame] = None,
 ):
     """Aggregate infractions into inspections, filter and create labels."""
     _, uri, _ = outputs
-    df = aggregate_inspections(uri, table_name, establishment_types_wanted)
+    # Push filters and class labels down into database, so that only the
+    # remaining inspections are transferred
+    if execution_mode == "database":
+        return filter_inspections_in_database(
+            uri,
+            table_name,
+            establishment_types_wanted,
+            label_col_name,
+            df_touched=df_touched,
+        )
+    # Filters only compare inspections of the same establishment, so the
+    # establishments changed by new data can be recomputed on their own
+    df = aggregate_inspections(
+        uri, table_name, establishment_types_wanted, df_touched=df_touched
+    )
     df = remove_multi_day_inspections(df)
     df = remove_reinspections(df)
     df = create_class_labels(df, label_col_name)
@@ -483,6 +876,7 @@ def convert_infractions_to_inspections(
 
 # Functionality from 3_*.ipynb
 @task
+@instrument
 def get_missing_lat_lon(
     df: pd.DataFrame, outputs: List[str], table_name: str
 ) -> List[pd.DataFrame]:
@@ -490,9 +884,7 @@ def get_missing_lat_lon(
     _, uri, _ = outputs
     logger = get_logger()
     logger.info("Getting locations missing a latitude and longitude...")
-    engine = create_engine(uri)
-    conn = engine.connect()
-    df_query = pd.read_sql(
+    df_query = read_sql(
         f"""
         SELECT establishment_id,
                establishmenttype,
@@ -502,10 +894,8 @@ def get_missing_lat_lon(
         FROM {table_name}
         GROUP BY establishment_id, establishmenttype, establishment_address
         """,
-        con=conn,
+        uri,
     )
-    conn.close()
-    engine.dispose()
     df_with_lat_lon = df.merge(
         df_query,
         on=["establishment_id", "establishmenttype", "establishment_address"],
@@ -513,7 +903,7 @@ def get_missing_lat_lon(
     )
     df_addr_lat_lon = (
         df_with_lat_lon.query("latitude.isnull() | longitude.isnull()")
-        .groupby("establishment_address", as_index=False)[
+        .groupby("establishment_address", as_index=False, observed=True)[
             ["latitude", "longitude"]
         ]
         .max()
@@ -527,49 +917,67 @@ def get_missing_lat_lon(
 
 
 @task
+@instrument
 def geocode_missing_addr_lat_lon(
     df_outputs: List[pd.DataFrame],
     outputs: List[str],
     geocoded_table_name,
-    min_delay: int = 1,
-    max_delay: int = 3,
+    requests_per_second: float = 1.0,
+    max_in_flight: int = 4,
+    cache_fpath: str = "data/processed/geocode_cache.sqlite",
 ) -> pd.DataFrame:
     """Geocode locations with a missing address."""
     _, uri, _ = outputs
     logger = get_logger()
     logger.info("Geocoding locations a missing co-ordinates...")
-    engine = create_engine(uri)
-    conn = engine.connect()
     df_with_lat_lon, unique_addresses_missing_lat_lon = df_outputs
+    if is_duckdb_uri(uri):
+        # Geocoded addresses are appended to a SQLite database, since the
+        # DuckDB database only contains a (read-only) view
+        uri = get_sqlite_uri(uri)
+        create_geocoded_table(uri, geocoded_table_name)
     geocode_missing_lat_lon(
         unique_addresses_missing_lat_lon,
         geocoded_table_name,
         uri,
-        min_delay,
-        max_delay,
+        requests_per_second,
+        max_in_flight,
+        cache_fpath=cache_fpath,
     )
-    address_uppercase_sql = (
-        "UCASE(REPLACE(address, ', Toronto, ON, Canada', ''))"
+    # Get geocoded co-ordinates by canonical address, so that differently
+    # spelled versions of the same address are matched
+    address_cache = AddressCache(cache_fpath)
+    unique_addresses = (
+        df_with_lat_lon["establishment_address"].dropna().unique()
     )
-    df_query = pd.read_sql(
-        f"""
-        SELECT {address_uppercase_sql} AS establishment_address,
-               latitude AS latitude_geo,
-               longitude AS longitude_geo
-        FROM addressinfo
-        """,
-        con=conn,
+    df_geocoded = pd.DataFrame.from_records(
+        [
+            (canonical_address, record["latitude"], record["longitude"])
+            for canonical_address, record in address_cache.get_many(
+                unique_addresses
+            ).items()
+        ],
+        columns=["canonical_address", "latitude_geo", "longitude_geo"],
+    ).astype({"latitude_geo": float, "longitude_geo": float})
+    address_cache.close()
+    canonical_addresses = dict(
+        zip(unique_addresses, map(canonicalize_address, unique_addresses))
     )
-    conn.close()
-    engine.dispose()
-    df_with_lat_lon_filled = df_with_lat_lon.merge(
-        df_query, on=["establishment_address"], how="left"
+    df_with_lat_lon_filled = (
+        df_with_lat_lon.assign(
+            canonical_address=df_with_lat_lon["establishment_address"].map(
+                canonical_addresses
+            )
+        )
+        .merge(df_geocoded, on=["canonical_address"], how="left")
+        .drop(columns=["canonical_address"])
     )
     logger.info("Done.")
     return df_with_lat_lon_filled
 
 
 @task
+@instrument
 def replace_missing_lat_lon(df: pd.DataFrame) -> pd.DataFrame:
     """Replace missing values in lat-long columns with geocoded values."""
     logger = get_logger()
@@ -581,6 +989,97 @@ def replace_missing_lat_lon(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
+def get_null_col_names(categories_fpath: str) -> List[str]:
+    """Get names of num_null columns, to tell them apart."""
+    with open(categories_fpath) as f:
+        categories = json.load(f)
+    # Both actions and court outcomes can have a num_null column
+    return [f"{c}_null" for c in PIVOT_COLS if "NULL" in categories[c]]
+
+
+def get_stored_inspections_fpath(table_name: str, data_dir: str) -> str:
+    """Get path to stored table of inspections."""
+    return os.path.join(data_dir, f"{table_name}_inspections.parquet")
+
+
+@task
+@instrument
+def get_touched_establishments(
+    table_name: str, data_dir: str = "data/processed"
+) -> Optional[pd.DataFrame]:
+    """Get establishments changed since they were last recomputed."""
+    logger = get_logger()
+    # Without stored inspections, all establishments must be recomputed
+    if not os.path.exists(get_stored_inspections_fpath(table_name, data_dir)):
+        logger.info("No stored inspections found. Recomputing all.")
+        return None
+    df_touched = read_touched_establishments(table_name, data_dir)
+    logger.info(f"Found {len(df_touched):,} establishments to recompute.")
+    return df_touched
+
+
+@task
+@instrument
+def merge_recomputed_inspections(
+    df: pd.DataFrame,
+    df_touched: Optional[pd.DataFrame],
+    table_name: str,
+    categories_fpath: str,
+    data_dir: str = "data/processed",
+) -> pd.DataFrame:
+    """Replace inspections of recomputed establishments in stored table."""
+    logger = get_logger()
+    logger.info("Merging recomputed inspections into stored inspections...")
+    # Column names must be unique in the stored (Parquet) table, so num_null
+    # columns are renamed while stored
+    null_col_names = get_null_col_names(categories_fpath)
+    df = merge_recomputed_establishments(
+        rename_null_columns(df, null_col_names),
+        df_touched,
+        get_stored_inspections_fpath(table_name, data_dir),
+    ).rename(columns={c: "num_null" for c in null_col_names})
+    clear_touched_establishments(table_name, data_dir)
+    logger.info("Done.")
+    return df
+
+
+# Functionality from 7_feat_engineering.ipynb
+@task
+@instrument
+def engineer_features(
+    df: pd.DataFrame,
+    df_touched: Optional[pd.DataFrame],
+    table_name: str,
+    categories_fpath: str,
+    data_dir: str = "data/processed",
+) -> pd.DataFrame:
+    """Add per-establishment features and store them."""
+    logger = get_logger()
+    logger.info("Engineering features from past inspections...")
+    with open(categories_fpath) as f:
+        categories = json.load(f)
+    null_col_names = get_null_col_names(categories_fpath)
+    action_types, court_outcome_types = [
+        [
+            f"{c}_null" if cat == "NULL" else PIVOT_COL_NAMERS[c](cat)
+            for cat in categories[c]
+        ]
+        for c in PIVOT_COLS
+    ]
+    df_features = add_establishment_features(
+        rename_null_columns(df, null_col_names),
+        action_types,
+        court_outcome_types,
+    )
+    df_features = merge_recomputed_establishments(
+        df_features,
+        df_touched,
+        os.path.join(data_dir, f"{table_name}_features.parquet"),
+    )
+    logger.info("Done.")
+    return df_features
+
+
 # Flow
 @flow(name="Run through end-to-end analysis workflow")
 def analyze_infractions(
@@ -589,10 +1088,51 @@ def analyze_infractions(
     establishment_types_wanted: List,
     table_name: str = "inspections",
     geocoded_table_name: str = "addressinfo",
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_recycle: int = 3_600,
+    ingestion_mode: str = "full",
+    recompute_mode: str = "full",
+    storage_mode: str = "memory",
+    backend: str = "mysql",
+    execution_mode: str = "pandas",
+    metrics_dir: str = "reports/metrics",
+    profile: bool = False,
 ) -> pd.DataFrame:
     """Retrieve data, process and append to database table."""
+    logger = get_logger()
+    start_time = perf_counter()
+    # Metrics of every task and sub-flow in this run are saved together,
+    # with an optional cProfile capture of each task
+    clear_metrics()
+    configure_instrumentation(profile=profile)
+    if backend == "duckdb" and "incremental" in [
+        ingestion_mode,
+        recompute_mode,
+    ]:
+        raise ValueError(
+            "Incremental ingestion and recomputation require the mysql "
+            "backend, since the duckdb backend has no stored table."
+        )
+    if recompute_mode == "incremental" and ingestion_mode != "incremental":
+        raise ValueError(
+            "Incremental recomputation requires incremental ingestion, "
+            "since only it records the establishments changed by new data."
+        )
+    # Single pool of database connections, shared by all tasks in this run
+    configure_engine_pool(
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_recycle=pool_recycle,
+    )
+
     # Database Administration
-    outputs = get_database_uris()
+    # (with the duckdb backend, infractions are queried from the processed
+    # snapshots with an embedded database, so no database server is needed)
+    if backend == "duckdb":
+        outputs = get_embedded_database_uris()
+    else:
+        outputs = get_database_uris()
     prepared_dbase = prepare_database(outputs, table_name)
 
     # Extract
@@ -600,26 +1140,96 @@ def analyze_infractions(
         zip_filenames, outputs, table_name, wait_for=[prepared_dbase]
     )
 
-    # Transform
-    subflow_state = transform_all(files_lists, cols_order_wanted, table_name)
-
-    # Load
-    dfs = list(map(get_state_result, tuple(subflow_state.result())))
-    distinct_fnames = load(dfs, outputs, table_name)
+    # Transform (with partitioned storage, snapshots are written to disk
+    # and only their partition metadata is returned)
+    subflow_state = transform_all(
+        files_lists, cols_order_wanted, table_name, storage_mode
+    )
 
-    # Filter invalid infractions and Aggregate into inspections
-    df = convert_infractions_to_inspections(
-        establishment_types_wanted,
+    # Load (metrics of transforms run by Dask workers are returned with
+    # their results, and recorded with those of this run)
+    results = list(map(get_state_result, tuple(subflow_state.result())))
+    add_metrics([record for r in results for record in r["metrics"]])
+    dfs = [r["result"] for r in results]
+    distinct_fnames = load(
+        dfs,
         outputs,
         table_name,
-        distinct_fnames,
-        "is_infraction",
+        ingestion_mode=ingestion_mode,
+        storage_mode=storage_mode,
     )
 
-    # Geocode missing latitudes and longitudes
-    df_outputs = get_missing_lat_lon(df.result().result(), outputs, table_name)
-    df_geocoded = geocode_missing_addr_lat_lon(
-        df_outputs, outputs, geocoded_table_name, 1, 3
+    # Only recompute establishments changed by new data, and merge them
+    # into stored inspections
+    # Categories of actions and court outcomes are cached per table and
+    # database, as the columns of inspections and features
+    categories_fpath = get_categories_fpath(outputs[1], table_name)
+    df_touched = None
+    if recompute_mode == "incremental":
+        df_touched = (
+            get_touched_establishments(table_name, wait_for=[distinct_fnames])
+            .result()
+            .result()
+        )
+    if df_touched is not None and df_touched.empty:
+        df = merge_recomputed_inspections(
+            pd.DataFrame(), df_touched, table_name, categories_fpath
+        )
+    else:
+        # Filter invalid infractions and Aggregate into inspections
+        df = convert_infractions_to_inspections(
+            establishment_types_wanted,
+            outputs,
+            table_name,
+            distinct_fnames,
+            "is_infraction",
+            execution_mode,
+            df_touched=df_touched,
+        )
+
+        # Geocode missing latitudes and longitudes
+        df_outputs = get_missing_lat_lon(
+            df.result().result(), outputs, table_name
+        )
+        df_geocoded = geocode_missing_addr_lat_lon(
+            df_outputs, outputs, geocoded_table_name, 1.0, 4
+        )
+        df = replace_missing_lat_lon(df_geocoded)
+        # Features only depend on inspections of the same establishment,
+        # so they are also only recomputed for changed establishments
+        df_features = engineer_features(
+            df, df_touched, table_name, categories_fpath
+        )
+        if recompute_mode == "incremental":
+            df = merge_recomputed_inspections(
+                df,
+                df_touched,
+                table_name,
+                categories_fpath,
+                wait_for=[df_features],
+            )
+
+    # Wait for last task, then report pool usage and close connections
+    _ = df.result()
+    for engine_url, pool_metrics in get_pool_metrics().items():
+        logger.info(
+            f"Connection pool metrics for {engine_url}: {pool_metrics}"
+        )
+    dispose_engines()
+    metrics_fpath = write_run_metrics(
+        {
+            "flow": "analyze_infractions",
+            "wall_seconds": perf_counter() - start_time,
+            "ingestion_mode": ingestion_mode,
+            "recompute_mode": recompute_mode,
+            "storage_mode": storage_mode,
+            "backend": backend,
+            "execution_mode": execution_mode,
+        },
+        metrics_dir,
+    )
+    logger.info(
+        f"Task metrics (saved to {metrics_fpath}):\n"
+        f"{get_metrics_summary(get_metrics()).to_string()}"
     )
-    df = replace_missing_lat_lon(df_geocoded)
     return df
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Utilities to stream records from DineSafe XML snapshots."""
+
+# pylint: disable=invalid-name
+
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+from lxml import etree
+
+
+def iter_xml_records(filepath: str) -> Iterator[Dict[str, Optional[str]]]:
+    """Yield one dictionary per child (row) of the XML document root."""
+    depth = 0
+    root = None
+    for event, elem in etree.iterparse(filepath, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if depth == 1:
+                root = elem
+            continue
+        depth -= 1
+        # Only rows (children of the root element) are converted to records,
+        # each of their children being one column of the record
+        if depth == 1:
+            yield {child.tag: child.text for child in elem}
+            # Free the row and every row already processed, so that memory
+            # use does not grow with the size of the file
+            elem.clear()
+            while elem.getprevious() is not None:
+                del root[0]
+
+
+def iter_xml_batches(
+    filepath: str, batch_size: int = 50_000, columns: List[str] = None
+) -> Iterator[pd.DataFrame]:
+    """Yield fixed-size DataFrames of string-valued records from XML file."""
+    records = []
+    for record in iter_xml_records(filepath):
+        records.append(record)
+        if len(records) == batch_size:
+            yield pd.DataFrame.from_records(records, columns=columns)
+            records = []
+    if records:
+        yield pd.DataFrame.from_records(records, columns=columns)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Fixtures shared by tests of aggregation and filtering of inspections."""
+
+# pylint: disable=invalid-name,redefined-outer-name
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+INFRACTION_COLS = [
+    "row_id",
+    "establishment_id",
+    "inspection_id",
+    "establishment_name",
+    "establishmenttype",
+    "establishment_address",
+    "latitude",
+    "longitude",
+    "establishment_status",
+    "minimum_inspections_peryear",
+    "infraction_details",
+    "inspection_date",
+    "severity",
+    "action",
+    "court_outcome",
+    "amount_fined",
+    "filename",
+]
+
+
+@pytest.fixture
+def establishment_types_wanted():
+    """Get types of establishments kept, including one with a quote."""
+    return ["Restaurant", "Food Take Out", "Farmer's Market"]
+
+
+@pytest.fixture
+def infractions() -> pd.DataFrame:
+    """Get infractions of a few establishments, with inspections to filter."""
+    # fmt: off
+    rows = [
+        # Inspection followed by a re-inspection within 2 days
+        (1, 10, "Restaurant", "1 KING ST", "2020-01-01", "S - Significant",
+         "Notice to Comply", None, None),
+        (1, 10, "Restaurant", "1 KING ST", "2020-01-01", "M - Minor",
+         "Notice to Comply", "", None),
+        (1, 11, "Restaurant", "1 KING ST", "2020-01-02", None, None, None,
+         None),
+        (1, 12, "Restaurant", "1 KING ST", "2020-06-01", "M - Minor",
+         "Ticket", "Conviction - Fined", 55.0),
+        # Same establishment ID at another address (not a re-inspection)
+        (1, 13, "Restaurant", "5 BAY ST", "2020-01-02", "C - Crucial",
+         "Closed", None, None),
+        # Inspection taking more than one day
+        (2, 20, "Food Take Out", "2 QUEEN ST", "2020-02-01", "M - Minor",
+         "Notice to Comply", None, None),
+        (2, 20, "Food Take Out", "2 QUEEN ST", "2020-02-05", "M - Minor",
+         "", None, None),
+        (2, 21, "Food Take Out", "2 QUEEN ST", "2020-03-01", "C - Crucial",
+         "Ticket", "Conviction - Fined", 250.0),
+        # Establishment type with a quote
+        (3, 30, "Farmer's Market", "3 BLOOR ST", "2021-05-01", None, None,
+         None, None),
+        # Establishment type that is not wanted
+        (4, 40, "Bakery", "4 DUNDAS ST", "2021-05-01", None, None, None,
+         None),
+    ]
+    # fmt: on
+    df = pd.DataFrame(
+        rows,
+        columns=[
+            "establishment_id",
+            "inspection_id",
+            "establishmenttype",
+            "establishment_address",
+            "inspection_date",
+            "severity",
+            "action",
+            "court_outcome",
+            "amount_fined",
+        ],
+    )
+    return df.assign(
+        row_id=range(len(df)),
+        establishment_name=df["establishment_address"].str.title(),
+        latitude=43.7,
+        longitude=-79.4,
+        establishment_status="Pass",
+        minimum_inspections_peryear=2,
+        infraction_details=[
+            f"Infraction {k}" if s else None
+            for k, s in enumerate(df["severity"])
+        ],
+        inspection_date=pd.to_datetime(df["inspection_date"]),
+        filename=20220101000000,
+    )[INFRACTION_COLS]
+
+
+@pytest.fixture
+def sqlite_uri(tmp_path, infractions) -> str:
+    """Get URI of SQLite database with a table of infractions."""
+    uri = f"sqlite:///{tmp_path / 'infractions.sqlite'}"
+    engine = create_engine(uri)
+    with engine.begin() as conn:
+        infractions.to_sql("inspections", conn, index=False)
+    engine.dispose()
+    return uri
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of canonical addresses used as keys of the geocode cache."""
+
+# pylint: disable=invalid-name
+
+import pytest
+
+from src.address_cache import AddressCache, canonicalize_address
+
+
+@pytest.mark.parametrize(
+    "address",
+    [
+        # Street names starting with a unit keyword
+        "1000 STEELES AVE W",
+        "100 STEPHEN DR",
+        "100 STERLING RD",
+        "5 UNITY RD",
+        "12 RMC DR",
+        "1 APTOS CRT",
+        "1 STE ANNE ST",
+        # Ranges of street numbers
+        "100-102 QUEEN ST W",
+        "5-7 KING ST",
+    ],
+)
+def test_canonicalize_address_keeps_street(address):
+    """Street names and number ranges are not removed."""
+    assert canonicalize_address(address) == address
+
+
+@pytest.mark.parametrize(
+    "address, canonical_address",
+    [
+        ("100 King St W Unit 5", "100 KING ST W"),
+        ("100 King St W, Suite 1200", "100 KING ST W"),
+        ("100 KING ST W STE 3A", "100 KING ST W"),
+        ("100 KING ST W APT#4", "100 KING ST W"),
+        ("100 KING ST W UNIT B", "100 KING ST W"),
+        ("100 KING ST W #12", "100 KING ST W"),
+        ("12-345 MAIN ST", "345 MAIN ST"),
+        ("1205-100 King Street West, Toronto, ON", "100 KING ST W"),
+        ("100 Queen St. West, Toronto, ON, Canada", "100 QUEEN ST W"),
+    ],
+)
+def test_canonicalize_address_removes_unit(address, canonical_address):
+    """Units, city suffixes and spelling differences are removed."""
+    assert canonicalize_address(address) == canonical_address
+
+
+def test_address_cache_does_not_share_unrelated_streets(tmp_path):
+    """Streets named like unit keywords get their own cached record."""
+    address_cache = AddressCache(str(tmp_path / "geocode_cache.sqlite"))
+    address_cache.put_many([{"address": "1000 Ave W", "latitude": 1.0}])
+    assert address_cache.get_many(["1000 Steeles Ave W"]) == {}
+    assert list(address_cache.get_many(["1000 AVE W, Toronto"])) == [
+        "1000 AVE W"
+    ]
+    address_cache.close()
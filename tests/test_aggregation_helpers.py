@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of single-pass aggregation of infractions into inspections."""
+
+# pylint: disable=invalid-name
+
+import json
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from src.aggregation_helpers import (
+    INSPECTION_COLS,
+    PIVOT_COL_NAMERS,
+    PIVOT_COLS,
+    SEVERITY_COLS,
+    get_categories,
+    get_categories_fpath,
+    pivot_inspections,
+)
+
+INSPECTION_COLS_STR = ", ".join(INSPECTION_COLS)
+
+
+def get_grouped_query() -> str:
+    """Get query grouping infractions by inspection, action and outcome."""
+    severity_strs = ",\n".join(
+        f"SUM(CASE WHEN severity LIKE '%{s}' THEN 1 ELSE 0 END) AS {c}"
+        for s, c in [
+            ("S - Significant", "num_significant"),
+            ("C - Crucial", "num_crucial"),
+            ("M - Minor", "num_minor"),
+            ("NA -", "num_na"),
+        ]
+    )
+    return f"""
+        SELECT {INSPECTION_COLS_STR},
+            action,
+            court_outcome,
+            GROUP_CONCAT(infraction_details, '. ') AS infractions_summary,
+            {severity_strs},
+            COUNT(infraction_details) AS num_infractions
+        FROM inspections
+        GROUP BY {INSPECTION_COLS_STR}, action, court_outcome
+        """
+
+
+def get_case_query(categories) -> str:
+    """Get query counting categories with SUM(CASE ...), per inspection."""
+    case_strs = []
+    for c in PIVOT_COLS:
+        for cat in categories[c]:
+            value_str = "IS NULL" if cat == "NULL" else f"= '{cat}'"
+            case_strs.append(
+                f"SUM(CASE WHEN {c} {value_str} THEN 1 ELSE 0 END) "
+                f'AS "{c}__{cat}"'
+            )
+    case_strs = ",\n".join(case_strs)
+    return f"""
+        SELECT {INSPECTION_COLS_STR},
+            {case_strs}
+        FROM ({get_grouped_query()}) AS combo
+        GROUP BY {INSPECTION_COLS_STR}
+        ORDER BY inspection_id, inspection_date
+        """
+
+
+def test_pivot_inspections_matches_sum_case(sqlite_uri, tmp_path):
+    """Counts of actions and outcomes match SUM(CASE ...) in the database."""
+    engine = create_engine(sqlite_uri)
+    with engine.connect() as conn:
+        df_grouped = pd.read_sql(get_grouped_query(), con=conn)
+        categories = get_categories(df_grouped, str(tmp_path / "cats.json"))
+        df_expected = pd.read_sql(get_case_query(categories), con=conn)
+    engine.dispose()
+    # Empty values are found in both columns, alongside missing values
+    for c in PIVOT_COLS:
+        assert df_grouped[c].eq("").any() and df_grouped[c].isna().any()
+        assert "NULL" in categories[c]
+
+    df = pivot_inspections(df_grouped, categories)
+    df = df.sort_values(by=["inspection_id", "inspection_date"])
+    df = df.reset_index(drop=True)
+    assert list(df).count("num_null") == 2
+    pd.testing.assert_frame_equal(
+        df[INSPECTION_COLS], df_expected[INSPECTION_COLS]
+    )
+    start = len(INSPECTION_COLS) + 1 + len(SEVERITY_COLS)
+    for c in PIVOT_COLS:
+        stop = start + len(categories[c])
+        df_counts = df.iloc[:, start:stop]
+        assert list(df_counts) == [
+            PIVOT_COL_NAMERS[c](cat) for cat in categories[c]
+        ]
+        assert (
+            df_counts.to_numpy().tolist()
+            == df_expected[[f"{c}__{cat}" for cat in categories[c]]]
+            .to_numpy()
+            .tolist()
+        )
+        start = stop
+
+
+def test_get_categories_prune(tmp_path):
+    """Categories no longer found are only dropped when pruning."""
+    categories_fpath = str(tmp_path / "cats.json")
+    df = pd.DataFrame(
+        {"action": ["Closed", None], "court_outcome": ["Fined", ""]}
+    )
+    get_categories(df, categories_fpath)
+    df_new = pd.DataFrame({"action": ["Ticket"], "court_outcome": ["Fined"]})
+    assert get_categories(df_new, categories_fpath) == {
+        "action": ["Closed", "NULL", "Ticket"],
+        "court_outcome": ["Fined", "NULL"],
+    }
+    assert get_categories(df_new, categories_fpath, prune=True) == {
+        "action": ["Ticket"],
+        "court_outcome": ["Fined"],
+    }
+    with open(categories_fpath) as f:
+        assert json.load(f)["action"] == ["Ticket"]
+
+
+def test_get_categories_fpath():
+    """Categories are cached per table and database."""
+    fpaths = {
+        get_categories_fpath("sqlite:///a.sqlite", "inspections"),
+        get_categories_fpath("sqlite:///b.sqlite", "inspections"),
+        get_categories_fpath("sqlite:///a.sqlite", "inspections_new"),
+    }
+    assert len(fpaths) == 3
+    assert all("sqlite" not in fpath for fpath in fpaths)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of bulk loading of DataFrames into a SQLite database."""
+
+# pylint: disable=invalid-name,redefined-outer-name
+
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event
+
+from src.bulk_load_helpers import (
+    MAX_PARAMS,
+    bulk_load,
+    load_copy,
+    load_multirow,
+)
+
+
+def get_infractions(num_rows: int) -> pd.DataFrame:
+    """Get infractions with missing values and a datetime column."""
+    return pd.DataFrame(
+        {
+            "inspection_id": np.arange(num_rows),
+            "severity": pd.Series(
+                ["M - Minor", None] * (num_rows // 2),
+                dtype="category",
+            ),
+            "amount_fined": np.where(
+                np.arange(num_rows) % 2, np.nan, 100.0
+            ).astype("float32"),
+            "inspection_date": pd.to_datetime("2022-01-01")
+            + pd.to_timedelta(np.arange(num_rows) % 3, unit="D"),
+        }
+    )
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Get engine of a SQLite database with an empty infractions table."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'infractions.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(
+            """
+            CREATE TABLE infractions (
+                inspection_id INTEGER,
+                severity TEXT,
+                amount_fined FLOAT,
+                inspection_date TEXT
+            )
+            """
+        )
+    yield engine
+    engine.dispose()
+
+
+def read_infractions(engine) -> pd.DataFrame:
+    """Get appended infractions, with a new connection."""
+    with engine.connect() as conn:
+        return pd.read_sql(
+            "SELECT * FROM infractions ORDER BY inspection_id", con=conn
+        )
+
+
+def test_load_multirow_limits_bound_parameters(engine):
+    """Rows per statement keep bound parameters within the limit."""
+    statement_params = []
+
+    def record_params(conn, cursor, statement, parameters, *args):
+        if statement.startswith("INSERT"):
+            statement_params.append(len(parameters))
+
+    event.listen(engine, "before_cursor_execute", record_params)
+    df = get_infractions(1_000)
+    with engine.begin() as conn:
+        load_multirow(df, conn, "infractions", chunksize=10_000)
+    max_rows = MAX_PARAMS["sqlite"] // len(list(df))
+    assert max(statement_params) == max_rows * len(list(df))
+    assert max(statement_params) <= MAX_PARAMS["sqlite"]
+    assert len(statement_params) == -(-len(df) // max_rows)
+    assert len(read_infractions(engine)) == len(df)
+
+
+def test_load_copy_nulls_and_dates(engine):
+    """Missing values are stored as NULL and datetimes as dates."""
+    df = get_infractions(4)
+    with engine.connect() as conn:
+        load_copy(df, conn, "infractions", chunksize=3)
+    df_loaded = read_infractions(engine)
+    assert df_loaded["severity"].tolist() == ["M - Minor", None] * 2
+    assert df_loaded["amount_fined"].isna().tolist() == [False, True] * 2
+    assert df_loaded["inspection_date"].tolist() == [
+        "2022-01-01",
+        "2022-01-02",
+        "2022-01-03",
+        "2022-01-01",
+    ]
+
+
+def test_load_copy_uses_transaction_of_caller(engine):
+    """Rows are only committed with the transaction of the caller."""
+    df = get_infractions(4)
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        load_copy(df, conn, "infractions")
+        assert conn.in_transaction()
+        assert read_infractions(engine).empty
+        transaction.rollback()
+    assert read_infractions(engine).empty
+
+    with engine.connect() as conn:
+        with conn.begin():
+            load_copy(df, conn, "infractions")
+        assert len(read_infractions(engine)) == len(df)
+
+
+def test_load_copy_unsupported_dialect():
+    """Dialects without a native bulk copy path raise an error."""
+    conn = SimpleNamespace(
+        engine=SimpleNamespace(dialect=SimpleNamespace(name="mysql"))
+    )
+    with pytest.raises(ValueError, match="not supported for mysql"):
+        load_copy(get_infractions(2), conn, "infractions")
+
+
+@pytest.mark.parametrize("method", ["multirow", "copy"])
+def test_bulk_load_stats(engine, method):
+    """Rows appended and rows per second are reported."""
+    df = get_infractions(10)
+    with engine.begin() as conn:
+        stats = bulk_load(df, conn, "infractions", method)
+    assert stats["method"] == method
+    assert stats["rows"] == len(df) == len(read_infractions(engine))
+    assert stats["seconds"] > 0
+    assert stats["rows_per_sec"] == pytest.approx(
+        stats["rows"] / stats["seconds"]
+    )
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of cached CKAN responses against a local HTTP server."""
+
+# pylint: disable=invalid-name,redefined-outer-name,wrong-import-position
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import requests
+
+pytest.importorskip("geopandas")
+
+from src import ckan_cache  # noqa: E402
+from src.ckan_cache import CachedCKANClient  # noqa: E402
+from src.download_helpers import get_pooled_session  # noqa: E402
+
+
+def get_body(records) -> bytes:
+    """Get datastore_search response with records."""
+    return json.dumps({"result": {"records": records}}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serve a single response, with ETag revalidation and server errors."""
+
+    def do_GET(self):
+        """Send response, not modified response or server error."""
+        server = self.server
+        server.requests.append(self.headers.get("If-None-Match"))
+        if server.status >= 500:
+            self.send_response(server.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, *args):
+        """Do not log requests."""
+
+
+@pytest.fixture
+def server():
+    """Start local HTTP server in a background thread."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.body = get_body([{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+    httpd.etag = '"v1"'
+    httpd.status = 200
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/search"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def get_client(tmp_path, session=None) -> CachedCKANClient:
+    """Get client revalidating cached responses on every call."""
+    return CachedCKANClient(
+        cache_dir=str(tmp_path),
+        offline=False,
+        metadata_ttl=0,
+        session=session or requests.Session(),
+    )
+
+
+def test_get_file_revalidates_with_etag(server, tmp_path):
+    """Unchanged response is not downloaded again."""
+    client = get_client(tmp_path)
+    body_fpath = client.get_file(server.url, "search")
+    assert client.get_file(server.url, "search") == body_fpath
+    assert server.requests == [None, server.etag]
+    with open(body_fpath, "rb") as f:
+        assert f.read() == server.body
+
+
+@pytest.mark.parametrize("max_retries", [0, 1])
+def test_get_file_uses_stale_copy_on_server_error(
+    server, tmp_path, max_retries
+):
+    """Cached response is used if the server fails, with or without retry."""
+    session = (
+        get_pooled_session(max_retries=max_retries, backoff_factor=0)
+        if max_retries
+        else requests.Session()
+    )
+    client = get_client(tmp_path, session)
+    body_fpath = client.get_file(server.url, "search")
+    server.status = 503
+    assert client.get_file(server.url, "search") == body_fpath
+    with open(body_fpath, "rb") as f:
+        assert f.read() == server.body
+
+
+def test_get_file_raises_on_server_error_without_cache(server, tmp_path):
+    """Server error is raised if no cached response can be used."""
+    server.status = 500
+    with pytest.raises(requests.HTTPError):
+        get_client(tmp_path).get_file(server.url, "search")
+
+
+def test_get_file_offline_without_cache(server, tmp_path):
+    """Uncached response cannot be retrieved in offline mode."""
+    client = CachedCKANClient(cache_dir=str(tmp_path), offline=True)
+    with pytest.raises(FileNotFoundError):
+        client.get_file(server.url, "search")
+    assert not server.requests
+
+
+def test_datastore_search_reuses_parsed_response(
+    server, tmp_path, monkeypatch
+):
+    """Response is parsed once and its body is not hashed again."""
+    hashed_fpaths = []
+    get_file_hash = ckan_cache.get_file_hash
+    monkeypatch.setattr(
+        ckan_cache,
+        "get_file_hash",
+        lambda fpath: hashed_fpaths.append(fpath) or get_file_hash(fpath),
+    )
+    client = get_client(tmp_path)
+    df = client.datastore_search("search", url=server.url)
+    pd.testing.assert_frame_equal(
+        client.datastore_search("search", url=server.url), df
+    )
+    assert list(df["name"]) == ["a", "b"]
+    # Body is only hashed when it is downloaded
+    assert len(hashed_fpaths) == 1
+
+    # Changed response is parsed again, replacing the old parsed file
+    server.body = get_body([{"id": 3, "name": "c"}])
+    server.etag = '"v2"'
+    df = client.datastore_search("search", url=server.url)
+    assert list(df["name"]) == ["c"]
+    assert len(hashed_fpaths) == 2
+    assert len(list(tmp_path.glob("*.parquet"))) == 1
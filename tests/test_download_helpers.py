@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of snapshot downloads against a local HTTP server."""
+
+# pylint: disable=invalid-name,redefined-outer-name
+
+import hashlib
+import io
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from zipfile import ZipFile
+
+import pytest
+
+from src import download_helpers
+from src.download_helpers import (
+    download_file,
+    download_snapshots,
+    get_pooled_session,
+)
+
+CONTENT = os.urandom(100_000)
+
+
+def get_zip_content(zip_fname: str) -> bytes:
+    """Get zipped snapshot with an XML file."""
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w") as zfile:
+        zfile.writestr("dinesafe.xml", f"<ROWDATA>{zip_fname}</ROWDATA>")
+    return buffer.getvalue()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serve files by path, with optional support of Range requests."""
+
+    def do_GET(self):
+        """Send (part of) file, recording the request."""
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, self.headers.get("Range")))
+            server.num_active += 1
+            server.max_active = max(server.max_active, server.num_active)
+        try:
+            sleep(server.delay)
+            content = server.files[self.path]
+            start = 0
+            range_header = self.headers.get("Range")
+            if range_header and server.supports_range:
+                start = int(range_header.split("=")[1].rstrip("-"))
+                if start >= len(content):
+                    self.send_response(416)
+                    self.end_headers()
+                    return
+                self.send_response(206)
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(content) - start))
+            self.end_headers()
+            self.wfile.write(content[start:])
+        finally:
+            with server.lock:
+                server.num_active -= 1
+
+    def log_message(self, *args):
+        """Do not log requests."""
+
+
+@pytest.fixture
+def server():
+    """Start local HTTP server in a background thread."""
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.files = {"/file.bin": CONTENT}
+    httpd.requests = []
+    httpd.lock = threading.Lock()
+    httpd.num_active = 0
+    httpd.max_active = 0
+    httpd.delay = 0
+    httpd.supports_range = True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_file_resumes_partial_download(server, tmp_path):
+    """Only the missing bytes of a partial download are requested."""
+    fpath = str(tmp_path / "file.bin")
+    with open(f"{fpath}.part", "wb") as f:
+        f.write(CONTENT[:40_000])
+    download_file(get_pooled_session(), f"{server.url}/file.bin", fpath)
+    with open(fpath, "rb") as f:
+        assert f.read() == CONTENT
+    assert server.requests == [("/file.bin", "bytes=40000-")]
+    assert not os.path.exists(f"{fpath}.part")
+
+
+def test_download_file_restarts_if_range_is_ignored(server, tmp_path):
+    """Partial download is overwritten if server sends the full file."""
+    server.supports_range = False
+    fpath = str(tmp_path / "file.bin")
+    with open(f"{fpath}.part", "wb") as f:
+        f.write(b"stale")
+    download_file(get_pooled_session(), f"{server.url}/file.bin", fpath)
+    with open(fpath, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_download_file_completed_partial_download(server, tmp_path):
+    """Partial download holding the full file is not downloaded again."""
+    fpath = str(tmp_path / "file.bin")
+    with open(f"{fpath}.part", "wb") as f:
+        f.write(CONTENT)
+    download_file(get_pooled_session(), f"{server.url}/file.bin", fpath)
+    with open(fpath, "rb") as f:
+        assert f.read() == CONTENT
+
+
+def test_download_file_checksum(server, tmp_path):
+    """File with wrong checksum is removed instead of being kept."""
+    fpath = str(tmp_path / "file.bin")
+    url = f"{server.url}/file.bin"
+    with pytest.raises(ValueError, match="Checksum mismatch"):
+        download_file(get_pooled_session(), url, fpath, "0" * 64)
+    assert not os.path.exists(fpath)
+    assert not os.path.exists(f"{fpath}.part")
+    download_file(
+        get_pooled_session(), url, fpath, hashlib.sha256(CONTENT).hexdigest()
+    )
+    assert os.path.exists(fpath)
+
+
+def test_download_snapshots_concurrently(server, tmp_path, monkeypatch):
+    """Snapshots are downloaded at the same time and extracted."""
+    zip_filenames = [f"2022010100000{k}" for k in range(4)]
+    server.files = {f"/{z}.zip": get_zip_content(z) for z in zip_filenames}
+    server.delay = 0.2
+    monkeypatch.setattr(
+        download_helpers,
+        "get_snapshot_url",
+        lambda zip_fname: f"{server.url}/{zip_fname}.zip",
+    )
+    target_dirs = download_snapshots(zip_filenames, str(tmp_path), 4)
+    assert server.max_active > 1
+    for zip_fname, target_dir in zip(zip_filenames, target_dirs):
+        with open(os.path.join(target_dir, "dinesafe.xml")) as f:
+            assert zip_fname in f.read()
+        assert not os.path.exists(os.path.join(target_dir, "dinesafe.zip"))
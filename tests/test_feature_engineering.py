@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of vectorized per-establishment features of inspections."""
+
+# pylint: disable=invalid-name
+
+import numpy as np
+import pandas as pd
+
+from src.feature_engineering import (
+    ESTABLISHMENT_COLS,
+    INFRACTION_TYPES,
+    add_establishment_features,
+)
+
+ACTION_TYPES = ["action_null", "num_ticket"]
+COURT_OUTCOME_TYPES = ["court_outcome_null", "num_conviction_fined"]
+
+
+def get_inspections() -> pd.DataFrame:
+    """Get unsorted inspections of establishments sharing an ID."""
+    # fmt: off
+    rows = [
+        # Same establishment ID, at another address and of another type
+        (1, "Restaurant", "1 KING ST", "2020-03-01", "Pass", 1, 0, 0, 1,
+         0.0, 1, 0),
+        (1, "Restaurant", "5 BAY ST", "2020-02-01", "Closed", 0, 1, 2, 0,
+         1.0, 0, 1),
+        (1, "Restaurant", "1 KING ST", "2020-01-01", "Conditional Pass", 2,
+         1, 0, 0, 1.0, 1, 0),
+        (1, "Food Take Out", "1 KING ST", "2020-01-15", "Pass", 0, 0, 0, 1,
+         0.0, 1, 0),
+        (1, "Restaurant", "1 KING ST", "2020-05-01", "Closed", 0, 0, 1, 0,
+         np.nan, 0, 1),
+        (1, "Restaurant", "1 KING ST", "2020-09-01", "Pass", 1, 0, 0, 1,
+         0.0, 1, 0),
+        (1, "Restaurant", "1 KING ST", "2020-11-02", "Pass", 0, 0, 0, 1,
+         0.0, 1, 0),
+        (2, "Restaurant", "1 KING ST", "2021-01-04", "Pass", 0, 0, 0, 1,
+         0.0, 1, 0),
+        (2, "Restaurant", "1 KING ST", "2021-12-31", "Closed", 3, 2, 1, 0,
+         1.0, 0, 1),
+    ]
+    # fmt: on
+    df = pd.DataFrame(
+        rows,
+        columns=ESTABLISHMENT_COLS
+        + ["inspection_date", "establishment_status"]
+        + [f"num_{t}" for t in INFRACTION_TYPES]
+        + ACTION_TYPES
+        + COURT_OUTCOME_TYPES,
+    )
+    return df.assign(inspection_date=pd.to_datetime(df["inspection_date"]))
+
+
+def get_notebook_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Get features with grouped shift, cumsum and cumcount (notebook 7)."""
+    df = df.sort_values(
+        by=ESTABLISHMENT_COLS + ["inspection_date"], ignore_index=True
+    )
+    groups = df.groupby(ESTABLISHMENT_COLS)
+    df["time_since_last_infrac"] = groups["inspection_date"].diff(1).dt.days
+    last_status = groups["establishment_status"].shift()
+    df["last_pass"] = last_status == "Pass"
+    df["last_cond_pass"] = last_status == "Conditional Pass"
+    for t in INFRACTION_TYPES:
+        df[f"num_{t}_prev"] = groups[f"num_{t}"].shift()
+    prev_cols = []
+    for t in ACTION_TYPES:
+        prev_cols.append(f"num_{t.replace('num_', 'action_')}_prev")
+        df[prev_cols[-1]] = groups[t].shift()
+    for t in COURT_OUTCOME_TYPES:
+        prev_cols.append(f"num_{t.replace('num_', 'court_outcome_')}_prev")
+        df[prev_cols[-1]] = groups[t].shift()
+    groups = df.assign(is_fail=df["establishment_status"] == "Closed").groupby(
+        ESTABLISHMENT_COLS
+    )
+    df["cumulative_failures"] = groups["is_fail"].cumsum()
+    for t in INFRACTION_TYPES:
+        df[f"cumulative_{t}"] = groups[f"num_{t}"].cumsum()
+    for c in prev_cols:
+        df[f"cumulative_{c}"] = groups[c].cumsum()
+    df["ever_failed"] = df["cumulative_failures"] != 0
+    for t in INFRACTION_TYPES:
+        df[f"ever_{t}"] = df[f"cumulative_{t}"] > 0
+    df["cumulative_inspections"] = groups["inspection_date"].cumcount()
+    df["proportion_past_failures"] = (
+        df["cumulative_failures"] / df["cumulative_inspections"]
+    )
+    for t in INFRACTION_TYPES:
+        df[f"proportion_past_{t}"] = (
+            df[f"cumulative_{t}"] / df["cumulative_inspections"]
+        )
+    last_dates = groups["inspection_date"].shift()
+    df["days_since_last_inspection"] = (
+        last_dates - df["inspection_date"]
+    ).dt.days
+    for prefix, dates in [
+        ("last_inspection", last_dates),
+        ("inspection", df["inspection_date"]),
+    ]:
+        df[f"{prefix}_month"] = dates.dt.month
+        df[f"{prefix}_weekday"] = dates.dt.weekday
+        df[f"{prefix}_weekofyear"] = dates.dt.isocalendar().week
+        df[f"{prefix}_quarter"] = dates.dt.quarter
+        df[f"{prefix}_year"] = dates.dt.year
+    return df
+
+
+def test_add_establishment_features_matches_notebook():
+    """Vectorized features match grouped features of the notebook."""
+    df = get_inspections()
+    df_expected = get_notebook_features(df)
+    df_features = add_establishment_features(
+        df, ACTION_TYPES, COURT_OUTCOME_TYPES
+    )
+    assert sorted(df_features) == sorted(df_expected)
+    pd.testing.assert_frame_equal(
+        df_features[list(df_expected)], df_expected, check_dtype=False
+    )
+
+
+def test_add_establishment_features_segments():
+    """Features start again for each establishment, skipping missing lags."""
+    df_features = add_establishment_features(
+        get_inspections(), ACTION_TYPES, COURT_OUTCOME_TYPES
+    ).set_index("inspection_date")
+    # First row of each establishment (ID, type and address)
+    df_first = df_features.loc[
+        pd.to_datetime(
+            ["2020-01-15", "2020-01-01", "2020-02-01", "2021-01-04"]
+        )
+    ]
+    assert df_first["cumulative_inspections"].eq(0).all()
+    assert df_first["num_minor_prev"].isna().all()
+    assert df_first["cumulative_num_action_ticket_prev"].isna().all()
+    assert not df_first["last_pass"].any()
+    # Missing lag is kept as missing, but skipped by later running totals
+    np.testing.assert_array_equal(
+        df_features["cumulative_num_action_ticket_prev"].loc[
+            pd.to_datetime(
+                [
+                    "2020-01-01",
+                    "2020-03-01",
+                    "2020-05-01",
+                    "2020-09-01",
+                    "2020-11-02",
+                ]
+            )
+        ],
+        [np.nan, 1.0, 1.0, np.nan, 1.0],
+    )
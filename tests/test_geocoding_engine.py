@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of concurrent geocoding with a fake geocoding service."""
+
+# pylint: disable=invalid-name,wrong-import-position
+
+import pytest
+
+pytest.importorskip("geopy")
+
+from src.geocoding_engine import (  # noqa: E402
+    GeocodingProvider,
+    geocode_addresses,
+)
+
+
+class FakeProvider(GeocodingProvider):
+    """Geocoding service returning the same location for every address."""
+
+    def geocode(self, street_address):
+        """Geocode a single street address."""
+        return {"address": street_address, "latitude": 1.0}
+
+
+def test_provider_without_geocode():
+    """Provider not implementing geocode fails when it is created."""
+
+    class IncompleteProvider(GeocodingProvider):
+        """Geocoding service without a geocode method."""
+
+    with pytest.raises(TypeError):
+        IncompleteProvider()
+
+
+def test_geocode_addresses(tmp_path):
+    """Every address is geocoded once and saved to the checkpoint."""
+    addresses = [f"{k} KING ST W" for k in range(10)]
+    checkpoint_fpath = str(tmp_path / "checkpoint.jsonl")
+    records = list(
+        geocode_addresses(
+            addresses,
+            FakeProvider(),
+            requests_per_second=1_000,
+            checkpoint_fpath=checkpoint_fpath,
+        )
+    )
+    assert sorted(r["address"] for r in records) == sorted(addresses)
+    with open(checkpoint_fpath) as f:
+        assert len(f.readlines()) == len(addresses)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of incremental ingestion of infractions, using hashes of rows."""
+
+# pylint: disable=invalid-name,redefined-outer-name
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from src.ingestion_helpers import (
+    RowKeyIndex,
+    SeenKeys,
+    add_row_hashes,
+    check_row_keys,
+    delete_rows_by_key,
+    get_new_infractions,
+    hash_rows,
+)
+
+
+def get_snapshot(filename: int) -> pd.DataFrame:
+    """Get infractions of a snapshot, including identical infractions."""
+    return pd.DataFrame(
+        {
+            "row_id": [0, 1, 2],
+            "establishment_id": [1, 1, 2],
+            "inspection_id": [10, 10, 20],
+            "inspection_date": pd.to_datetime(["2020-01-01"] * 2 + [None]),
+            "infraction_details": ["Dirty floor", "Dirty floor", None],
+            "severity": ["M - Minor", "M - Minor", None],
+            "amount_fined": [np.nan, np.nan, 55.0],
+            "filename": filename,
+        }
+    )
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Get engine of a SQLite database with an empty infractions table."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'infractions.sqlite'}")
+    with engine.begin() as conn:
+        add_row_hashes(get_snapshot(1)).head(0).to_sql(
+            "inspections", conn, index=False
+        )
+    yield engine
+    engine.dispose()
+
+
+def test_hash_rows_stable_across_dtypes(tmp_path):
+    """Hashes do not change with compact dtypes or kinds of missing value."""
+    df = get_snapshot(1).drop(columns=["row_id"])
+    df_compact = df.assign(
+        establishment_id=df["establishment_id"].astype("int16"),
+        infraction_details=df["infraction_details"].astype("category"),
+        severity=df["severity"].astype("category"),
+        amount_fined=df["amount_fined"].astype("float32"),
+    )
+    df_nan = df.assign(severity=df["severity"].fillna(np.nan))
+    # Datetimes (and missing datetimes) are unchanged by a Parquet round trip
+    df_compact.to_parquet(tmp_path / "snapshot.parquet", index=False)
+    df_parquet = pd.read_parquet(tmp_path / "snapshot.parquet")
+    # Index is not hashed
+    df_parquet.index = df_parquet.index + 5
+    for df_other in [df_compact, df_nan, df_parquet]:
+        assert hash_rows(df_other).tolist() == hash_rows(df).tolist()
+    assert hash_rows(df).nunique() == 2
+    assert hash_rows(df.assign(amount_fined=1.0)).iloc[2] != (
+        hash_rows(df).iloc[2]
+    )
+
+
+def test_add_row_hashes_identical_infractions():
+    """Identical infractions of an inspection get different keys."""
+    df = add_row_hashes(get_snapshot(1))
+    assert df["row_key"].nunique() == 3
+    assert df["row_hash"].iloc[0] == df["row_hash"].iloc[1]
+    # Keys do not depend on the snapshot an infraction is found in
+    assert (
+        add_row_hashes(get_snapshot(2))["row_key"].tolist()
+        == df["row_key"].tolist()
+    )
+
+
+def test_seen_keys():
+    """Keys found in earlier snapshots are recognized."""
+    seen_keys = SeenKeys()
+    assert not seen_keys.isin(pd.Series([1, 2], dtype="int64")).any()
+    seen_keys.update(pd.Series([3, 1, 3], dtype="int64"))
+    seen_keys.update(pd.Series([-(2**63)], dtype="int64"))
+    assert seen_keys.isin(pd.Series([1, 2, 3, -(2**63)])).tolist() == [
+        True,
+        False,
+        True,
+        True,
+    ]
+    assert seen_keys.keys.tolist() == [-(2**63), 1, 3]
+
+
+def test_changed_infractions_are_replaced(engine, tmp_path):
+    """Changed infractions replace stored ones, and new ones are appended."""
+    index_dir = str(tmp_path / "index")
+    with engine.begin() as conn:
+        row_key_index = RowKeyIndex(conn, "inspections", index_dir)
+        df_new, changed_keys = get_new_infractions(
+            [get_snapshot(1)], row_key_index
+        )
+        assert len(df_new) == 3 and not changed_keys
+        df_new.to_sql("inspections", conn, index=False, if_exists="append")
+        row_key_index.update(df_new)
+
+    # Later snapshot changes the fine of an infraction and adds another
+    df_later = get_snapshot(2)
+    df_later.loc[2, "amount_fined"] = 100.0
+    df_later = pd.concat(
+        [
+            df_later,
+            get_snapshot(2).iloc[[0]].assign(row_id=3, inspection_id=11),
+        ],
+        ignore_index=True,
+    )
+    with engine.begin() as conn:
+        # Index is read from its file, instead of the table
+        row_key_index = RowKeyIndex(conn, "inspections", index_dir)
+        df_new, changed_keys = get_new_infractions([df_later], row_key_index)
+        assert sorted(df_new["inspection_id"]) == [11, 20]
+        assert (
+            changed_keys
+            == df_new.loc[df_new["inspection_id"] == 20, "row_key"].tolist()
+        )
+        delete_rows_by_key(conn, "inspections", changed_keys, chunksize=1)
+        df_new.to_sql("inspections", conn, index=False, if_exists="append")
+        row_key_index.update(df_new)
+        df = pd.read_sql(
+            "SELECT * FROM inspections ORDER BY inspection_id, row_id",
+            con=conn,
+        )
+    assert df["row_key"].is_unique
+    assert df["inspection_id"].tolist() == [10, 10, 11, 20]
+    assert df["amount_fined"].iloc[-1] == 100.0
+    assert df["filename"].tolist() == [1, 1, 2, 2]
+    assert len(row_key_index.row_hashes) == 4
+
+
+def test_check_row_keys(engine):
+    """Rows appended without keys prevent incremental ingestion."""
+    with engine.begin() as conn:
+        check_row_keys(conn, "inspections")
+        add_row_hashes(get_snapshot(1)).to_sql(
+            "inspections", conn, index=False, if_exists="append"
+        )
+        check_row_keys(conn, "inspections")
+        get_snapshot(2).to_sql(
+            "inspections", conn, index=False, if_exists="append"
+        )
+        with pytest.raises(ValueError, match="3 rows without a row_key"):
+            check_row_keys(conn, "inspections")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of filters of inspections in pandas and in the database."""
+
+# pylint: disable=invalid-name,wrong-import-position
+
+import pytest
+
+pytest.importorskip("prefect")
+
+from src.aggregation_helpers import INSPECTION_COLS  # noqa: E402
+from src.duckdb_backend import assert_backend_parity  # noqa: E402
+from src.workflow.workflow_utils import (  # noqa: E402
+    aggregate_inspections,
+    create_class_labels,
+    filter_inspections_in_database,
+    remove_multi_day_inspections,
+    remove_reinspections,
+)
+
+
+def filter_inspections(
+    uri: str, establishment_types_wanted, table_name: str = "inspections"
+):
+    """Aggregate infractions in database and filter inspections in pandas."""
+    df = aggregate_inspections.fn(uri, table_name, establishment_types_wanted)
+    df = remove_multi_day_inspections.fn(df)
+    df = remove_reinspections.fn(df)
+    return create_class_labels.fn(df)
+
+
+def test_filters_in_database_match_pandas(
+    sqlite_uri, establishment_types_wanted, tmp_path, monkeypatch
+):
+    """Filters pushed down into the database give the same inspections."""
+    # Categories of pivoted columns are cached in the working directory
+    monkeypatch.chdir(tmp_path)
+    df_inspections = filter_inspections(sqlite_uri, establishment_types_wanted)
+    df_filtered = filter_inspections_in_database.fn(
+        sqlite_uri, "inspections", establishment_types_wanted
+    )
+    assert_backend_parity(df_filtered, df_inspections, INSPECTION_COLS)
+    # Multi-day inspection and inspection re-inspected within 2 days are
+    # removed, and the other establishment at the same ID is kept
+    assert sorted(df_inspections["inspection_id"]) == [11, 12, 13, 21, 30]
+    labels = df_inspections.set_index("inspection_id")["is_infraction"]
+    assert labels.to_dict() == {11: 0, 12: 0, 13: 1, 21: 1, 30: 0}
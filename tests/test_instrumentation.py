@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of metrics of instrumented calls run in other processes."""
+
+# pylint: disable=invalid-name
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+from src.instrumentation import (
+    INSTRUMENTATION_SETTINGS,
+    add_metrics,
+    clear_metrics,
+    collect_metrics,
+    configure_instrumentation,
+    get_metrics,
+    instrument,
+)
+
+
+@instrument
+def double_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """Get DataFrame with each row repeated."""
+    return pd.concat([df, df])
+
+
+def run_in_worker(df: pd.DataFrame, settings: dict) -> dict:
+    """Run instrumented call as a worker process, with settings of parent."""
+    configure_instrumentation(**settings)
+    with collect_metrics() as metrics:
+        result = double_rows(df)
+    return {"result": result, "metrics": metrics, "pid": os.getpid()}
+
+
+@pytest.fixture(autouse=True)
+def restore_settings():
+    """Restore instrumentation settings and clear recorded metrics."""
+    settings = dict(INSTRUMENTATION_SETTINGS)
+    clear_metrics()
+    yield
+    configure_instrumentation(**settings)
+    clear_metrics()
+
+
+def test_collect_metrics_instead_of_recording():
+    """Collected metrics are only recorded once they are added."""
+    with collect_metrics() as metrics:
+        double_rows(pd.DataFrame({"a": [1, 2]}))
+    assert get_metrics().empty
+    assert [m["rows_out"] for m in metrics] == [4]
+    add_metrics(metrics)
+    assert get_metrics()["name"].tolist() == ["double_rows"]
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="worker processes are started with fork",
+)
+def test_metrics_of_worker_process(tmp_path):
+    """Metrics and profiles of calls in a worker process reach the parent."""
+    settings = dict(
+        INSTRUMENTATION_SETTINGS,
+        profile=True,
+        profile_dir=str(tmp_path),
+    )
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("fork")
+    ) as executor:
+        output = executor.submit(
+            run_in_worker, pd.DataFrame({"a": [1, 2, 3]}), settings
+        ).result()
+    assert output["pid"] != os.getpid()
+    # Settings of the parent are not changed by the worker
+    assert not INSTRUMENTATION_SETTINGS["profile"]
+    assert get_metrics().empty
+    add_metrics(output["metrics"])
+    df_metrics = get_metrics()
+    assert df_metrics["rows_out"].tolist() == [6]
+    assert os.path.exists(df_metrics["profile_fpath"].iloc[0])
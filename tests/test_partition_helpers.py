@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of processed snapshots stored as partitions of Parquet files."""
+
+# pylint: disable=invalid-name,import-outside-toplevel
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+
+from src.ingestion_helpers import OccurrenceCounts, add_row_hashes
+from src.partition_helpers import (
+    iter_partition,
+    read_partition,
+    write_partition,
+)
+from src.schema import INFRACTIONS_SCHEMA, apply_schema
+
+
+def get_batches(infractions: pd.DataFrame, batch_size: int = 3):
+    """Get processed batches of infractions, as read from a snapshot."""
+    # First batch has no court outcome, later batches have court outcomes
+    df = infractions.iloc[[0, 2, 4, 1, 3, 5, 6, 7, 8, 9]]
+    df = df.astype({"filename": "int64"})
+    for start, end in zip(
+        range(0, len(df), batch_size),
+        range(batch_size, len(df) + batch_size, batch_size),
+    ):
+        yield apply_schema(
+            df.iloc[start:end].reset_index(drop=True), INFRACTIONS_SCHEMA
+        )
+
+
+def test_partition_with_all_null_categories(infractions, tmp_path):
+    """Parts with only missing values of a category can be read together."""
+    batches = list(get_batches(infractions))
+    assert batches[0]["court_outcome"].isna().all()
+    assert batches[1]["court_outcome"].notna().any()
+    partition_dir = str(tmp_path / "20220101000000__v1")
+    metadata = write_partition(iter(batches), partition_dir, 20220101000000)
+    assert metadata["num_parts"] == len(batches)
+
+    df_expected = apply_schema(
+        pd.concat(batches, ignore_index=True).astype(
+            {"court_outcome": object, "action": object}
+        ),
+        INFRACTIONS_SCHEMA,
+    )
+    # Partition can also be read as a Parquet dataset
+    assert len(pd.read_parquet(partition_dir)) == len(infractions)
+    pd.testing.assert_frame_equal(read_partition(partition_dir), df_expected)
+    df_parts = list(iter_partition(partition_dir))
+    assert [len(df) for df in df_parts] == [len(df) for df in batches]
+    assert (
+        pd.concat(df_parts, ignore_index=True)["court_outcome"].tolist()
+        == df_expected["court_outcome"].tolist()
+    )
+
+
+def test_occurrence_counts_across_parts(infractions):
+    """Keys of infractions do not depend on how a snapshot is split."""
+    # Identical infractions of an inspection, in different parts
+    df = pd.concat([infractions.iloc[[2]]] * 4, ignore_index=True)
+    df = df.assign(row_id=range(len(df)))
+    occurrence_counts = OccurrenceCounts()
+    df_parts = pd.concat(
+        [
+            add_row_hashes(df.iloc[:3], occurrence_counts),
+            add_row_hashes(df.iloc[3:], occurrence_counts),
+        ],
+        ignore_index=True,
+    )
+    pd.testing.assert_frame_equal(df_parts, add_row_hashes(df))
+    assert df_parts["row_key"].is_unique
+
+
+def test_load_partitions_incrementally(infractions, tmp_path, monkeypatch):
+    """Parts of partitions are appended to the database one at a time."""
+    pytest.importorskip("prefect")
+    from src.workflow.workflow_utils import load
+
+    monkeypatch.chdir(tmp_path)
+    partition = write_partition(
+        get_batches(infractions),
+        str(tmp_path / "20220101000000__v1"),
+        20220101000000,
+    )
+    uri = f"sqlite:///{tmp_path / 'infractions.sqlite'}"
+    engine = create_engine(uri)
+    with engine.begin() as conn:
+        add_row_hashes(infractions).head(0).to_sql(
+            "inspections", conn, index=False
+        )
+    engine.dispose()
+    for _ in range(2):
+        filenames = load.fn(
+            [partition],
+            ["", uri, ""],
+            "inspections",
+            ingestion_mode="incremental",
+            storage_mode="partitioned",
+        )
+    engine = create_engine(uri)
+    with engine.connect() as conn:
+        df = pd.read_sql("SELECT * FROM inspections ORDER BY row_id", conn)
+    engine.dispose()
+    # Infractions are not appended again by the second run
+    assert filenames == [20220101000000]
+    assert df["row_id"].tolist() == sorted(infractions["row_id"])
+    assert df["row_key"].is_unique
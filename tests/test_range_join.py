@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of joins of time-varying attributes onto inspections."""
+
+# pylint: disable=invalid-name
+
+import numpy as np
+import pandas as pd
+
+from src.range_join import range_join
+
+PERIOD_STARTS = {2006: 2011, 2011: 2013, 2016: 2018}
+
+
+def test_range_join_matches_merges_by_period():
+    """Rows get attributes of their period, as with one merge per period."""
+    df = pd.DataFrame(
+        {
+            "location": ["a", "a", "b", "b", "a", "c"],
+            "year": [2009, 2011, 2013, 2017, 2020, 2014],
+        }
+    )
+    df_attrs = pd.DataFrame(
+        {
+            "location": ["a", "a", "a", "b", "b", "b"],
+            "census_year": [2006, 2011, 2016] * 2,
+            "pop": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        }
+    )
+    df_full = range_join(
+        df, df_attrs, ["location"], df["year"], PERIOD_STARTS, "census_year"
+    )
+    # Rows before the first period are dropped, while rows in a period
+    # without attributes are kept
+    dfs_by_period = [
+        df[df["year"].between(start, end)]
+        .assign(census_year=census_year)
+        .merge(df_attrs, on=["location", "census_year"], how="left")
+        for (census_year, start), end in zip(
+            PERIOD_STARTS.items(), [2012, 2017, np.inf]
+        )
+    ]
+    df_expected = (
+        pd.concat(dfs_by_period, ignore_index=True)
+        .sort_values(by="year", ignore_index=True)
+        .astype({"census_year": float})
+    )
+    pd.testing.assert_frame_equal(
+        df_full.sort_values(by="year", ignore_index=True), df_expected
+    )
+    assert 2009 not in set(df_full["year"])
+    assert df_full.query("location == 'c'")["pop"].isna().all()
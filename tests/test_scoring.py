@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+
+"""Tests of batch scoring of establishments."""
+
+# pylint: disable=invalid-name
+
+import numpy as np
+import pandas as pd
+import pytest
+from joblib import dump
+from sklearn.linear_model import LogisticRegression
+
+from src.scoring import iter_latest_rows, score_establishments
+
+
+def get_features() -> pd.DataFrame:
+    """Get features sorted by establishment and inspection date."""
+    return pd.DataFrame(
+        {
+            "establishment_id": [1, 1, 1, 2, 3, 3, 4],
+            "establishmenttype": ["A", "A", "A", "B", None, None, "B"],
+            "establishment_address": ["x", "x", "x", "y", None, None, "z"],
+            "inspection_date": pd.to_datetime(
+                [
+                    "2020-01-01",
+                    "2020-06-01",
+                    "2021-01-01",
+                    "2019-01-01",
+                    "2018-01-01",
+                    "2019-01-01",
+                    "2020-01-01",
+                ]
+            ),
+            "num_infractions": [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        }
+    )
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 3, 7])
+def test_iter_latest_rows(batch_size):
+    """Latest row of each establishment is found across chunks."""
+    df = get_features()
+    batches = [
+        df.iloc[start:end]
+        for start, end in zip(
+            range(0, len(df), batch_size),
+            range(batch_size, len(df) + batch_size, batch_size),
+        )
+    ]
+    df_latest = pd.concat(iter_latest_rows(iter(batches)))
+    # Establishment with missing type and address has a single latest row
+    assert df_latest["num_infractions"].tolist() == [2.0, 3.0, 5.0, 6.0]
+
+
+@pytest.mark.parametrize(
+    "order",
+    [
+        # Dates of an establishment out of order
+        [1, 0, 2, 3, 4, 5, 6],
+        # Rows of an establishment split by another establishment
+        [0, 1, 3, 2, 4, 5, 6],
+    ],
+)
+def test_iter_latest_rows_unsorted(order):
+    """Unsorted features raise an error, instead of wrong latest rows."""
+    df = get_features().iloc[order]
+    with pytest.raises(ValueError, match="must be sorted"):
+        list(iter_latest_rows(iter([df.iloc[:4], df.iloc[4:]])))
+
+
+def test_score_establishments_empty_features(tmp_path):
+    """Empty feature table gives no scores instead of an error."""
+    model = LogisticRegression().fit(
+        pd.DataFrame({"num_infractions": [0.0, 1.0, 2.0, 3.0]}),
+        np.array([0, 0, 1, 1]),
+    )
+    model_fpath = str(tmp_path / "trained_model__1.joblib")
+    dump(model, model_fpath)
+    features_fpath = str(tmp_path / "features.parquet")
+    get_features().head(0).to_parquet(features_fpath, index=False)
+    df_scores, stats = score_establishments(model_fpath, features_fpath)
+    assert df_scores.empty
+    assert "risk_rank" in list(df_scores)
+    assert stats["establishments_scored"] == 0
+
+
+def test_score_establishments_missing_features(tmp_path):
+    """Missing features of the model are listed before scoring."""
+    df = get_features().assign(Shape__Area=1.0)
+    model = LogisticRegression().fit(
+        df[["num_infractions", "Shape__Area"]], np.array([0, 1] * 3 + [0])
+    )
+    model_fpath = str(tmp_path / "trained_model__1.joblib")
+    dump(model, model_fpath)
+    for fname in ["features.parquet", "features.csv"]:
+        features_fpath = str(tmp_path / fname)
+        if fname.endswith(".parquet"):
+            get_features().to_parquet(features_fpath, index=False)
+        else:
+            get_features().to_csv(features_fpath, index=False)
+        with pytest.raises(ValueError, match="missing 1 columns.*Shape__Area"):
+            score_establishments(model_fpath, features_fpath)